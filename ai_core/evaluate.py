@@ -0,0 +1,213 @@
+"""
+分割评估工具 (Segmentation Evaluation)
+-------------------------------------
+在带标注的数据集上运行 ModelService 推理流水线，检查模型版本 / 推理模式 / 精度的分割质量：
+1. 数据集格式与 ai_core.predict 相同：图像目录 + --labels 标注目录，内存映射的 .npy + --npy-labels，
+   或旧版 [(图像, 标注), ...] 数据集 (--allow-pickle)。
+2. 逐张流式评估：解码在进程池中预取，推理返回全分辨率概率图，计算完指标即丢弃，
+   整个数据集不会同时驻留内存。ROC-AUC 通过概率直方图累积 (utils.seg_metrics)。
+3. 输出逐图报告 per_image.csv (Dice / IoU / 敏感度 / 特异度 / AUC) 与汇总报告 summary.json
+   (micro: 全部像素合并；macro: 逐图平均)，汇总中记录模型版本、后端、精度与推理模式。
+4. --compare 另一份 summary.json 时打印各指标差值，可用于比较模型版本或推理模式。
+
+用法:
+    python -m ai_core.evaluate --input data/images --labels data/labels --output eval/resize --mode resize
+    python -m ai_core.evaluate --input data/images --labels data/labels --output eval/tiled --mode tiled \\
+        --compare eval/resize/summary.json
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Tuple
+
+from ai_core.predict import collect_sources, load_item
+
+PER_IMAGE_FIELDS = ("name", "width", "height", "inference_mode", "dice", "iou", "sensitivity",
+                    "specificity", "auc", "seconds")
+COMPARE_METRICS = ("dice", "iou", "sensitivity", "specificity", "auc")
+
+
+def _fmt(value: float) -> str:
+    return "" if value is None or (isinstance(value, float) and math.isnan(value)) else f"{value:.6f}"
+
+
+def _json_safe(value: Any) -> Any:
+    """NaN 写成 null，保证 summary.json 是合法 JSON"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    return value
+
+
+async def evaluate(args, service) -> Dict[str, Any]:
+    from utils.seg_metrics import StreamingSegMetrics
+
+    # 每种 source 的最后一个元素都是标注 (路径或数组)
+    sources = [(name, src) for name, src in collect_sources(args) if src[-1] is not None]
+    if not sources:
+        raise SystemExit("❌ 没有带标注的样本 (目录模式需要 --labels，.npy 需要 --npy-labels)")
+
+    metrics = StreamingSegMetrics(threshold=args.threshold)
+    loop = asyncio.get_running_loop()
+    decode_pool = ProcessPoolExecutor(max_workers=args.decode_workers,
+                                      mp_context=multiprocessing.get_context("spawn"))
+    prefetch = asyncio.Semaphore(args.prefetch)
+    record_lock = asyncio.Lock()
+    modes = set()
+    skipped = 0
+    tasks = set()
+
+    per_image_file = open(os.path.join(args.output, "per_image.csv"), "w", encoding="utf-8", newline="")
+    writer = csv.DictWriter(per_image_file, fieldnames=PER_IMAGE_FIELDS)
+    writer.writeheader()
+
+    async def handle(name: str, source: Tuple[Any, ...]):
+        nonlocal skipped
+        try:
+            item_start = time.perf_counter()
+            if source[0] == "array":
+                image, label = load_item(source, args.channel_order)
+            else:
+                image, label = await loop.run_in_executor(decode_pool, load_item, source, args.channel_order)
+            if image is None or label is None:
+                skipped += 1
+                print(f"⚠️ 跳过 {name}: 图像或标注无法读取")
+                return
+
+            result = await service.predict(image, name, mode=args.mode, return_probs=True)
+            if result["status"] != "success":
+                raise RuntimeError(result.get("message"))
+            probs = result["probs"]
+            if label.shape != probs.shape:
+                import cv2
+                label = cv2.resize(label.astype("uint8"), (probs.shape[1], probs.shape[0]),
+                                   interpolation=cv2.INTER_NEAREST) > 0
+
+            # 指标计算 (含直方图累积) 放在线程池；累加器不是线程安全的，逐张串行更新
+            async with record_lock:
+                row = await loop.run_in_executor(None, metrics.update, probs, label)
+            modes.add(result.get("inference_mode"))
+            writer.writerow({
+                "name": name,
+                "width": probs.shape[1],
+                "height": probs.shape[0],
+                "inference_mode": result.get("inference_mode"),
+                **{key: _fmt(row[key]) for key in COMPARE_METRICS},
+                "seconds": f"{time.perf_counter() - item_start:.4f}",
+            })
+        except Exception as e:
+            skipped += 1
+            print(f"❌ {name}: {str(e)}")
+        finally:
+            prefetch.release()
+
+    start = time.perf_counter()
+    try:
+        for name, source in sources:
+            await prefetch.acquire()
+            task = asyncio.create_task(handle(name, source))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        decode_pool.shutdown(wait=True, cancel_futures=True)
+        per_image_file.close()
+    elapsed = time.perf_counter() - start
+
+    summary = metrics.summary()
+    summary.update({
+        "model_version": service.model_version,
+        "model_backend": service.model_backend,
+        "precision": service.precision,
+        "inference_mode": args.mode or "default",
+        "resolved_modes": sorted(m for m in modes if m),
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_sec": round(summary["images"] / elapsed, 3) if elapsed > 0 else 0.0,
+        "dataset": os.path.abspath(args.input),
+    })
+    return summary
+
+
+def print_comparison(summary: Dict[str, Any], baseline: Dict[str, Any]):
+    """逐项打印 (当前 - 基线) 差值"""
+    print(f"🔍 对比基线: {baseline.get('model_version')} / {baseline.get('precision')} / "
+          f"{baseline.get('inference_mode')}")
+    for scope in ("micro", "macro"):
+        for name in COMPARE_METRICS:
+            current = summary[scope].get(name)
+            base = (baseline.get(scope) or {}).get(name)
+            if current is None or base is None or math.isnan(current):
+                continue
+            print(f"   {scope:5s} {name:12s} {base:.4f} -> {current:.4f} ({current - base:+.4f})")
+    if baseline.get("images_per_sec"):
+        print(f"   吞吐量 {baseline['images_per_sec']:.2f} -> {summary['images_per_sec']:.2f} images/sec")
+
+
+async def _main(args):
+    from core.config import settings
+
+    settings.BATCH_MAX_SIZE = args.batch_size
+    settings.INFERENCE_MAX_QUEUE = max(settings.INFERENCE_MAX_QUEUE, args.prefetch)
+    if args.precision:
+        settings.MODEL_DEFAULT_PRECISION = args.precision
+        settings.MODEL_PRECISION_BY_VERSION = {}
+
+    from services.model_service import ModelService
+
+    service = ModelService()
+    if not await service.load_model(settings.MODEL_PATH):
+        raise SystemExit("❌ 模型加载失败")
+    try:
+        summary = await evaluate(args, service)
+    finally:
+        await service.shutdown()
+
+    with open(os.path.join(args.output, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(_json_safe(summary), f, indent=2, ensure_ascii=False)
+
+    micro, macro = summary["micro"], summary["macro"]
+    print(f"✅ 评估完成: {summary['images']} 张 (跳过 {summary['skipped']}), "
+          f"{summary['images_per_sec']:.2f} images/sec")
+    print(f"   micro: Dice={micro['dice']:.4f} IoU={micro['iou']:.4f} Se={micro['sensitivity']:.4f} "
+          f"Sp={micro['specificity']:.4f} AUC={micro['auc']:.4f}")
+    print(f"   macro: Dice={macro['dice']:.4f} IoU={macro['iou']:.4f} AUC={macro['auc']:.4f}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print_comparison(_json_safe(summary), baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="U-Net 分割质量评估 (Dice / IoU / Se / Sp / ROC-AUC)")
+    parser.add_argument("--input", required=True, help="图像目录或 .npy 数据集")
+    parser.add_argument("--labels", help="标注目录 (与图像同名)")
+    parser.add_argument("--npy-labels", help="与 .npy 数据集一一对应的标注数组")
+    parser.add_argument("--output", required=True, help="报告输出目录 (per_image.csv, summary.json)")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--allow-pickle", action="store_true", help="读取旧版 [(图像, 标注), ...] 数据集")
+    parser.add_argument("--channel-order", choices=("rgb", "bgr"), default="rgb")
+    parser.add_argument("--mode", choices=("resize", "tiled", "auto"), default=None, help="推理模式")
+    parser.add_argument("--precision", choices=("fp32", "int8", "bf16"), default=None)
+    parser.add_argument("--threshold", type=float, default=0.5, help="二值化阈值")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--prefetch", type=int, default=16)
+    parser.add_argument("--compare", help="用于对比的另一份 summary.json")
+    args = parser.parse_args()
+    args.prefetch = max(args.prefetch, args.batch_size)
+
+    os.makedirs(args.output, exist_ok=True)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
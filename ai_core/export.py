@@ -0,0 +1,106 @@
+"""
+模型导出工具 (TorchScript / Frozen Graph Export)
+-----------------------------------------------
+把 pickle 保存的完整 U-Net (bestmodel.pt) 导出为冻结的 TorchScript 计算图：
+1. Conv + BatchNorm 折叠：Conv 块中每个 Conv2d 后紧跟的 BatchNorm2d 被合并进卷积权重，BN 替换为 Identity。
+2. torch.jit.trace 得到静态图，再用 torch.jit.freeze 把参数内联为常量并做常量折叠。
+3. 校验导出前后输出一致，保存为 <checkpoint>.frozen.pt。
+ModelService.load_model 在该文件存在且比原始权重新时优先加载它。
+
+用法:
+    python -m ai_core.export [--checkpoint ai_core/bestmodel.pt] [--output ...] [--size 512]
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+AI_CORE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# 冻结模型文件的后缀
+FROZEN_SUFFIX = ".frozen.pt"
+
+
+def optimized_model_path(checkpoint_path: str) -> str:
+    """原始权重对应的冻结模型路径：bestmodel.pt -> bestmodel.frozen.pt"""
+    root, _ = os.path.splitext(checkpoint_path)
+    return root + FROZEN_SUFFIX
+
+
+def load_checkpoint(checkpoint_path: str, map_location="cpu") -> torch.nn.Module:
+    """加载 pickle 保存的完整模型 (需要 ai_core 在 sys.path 中以便找到 Unet 模块)"""
+    if AI_CORE_PATH not in sys.path:
+        sys.path.append(AI_CORE_PATH)
+    model = torch.load(checkpoint_path, map_location=map_location, weights_only=False)
+    model.eval()
+    return model
+
+
+def fold_conv_bn(model: torch.nn.Module) -> int:
+    """
+    原地把 Sequential 中「Conv2d -> BatchNorm2d」相邻对折叠为单个 Conv2d
+    模型必须处于 eval 模式 (使用 BN 的运行统计量)。返回折叠的层数。
+    """
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+    folded = 0
+    for module in model.modules():
+        if not isinstance(module, torch.nn.Sequential):
+            continue
+        names = list(module._modules.keys())
+        for conv_name, bn_name in zip(names, names[1:]):
+            conv = module._modules[conv_name]
+            bn = module._modules[bn_name]
+            if isinstance(conv, torch.nn.Conv2d) and isinstance(bn, torch.nn.BatchNorm2d):
+                module._modules[conv_name] = fuse_conv_bn_eval(conv, bn)
+                module._modules[bn_name] = torch.nn.Identity()
+                folded += 1
+    return folded
+
+
+def export_frozen(model: torch.nn.Module, example: torch.Tensor) -> torch.jit.ScriptModule:
+    """折叠 BN 后 trace 并冻结 (会原地修改 model)"""
+    folded = fold_conv_bn(model)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced.eval())
+    print(f"🧩 已折叠 Conv+BN: {folded} 层")
+    return frozen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出冻结的 TorchScript U-Net")
+    parser.add_argument("--checkpoint", default=os.path.join(AI_CORE_PATH, "bestmodel.pt"))
+    parser.add_argument("--output", help="输出路径，默认 <checkpoint>.frozen.pt")
+    parser.add_argument("--size", type=int, default=512, help="trace 时的输入边长")
+    args = parser.parse_args()
+
+    output = args.output or optimized_model_path(args.checkpoint)
+
+    print(f"🔧 加载原始模型: {args.checkpoint}")
+    eager = load_checkpoint(args.checkpoint)
+    example = torch.rand(1, 3, args.size, args.size)
+    with torch.no_grad():
+        reference = eager(example)
+
+    start = time.perf_counter()
+    frozen = export_frozen(load_checkpoint(args.checkpoint), example)
+    print(f"⏱️ 导出耗时 {time.perf_counter() - start:.2f}s")
+
+    # 校验：单张与批量输入的输出都应与原模型一致
+    with torch.no_grad():
+        max_diff = (frozen(example) - reference).abs().max().item()
+        batch = torch.rand(2, 3, args.size, args.size)
+        batch_diff = (frozen(batch) - eager(batch)).abs().max().item()
+    print(f"🔍 输出最大误差: {max_diff:.2e} (batch=2: {batch_diff:.2e})")
+    if max(max_diff, batch_diff) > 1e-3:
+        raise SystemExit("❌ 导出模型与原模型输出差异过大，已放弃保存")
+
+    torch.jit.save(frozen, output)
+    print(f"✅ 已保存冻结模型: {output}")
+
+
+if __name__ == "__main__":
+    main()
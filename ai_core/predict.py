@@ -1,19 +1,338 @@
-import torch
-import numpy as np
+"""
+离线批量分割工具 (Offline Bulk Segmentation)
+-------------------------------------------
+对整个图像目录或 .npy 数据集做血管分割，输出掩码 PNG 与逐图指标 CSV：
+1. 输入：图像目录 (可递归)，或内存映射 (mmap) 打开的 .npy 数组 (N, H, W, 3) / (N, 3, H, W)；
+   旧版 allow_pickle 的 [(图像, 标注), ...] 数据集需显式加 --allow-pickle (整体载入内存)。
+2. 解码在进程池中进行，最多预取 --prefetch 张图像，解码与推理重叠执行。
+3. 推理走与 API 相同的 ModelService 路径 (预处理、微批调度、分块推理、后处理)，
+   并发请求由微批调度器合并为 --batch-size 的批次。
+4. 可断点续跑：每张图像完成后追加到 manifest.txt，重新运行时跳过其中已完成的图像。
+5. 提供标注 (--labels 目录或 --npy-labels) 时额外计算 Dice / IoU；结束时报告吞吐量 (images/sec)。
+
+用法:
+    python -m ai_core.predict --input data/images --output out/ [--labels data/labels] [--mode auto]
+    python -m ai_core.predict --input pre/testdataset.npy --output out/ [--npy-labels pre/labels.npy]
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
 import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".gif", ".bmp")
+MANIFEST_NAME = "manifest.txt"
+METRICS_NAME = "metrics.csv"
+METRICS_FIELDS = ("name", "width", "height", "inference_mode", "confidence", "vessel_coverage",
+                  "dice", "iou", "seconds")
+
+logger = logging.getLogger("ai_core.predict")
+
+
+# ----------------------------------------------------------------------
+# 数据源 (在解码子进程中执行)
+# ----------------------------------------------------------------------
+_npy_cache: Dict[str, np.ndarray] = {}
+
+
+def _open_npy(path: str) -> np.ndarray:
+    """每个子进程只打开一次内存映射"""
+    arr = _npy_cache.get(path)
+    if arr is None:
+        arr = _npy_cache[path] = np.load(path, mmap_mode="r")
+    return arr
+
+
+def to_bgr_uint8(arr: np.ndarray, channel_order: str = "rgb") -> np.ndarray:
+    """把数据集中的单张图像转换为服务使用的 (H, W, 3) uint8 BGR"""
+    arr = np.asarray(arr)
+    if arr.ndim == 3 and arr.shape[0] in (1, 3) and arr.shape[-1] not in (1, 3):
+        arr = arr.transpose(1, 2, 0)
+    if arr.ndim == 3 and arr.shape[-1] == 1:
+        arr = arr[:, :, 0]
+    if arr.dtype != np.uint8:
+        # 模型预处理本身是 Min-Max 归一化，线性拉伸到 0-255 不改变模型输入
+        arr = arr.astype(np.float32)
+        lo, hi = float(arr.min()), float(arr.max())
+        arr = ((arr - lo) * (255.0 / (hi - lo)) if hi > lo else np.zeros_like(arr)).astype(np.uint8)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+    if channel_order == "rgb":
+        return cv2.cvtColor(np.ascontiguousarray(arr), cv2.COLOR_RGB2BGR)
+    return np.ascontiguousarray(arr)
+
+
+def to_label_mask(arr: np.ndarray) -> np.ndarray:
+    """标注转换为 (H, W) bool"""
+    arr = np.squeeze(np.asarray(arr))
+    if arr.ndim == 3:
+        arr = arr[:, :, 0] if arr.shape[-1] in (3, 4) else arr[0]
+    return arr > (0.5 if arr.dtype.kind == "f" else 0)
+
+
+def _read_file_image(path: str) -> Optional[np.ndarray]:
+    from utils.image_utils import bytes_to_image
+
+    with open(path, "rb") as f:
+        return bytes_to_image(f.read())
+
+
+def load_item(source: Tuple[Any, ...], channel_order: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    读取并解码单个样本，返回 (BGR 图像, 标注掩码或 None)
+    source: ("file", 图像路径, 标注路径) / ("npy", 路径, 下标, 标注路径) / ("array", 图像, 标注)
+    """
+    kind = source[0]
+    label = None
+    if kind == "file":
+        _, path, label_path = source
+        image = _read_file_image(path)
+        if label_path:
+            label_image = _read_file_image(label_path)
+            label = to_label_mask(label_image) if label_image is not None else None
+    elif kind == "npy":
+        _, path, index, label_path = source
+        image = to_bgr_uint8(_open_npy(path)[index], channel_order)
+        if label_path:
+            label = to_label_mask(_open_npy(label_path)[index])
+    else:
+        _, data, label_data = source
+        image = to_bgr_uint8(data, channel_order)
+        label = to_label_mask(label_data) if label_data is not None else None
+    return image, label
+
+
+# ----------------------------------------------------------------------
+# 任务清单
+# ----------------------------------------------------------------------
+def _find_label(labels_dir: str, rel_path: str) -> Optional[str]:
+    stem = os.path.splitext(rel_path)[0]
+    for ext in IMAGE_EXTENSIONS:
+        candidate = os.path.join(labels_dir, stem + ext)
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def collect_sources(args) -> List[Tuple[str, Tuple[Any, ...]]]:
+    """列出全部样本：[(名称, source)]，名称同时决定掩码的输出路径"""
+    if os.path.isdir(args.input):
+        rel_paths = []
+        for root, dirs, files in os.walk(args.input):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    rel_paths.append(os.path.relpath(os.path.join(root, name), args.input))
+            if not args.recursive:
+                break
+        return [
+            (os.path.splitext(rel)[0],
+             ("file", os.path.join(args.input, rel), _find_label(args.labels, rel) if args.labels else None))
+            for rel in rel_paths
+        ]
+
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+    if args.allow_pickle:
+        # 旧版数据集：对象数组 [(图像, 标注), ...]，无法内存映射，只能整体载入
+        dataset = np.load(args.input, allow_pickle=True)
+        return [(f"{stem}_{i:05d}", _legacy_source(entry)) for i, entry in enumerate(dataset)]
+
+    count = len(np.load(args.input, mmap_mode="r"))
+    return [(f"{stem}_{i:05d}", ("npy", args.input, i, args.npy_labels)) for i in range(count)]
+
+
+def _legacy_source(entry) -> Tuple[Any, ...]:
+    """旧版条目为 (图像, 标注) 对；否则整条视为图像"""
+    is_pair = isinstance(entry, (tuple, list)) or (isinstance(entry, np.ndarray) and entry.dtype == object)
+    if is_pair and len(entry) == 2:
+        return ("array", entry[0], entry[1])
+    return ("array", entry, None)
+
+
+def read_manifest(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+# ----------------------------------------------------------------------
+# 批量推理
+# ----------------------------------------------------------------------
+class BulkRunner:
+    def __init__(self, args, service):
+        self.args = args
+        self.service = service
+        self.mask_dir = os.path.join(args.output, "masks")
+        os.makedirs(self.mask_dir, exist_ok=True)
+
+        manifest_path = os.path.join(args.output, MANIFEST_NAME)
+        metrics_path = os.path.join(args.output, METRICS_NAME)
+        self.done = read_manifest(manifest_path)
+        self.manifest = open(manifest_path, "a", encoding="utf-8")
+        new_csv = not os.path.exists(metrics_path) or os.path.getsize(metrics_path) == 0
+        self.metrics_file = open(metrics_path, "a", encoding="utf-8", newline="")
+        self.metrics = csv.DictWriter(self.metrics_file, fieldnames=METRICS_FIELDS)
+        if new_csv:
+            self.metrics.writeheader()
+
+        self.completed = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def close(self):
+        self.manifest.close()
+        self.metrics_file.close()
+
+    def _record(self, name: str, result: Dict[str, Any], label: Optional[np.ndarray], seconds: float):
+        """写掩码、指标行与 manifest (manifest 最后写，保证记录在案的图像输出完整)"""
+        from utils.seg_metrics import dice_score, iou_score
+
+        mask_path = os.path.join(self.mask_dir, name + ".png")
+        os.makedirs(os.path.dirname(mask_path), exist_ok=True)
+        with open(mask_path, "wb") as f:
+            f.write(result["mask_png"])
+
+        mask = result["mask"]
+        dice = iou = None
+        if label is not None:
+            if label.shape != mask.shape:
+                label = cv2.resize(label.astype(np.uint8), (mask.shape[1], mask.shape[0]),
+                                   interpolation=cv2.INTER_NEAREST) > 0
+            dice, iou = dice_score(mask, label), iou_score(mask, label)
+
+        self.metrics.writerow({
+            "name": name,
+            "width": mask.shape[1],
+            "height": mask.shape[0],
+            "inference_mode": result.get("inference_mode"),
+            "confidence": f"{result['confidence']:.6f}",
+            "vessel_coverage": f"{result['vessel_coverage']:.6f}",
+            "dice": "" if dice is None else f"{dice:.6f}",
+            "iou": "" if iou is None else f"{iou:.6f}",
+            "seconds": f"{seconds:.4f}",
+        })
+        self.metrics_file.flush()
+        self.manifest.write(name + "\n")
+        self.manifest.flush()
+
+    def _report(self, total: int, final: bool = False):
+        elapsed = time.perf_counter() - self.start
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        prefix = "✅ 完成" if final else "⏳ 进度"
+        print(f"{prefix}: {self.completed}/{total} 张 (失败 {self.failed}), "
+              f"{elapsed:.1f}s, {rate:.2f} images/sec", flush=True)
+
+    async def run(self, sources: List[Tuple[str, Tuple[Any, ...]]]):
+        args = self.args
+        todo = [(name, src) for name, src in sources if name not in self.done]
+        print(f"🔧 共 {len(sources)} 张，已完成 {len(sources) - len(todo)} 张，本次处理 {len(todo)} 张")
+        if not todo:
+            return
+
+        loop = asyncio.get_running_loop()
+        # spawn：父进程已加载 torch 并启动了推理线程，fork 不安全
+        decode_pool = ProcessPoolExecutor(max_workers=args.decode_workers,
+                                          mp_context=multiprocessing.get_context("spawn"))
+        prefetch = asyncio.Semaphore(args.prefetch)
+        record_lock = asyncio.Lock()
+        tasks = set()
+
+        async def handle(name: str, source: Tuple[Any, ...]):
+            try:
+                item_start = time.perf_counter()
+                if source[0] == "array":
+                    image, label = load_item(source, args.channel_order)
+                else:
+                    image, label = await loop.run_in_executor(decode_pool, load_item, source, args.channel_order)
+                if image is None:
+                    raise ValueError("无法解码图像")
+
+                result = await self.service.predict(image, name, mode=args.mode)
+                if result["status"] != "success":
+                    raise RuntimeError(result.get("message"))
+
+                async with record_lock:
+                    await loop.run_in_executor(None, self._record, name, result, label,
+                                               time.perf_counter() - item_start)
+                self.completed += 1
+                if self.completed % args.report_every == 0:
+                    self._report(len(todo))
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ {name}: {str(e)}")
+            finally:
+                prefetch.release()
+
+        try:
+            for name, source in todo:
+                # 最多 prefetch 张图像处于「已解码或解码中」状态，限制内存占用
+                await prefetch.acquire()
+                task = asyncio.create_task(handle(name, source))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            decode_pool.shutdown(wait=True, cancel_futures=True)
+            self._report(len(todo), final=True)
+
+
+async def _main(args):
+    from core.config import settings
+
+    # 在创建 ModelService 之前覆盖批处理相关配置
+    settings.BATCH_ENABLED = True
+    settings.BATCH_MAX_SIZE = args.batch_size
+    settings.INFERENCE_MAX_QUEUE = max(settings.INFERENCE_MAX_QUEUE, args.prefetch)
+    if args.precision:
+        settings.MODEL_DEFAULT_PRECISION = args.precision
+        settings.MODEL_PRECISION_BY_VERSION = {}
+
+    from services.model_service import ModelService
 
+    service = ModelService()
+    if not await service.load_model(settings.MODEL_PATH):
+        raise SystemExit("❌ 模型加载失败")
+    print(f"🧠 模型后端: {service.model_backend}, 精度: {service.precision}, 批大小: {args.batch_size}")
 
-dataset = np.load('pre/testdataset.npy', allow_pickle=True)
+    runner = BulkRunner(args, service)
+    try:
+        await runner.run(collect_sources(args))
+    finally:
+        runner.close()
+        await service.shutdown()
 
 
-data = dataset[0][0]
-label = dataset[0][1]
+def main():
+    parser = argparse.ArgumentParser(description="U-Net 离线批量血管分割")
+    parser.add_argument("--input", required=True, help="图像目录或 .npy 数据集")
+    parser.add_argument("--output", required=True, help="输出目录 (masks/, metrics.csv, manifest.txt)")
+    parser.add_argument("--labels", help="标注目录 (与图像同名，任意图像扩展名)")
+    parser.add_argument("--npy-labels", help="与 .npy 数据集一一对应的标注数组")
+    parser.add_argument("--recursive", action="store_true", help="递归扫描子目录")
+    parser.add_argument("--allow-pickle", action="store_true", help="读取旧版对象数组数据集 (整体载入内存)")
+    parser.add_argument("--channel-order", choices=("rgb", "bgr"), default="rgb", help=".npy 中图像的通道顺序")
+    parser.add_argument("--mode", choices=("resize", "tiled", "auto"), default=None, help="推理模式")
+    parser.add_argument("--precision", choices=("fp32", "int8", "bf16"), default=None)
+    parser.add_argument("--batch-size", type=int, default=8, help="微批大小")
+    parser.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="解码进程数")
+    parser.add_argument("--prefetch", type=int, default=32, help="最多同时在途 (解码 + 推理) 的图像数")
+    parser.add_argument("--report-every", type=int, default=50, help="每完成多少张打印一次吞吐量")
+    args = parser.parse_args()
+    args.prefetch = max(args.prefetch, args.batch_size)
 
-model = torch.load('model/bestmodel.pt').cpu()
-# model = torch.load('训练好的模型权重/lastmosel.pt').cpu()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    os.makedirs(args.output, exist_ok=True)
+    asyncio.run(_main(args))
 
-output = model(torch.Tensor(data.reshape(1,3,data.shape[-2],data.shape[-1]))).detach().numpy()
 
-cv2.imshow('label',label[0])
-cv2.imshow('output',output[0][0])
-cv2.waitKey()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+量化推理工具 (CPU int8 / bf16 Quantization)
+------------------------------------------
+服务只运行在 CPU 上 (Dockerfile 安装的是 CPU 版 torch)，U-Net 约 3100 万参数。本工具提供两种低精度模式：
+1. int8: FX 图模式静态量化。先折叠 Conv+BN，再用样例图像 (默认 frontend_demo/demo_images) 标定激活范围，
+   转换后 trace 保存为 <checkpoint>.int8.pt (TorchScript)。
+2. bf16: 运行时 torch.autocast(cpu, bfloat16)，无需导出文件，需 CPU 支持 AVX512-BF16/AMX 才有明显收益。
+两种模式都会做精度一致性检查：在样例图像上比较量化输出与 fp32 输出的二值掩码 (Dice / IoU)，
+据此决定是否为某个模型版本开启 (settings.MODEL_PRECISION_BY_VERSION)。
+
+用法:
+    python -m ai_core.quantize --mode int8 [--calibration-dir frontend_demo/demo_images] [--report report.json]
+    python -m ai_core.quantize --mode bf16
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, Iterable, List
+
+import cv2
+import numpy as np
+import torch
+
+from ai_core.export import AI_CORE_PATH, fold_conv_bn, load_checkpoint
+
+# 支持的推理精度
+PRECISIONS = ("fp32", "int8", "bf16")
+
+# int8 模型文件的后缀
+INT8_SUFFIX = ".int8.pt"
+
+DEFAULT_CALIBRATION_DIR = os.path.join(AI_CORE_PATH, "..", "frontend_demo", "demo_images")
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.tif", "*.tiff", "*.gif")
+
+
+def int8_model_path(checkpoint_path: str) -> str:
+    """原始权重对应的 int8 模型路径：bestmodel.pt -> bestmodel.int8.pt"""
+    root, _ = os.path.splitext(checkpoint_path)
+    return root + INT8_SUFFIX
+
+
+def load_calibration_inputs(directory: str, input_size=(512, 512)) -> List[torch.Tensor]:
+    """读取目录中的样例图像，使用与服务一致的预处理，返回 (1, 3, H, W) 张量列表"""
+    from services.preprocessing import Preprocessor
+
+    preprocessor = Preprocessor(input_size=input_size)
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    inputs = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        inputs.append(torch.from_numpy(preprocessor.preprocess(image)).unsqueeze(0))
+    if not inputs:
+        raise SystemExit(f"❌ 标定目录中没有可用图像: {directory}")
+    return inputs
+
+
+def quantize_int8(model: torch.nn.Module, calibration: Iterable[torch.Tensor],
+                  backend: str = "x86") -> torch.nn.Module:
+    """FX 静态量化：折叠 Conv+BN -> 插入观察器 -> 标定 -> 转换为 int8"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    model = model.eval()
+    fold_conv_bn(model)
+
+    calibration = list(calibration)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=(calibration[0],))
+    with torch.no_grad():
+        for batch in calibration:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def parity_report(reference: torch.nn.Module, candidate: torch.nn.Module,
+                  inputs: List[torch.Tensor], bf16: bool = False) -> Dict[str, float]:
+    """比较 candidate 与 fp32 reference 在样例上的掩码一致性与延迟"""
+    from services.model_service import vessel_probabilities
+    from utils.seg_metrics import dice_score, iou_score
+
+    dices, ious, ref_ms, cand_ms = [], [], [], []
+    with torch.no_grad():
+        for batch in inputs:
+            start = time.perf_counter()
+            ref = vessel_probabilities(reference(batch))
+            ref_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            if bf16:
+                with torch.autocast("cpu", dtype=torch.bfloat16):
+                    out = candidate(batch)
+            else:
+                out = candidate(batch)
+            cand = vessel_probabilities(out)
+            cand_ms.append((time.perf_counter() - start) * 1000)
+
+            for r, c in zip(ref, cand):
+                dices.append(dice_score(c > 0.5, r > 0.5))
+                ious.append(iou_score(c > 0.5, r > 0.5))
+
+    return {
+        "images": len(dices),
+        "dice_mean": float(np.mean(dices)),
+        "dice_min": float(np.min(dices)),
+        "iou_mean": float(np.mean(ious)),
+        "iou_min": float(np.min(ious)),
+        "fp32_ms": float(np.median(ref_ms)),
+        "candidate_ms": float(np.median(cand_ms)),
+        "speedup": float(np.median(ref_ms) / np.median(cand_ms)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="U-Net CPU 量化与精度一致性检查")
+    parser.add_argument("--mode", choices=("int8", "bf16"), default="int8")
+    parser.add_argument("--checkpoint", default=os.path.join(AI_CORE_PATH, "bestmodel.pt"))
+    parser.add_argument("--calibration-dir", default=DEFAULT_CALIBRATION_DIR)
+    parser.add_argument("--eval-dir", help="一致性检查使用的图像目录，默认与标定目录相同")
+    parser.add_argument("--output", help="int8 模型输出路径，默认 <checkpoint>.int8.pt")
+    parser.add_argument("--backend", default="x86", help="量化后端 (x86 / fbgemm / qnnpack)")
+    parser.add_argument("--min-dice", type=float, default=0.95, help="低于该 Dice 时不保存 int8 模型")
+    parser.add_argument("--report", help="一致性报告输出为 JSON 文件")
+    args = parser.parse_args()
+
+    reference = load_checkpoint(args.checkpoint)
+    calibration = load_calibration_inputs(args.calibration_dir)
+    eval_inputs = load_calibration_inputs(args.eval_dir) if args.eval_dir else calibration
+    print(f"🔧 标定图像 {len(calibration)} 张, 评估图像 {len(eval_inputs)} 张")
+
+    if args.mode == "int8":
+        quantized = quantize_int8(load_checkpoint(args.checkpoint), calibration, backend=args.backend)
+        candidate = torch.jit.freeze(torch.jit.trace(quantized, calibration[0]).eval())
+        report = parity_report(reference, candidate, eval_inputs)
+    else:
+        report = parity_report(reference, load_checkpoint(args.checkpoint), eval_inputs, bf16=True)
+
+    report["mode"] = args.mode
+    print(f"🔍 {args.mode} vs fp32: Dice={report['dice_mean']:.4f} (min {report['dice_min']:.4f}), "
+          f"IoU={report['iou_mean']:.4f} (min {report['iou_min']:.4f}), "
+          f"{report['fp32_ms']:.1f} ms -> {report['candidate_ms']:.1f} ms (x{report['speedup']:.2f})")
+
+    if args.mode == "int8":
+        if report["dice_min"] < args.min_dice:
+            print(f"❌ 最低 Dice 低于阈值 {args.min_dice}，未保存 int8 模型")
+        else:
+            output = args.output or int8_model_path(args.checkpoint)
+            torch.jit.save(candidate, output)
+            report["output"] = output
+            print(f"✅ 已保存 int8 模型: {output}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
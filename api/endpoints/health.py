@@ -1,9 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from typing import Optional
 from datetime import datetime
 import logging
-import psutil
-import os
+
+from services.system_monitor import system_monitor
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -36,25 +38,29 @@ class SystemStatsResponse(BaseModel):
     disk_usage: float
     active_connections: int
     boot_time: str
+    timestamp: Optional[str] = None
+    process_rss_mb: Optional[float] = None
+    process_cpu_percent: Optional[float] = None
+    process_threads: Optional[int] = None
+    torch_threads: Optional[int] = None
+    inference_pending: Optional[int] = None
+    inference_max_queue: Optional[int] = None
+    batch_queue_depth: Optional[int] = None
+    model_loaded: Optional[bool] = None
+    mongo_reachable: Optional[bool] = None
+    mongo_latency_ms: Optional[float] = None
 
 
 # 服务启动时间
 startup_time = datetime.now()
 
 
-def get_system_stats() -> dict:
-    """获取系统统计信息"""
-    try:
-        return {
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
-            "memory_percent": psutil.virtual_memory().percent,
-            "disk_usage": psutil.disk_usage('/').percent,
-            "active_connections": len(psutil.net_connections()),
-            "boot_time": datetime.fromtimestamp(psutil.boot_time()).isoformat()
-        }
-    except Exception as e:
-        logger.error(f"获取系统统计失败: {str(e)}")
-        return {}
+async def get_system_stats() -> dict:
+    """获取系统统计信息 (后台采样的缓存快照；监控尚未采样时现场采样一次)"""
+    stats = system_monitor.snapshot()
+    if not stats:
+        stats = await system_monitor.refresh()
+    return stats
 
 
 @router.get("/", response_model=HealthResponse)
@@ -98,11 +104,26 @@ async def health_check():
     )
 
 
+@router.get("/health/live")
+async def liveness():
+    """存活探针：事件循环能响应即存活，不检查任何依赖"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+
+@router.get("/health/ready")
+async def readiness():
+    """就绪探针：模型已加载并预热、MongoDB 可达时返回 200，否则 503"""
+    state = system_monitor.readiness()
+    state["status"] = "ready" if state["ready"] else "not_ready"
+    state["timestamp"] = datetime.now().isoformat()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
 @router.get("/info", response_model=ServiceInfoResponse)
 async def service_info():
     """服务信息端点"""
     from core.config import settings
-    from services.model_service import model_service
+    from services.model_registry import model_registry
 
     return ServiceInfoResponse(
         service_name=settings.APP_NAME,
@@ -110,13 +131,20 @@ async def service_info():
         environment=settings.ENVIRONMENT,
         debug_mode=settings.DEBUG,
         api_prefix=settings.API_V1_STR,
-        model_status="loaded" if model_service.model_loaded else "not_loaded"
+        model_status="loaded" if model_registry.default.model_loaded else "not_loaded"
     )
 
 
 @router.get("/system/stats", response_model=SystemStatsResponse)
 async def system_stats():
     """系统统计信息端点"""
-    stats = get_system_stats()
+    stats = await get_system_stats()
+
+    return SystemStatsResponse(**stats)
+
 
-    return SystemStatsResponse(**stats)
\ No newline at end of file
+@router.get("/system/stats/history")
+async def system_stats_history(limit: Optional[int] = Query(None, ge=1, description="返回最近的条数")):
+    """最近的系统状态快照 (按采样时间升序)"""
+    items = system_monitor.get_history(limit)
+    return {"interval": system_monitor.interval, "count": len(items), "items": items}
\ No newline at end of file
@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+import logging
+
+from core.config import settings
+from core.metrics import registry, register_stats_gauges, CONTENT_TYPE_LATEST
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def _register_service_gauges():
+    """缓存、推理队列、微批与写入队列的状态在抓取时从各服务的 get_stats() 读取"""
+    from core.rate_limit import admission
+    from services.model_service import model_service
+    from services.model_registry import model_registry
+    from services.prediction_cache import prediction_cache
+    from services.persistence_queue import write_behind
+    from services.storage_service import storage_service
+
+    register_stats_gauges(
+        "retina_cache", "Prediction cache", prediction_cache.get_stats,
+        ["misses", "memory_items", "memory_bytes", "memory_evictions", "disk_items", "disk_bytes"]
+    )
+    register_stats_gauges(
+        "retina_cache_hits", "Prediction cache hits by tier",
+        lambda: prediction_cache.get_stats()["hits"], ["memory", "disk"]
+    )
+    register_stats_gauges(
+        "retina_inference_executor", "Inference admission queue", model_service.executor.get_stats,
+        ["pending", "max_pending", "rejected", "completed"]
+    )
+    if model_service.batch_scheduler is not None:
+        register_stats_gauges(
+            "retina_batch_scheduler", "Micro-batch scheduler", model_service.batch_scheduler.get_stats,
+            ["queue_depth", "inflight_batches", "total_batches", "total_items", "avg_batch_size"]
+        )
+    register_stats_gauges(
+        "retina_model_registry", "Model registry", model_registry.get_stats,
+        ["resident_count", "resident_bytes", "memory_budget_bytes"]
+    )
+    register_stats_gauges(
+        "retina_admission", "Admission control", admission.get_stats,
+        ["inflight", "waiting", "tracked_clients"]
+    )
+    register_stats_gauges(
+        "retina_persistence", "Write-behind persistence queue", write_behind.get_stats,
+        ["queue_depth", "written", "journaled", "dropped", "mongo_available"]
+    )
+    register_stats_gauges(
+        "retina_storage", "Blob storage", storage_service.get_stats,
+        ["stored", "deduplicated", "failures", "pending_writes"]
+    )
+
+
+if settings.METRICS_ENABLED:
+    _register_service_gauges()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE_LATEST)
@@ -1,14 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, Dict, Any, List
 import time
 import logging
 import uuid
 import base64
+import binascii
+import hashlib
 
 from core.config import settings
-from services.model_service import model_service
-from utils.image_utils import base64_to_image, validate_image_size, get_image_info
+from core.metrics import stage_timer
+from core.rate_limit import admission, DeadlineExceeded, RateLimitExceeded
+from services.model_service import INFERENCE_MODES
+from services.model_registry import model_registry, ModelVersionError
+from services.inference_executor import InferenceQueueFullError
+from services.persistence_queue import write_behind
+from services.storage_service import storage_service
+from services.prediction_cache import prediction_cache, build_cache_entry, cache_entry_to_result
+from services.tta import parse_views
+from api.response_formats import OUTPUT_FORMATS, resolve_output_format, render_prediction
+from utils.image_utils import bytes_to_image, validate_image_size, get_image_info
 
 # 引入数据库模型
 from models.image import Image
@@ -32,8 +43,29 @@ class Base64PredictionRequest(BaseModel):
         description="图像格式：png, jpg, jpeg,gif,tif,tiff",
         example="png"
     )
+    inference_mode: Optional[str] = Field(
+        default=None,
+        description="推理模式：resize (缩放到512), tiled (全分辨率分块), auto；默认使用服务端配置",
+        example="auto"
+    )
+    tta: Optional[str] = Field(
+        default=None,
+        description="测试时增强：flips / rotations / d4，或逗号分隔的视图 (hflip,vflip,rot90,...)；"
+                    "所有视图在一次前向中完成，推理成本约为视图数倍",
+        example="flips"
+    )
+    tta_uncertainty_map: bool = Field(
+        default=False,
+        description="启用 TTA 时是否在 JSON 中返回逐像素不确定性图 (uncertainty_image)"
+    )
+    model_version: Optional[str] = Field(
+        default=None,
+        description="使用的模型版本 (须已注册并登记权重文件)；默认使用当前默认版本",
+        example="1.0.0-release"
+    )
 
     class Config:
+        protected_namespaces = ()
         json_schema_extra = {
             "example": {
                 "image_data": "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==",
@@ -44,6 +76,8 @@ class Base64PredictionRequest(BaseModel):
 
 class PredictionResponse(BaseModel):
     """预测响应模型"""
+    model_config = ConfigDict(protected_namespaces=())
+
     status: str
     request_id: str
     message: str
@@ -51,7 +85,17 @@ class PredictionResponse(BaseModel):
     image_info: Optional[Dict[str, Any]] = None
     confidence: Optional[float] = None
     vessel_coverage: Optional[float] = None
+    inference_mode: Optional[str] = None
+    model_version: Optional[str] = None
+    cache_hit: bool = False
+    output_format: str = "json"
     result_image: Optional[str] = None
+    mask_rle: Optional[Dict[str, Any]] = None
+    mask_packbits: Optional[Dict[str, Any]] = None
+    tta_views: Optional[List[str]] = None
+    tta_agreement: Optional[float] = None
+    tta_uncertain_fraction: Optional[float] = None
+    uncertainty_image: Optional[str] = None
 
 
 class ErrorResponse(BaseModel):
@@ -67,14 +111,24 @@ class ErrorResponse(BaseModel):
              response_model=PredictionResponse,
              responses={
                  400: {"model": ErrorResponse},
-                 500: {"model": ErrorResponse}
+                 404: {"model": ErrorResponse},
+                 429: {"model": ErrorResponse},
+                 500: {"model": ErrorResponse},
+                 503: {"model": ErrorResponse}
              })
-async def predict_from_base64(request: Base64PredictionRequest):
+async def predict_from_base64(
+        request: Base64PredictionRequest,
+        raw_request: Request,
+        output_format: Optional[str] = Query(
+            None, description=f"输出格式：{', '.join(OUTPUT_FORMATS)}；未指定时按 Accept 头选择，默认 json")
+):
     """
     Base64格式图像上传与预测
 
     支持包含data URI前缀的base64字符串，自动进行图像验证和预处理
     并自动将预测记录保存至数据库。
+    掩码可按 output_format / Accept 头以 JSON(base64 PNG)、原始 PNG、multipart、RLE、位打包形式返回，
+    或仅返回指标 (none)。
     """
     start_time = time.time()
     # 生成请求ID
@@ -97,6 +151,45 @@ async def predict_from_base64(request: Base64PredictionRequest):
                 }
             )
 
+        if request.inference_mode and request.inference_mode.lower() not in INFERENCE_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "error",
+                    "request_id": request_id,
+                    "error_code": "INVALID_MODE",
+                    "message": f"不支持的推理模式: {request.inference_mode}。支持: {', '.join(INFERENCE_MODES)}",
+                    "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+            )
+
+        try:
+            tta_views = parse_views(request.tta, settings.TTA_MAX_VIEWS)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "error",
+                    "request_id": request_id,
+                    "error_code": "INVALID_TTA",
+                    "message": str(e),
+                    "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+            )
+
+        fmt = resolve_output_format(raw_request, output_format)
+        if fmt is None:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "error",
+                    "request_id": request_id,
+                    "error_code": "INVALID_OUTPUT_FORMAT",
+                    "message": f"不支持的输出格式: {output_format}。支持: {', '.join(OUTPUT_FORMATS)}",
+                    "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+            )
+
         # 2. 处理base64数据
         base64_data = request.image_data
         if base64_data.startswith('data:'):
@@ -115,83 +208,127 @@ async def predict_from_base64(request: Base64PredictionRequest):
                 }
             )
 
-        # 4. 转换base64为图像
-        image = base64_to_image(base64_data)
-        if image is None:
+        # 4. 查询预测缓存 (命中时跳过图像解码与模型推理)
+        try:
+            with stage_timer("b64decode"):
+                image_bytes = base64.b64decode(base64_data)
+        except (binascii.Error, ValueError):
             raise HTTPException(
                 status_code=400,
                 detail={
                     "status": "error",
                     "request_id": request_id,
                     "error_code": "DECODE_FAILED",
-                    "message": "图像数据格式错误，无法解码",
+                    "message": "图像数据不是有效的base64编码",
                     "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
                 }
             )
-
-        # 5. 验证图像尺寸
-        is_valid, error_msg = validate_image_size(
-            image,
-            min_size=(100, 100),
-            max_size=(settings.MAX_IMAGE_DIMENSION, settings.MAX_IMAGE_DIMENSION)
+        # 内容哈希只计算一次：缓存键与原图存储键共用
+        content_digest = hashlib.sha256(image_bytes)
+        # 解析模型版本 (未常驻时返回 404，不在请求中加载)，缓存键与推理使用同一版本
+        service = await model_registry.resolve(request.model_version)
+        cache_key = prediction_cache.make_key(
+            image_bytes, service.model_version,
+            service.inference_params(request.inference_mode, tta_views),
+            content_digest=content_digest
         )
+        # 不确定性图不进入缓存，需要时总是重新推理
+        want_map = bool(tta_views) and request.tta_uncertainty_map
+        cached = None if want_map else await prediction_cache.get(cache_key)
+
+        if cached is not None:
+            image_info = cached["image_info"]
+            prediction_result = cache_entry_to_result(cached, request_id)
+            logger.info(f"⚡ 预测缓存命中 {request_id} ({cached['cache_tier']})")
+        else:
+            # 5. 从已解码的字节直接解码图像 (base64 只解码一次)
+            with stage_timer("decode"):
+                image = bytes_to_image(image_bytes)
+            if image is None:
+                raise HTTPException(
+                    status_code=400,
+                    detail={
+                        "status": "error",
+                        "request_id": request_id,
+                        "error_code": "DECODE_FAILED",
+                        "message": "图像数据格式错误，无法解码",
+                        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+                    }
+                )
 
-        if not is_valid:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "status": "error",
-                    "request_id": request_id,
-                    "error_code": "INVALID_DIMENSIONS",
-                    "message": error_msg,
-                    "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-            )
+            # 6. 验证图像尺寸
+            with stage_timer("validate"):
+                is_valid, error_msg = validate_image_size(
+                    image,
+                    min_size=(100, 100),
+                    max_size=(settings.MAX_IMAGE_DIMENSION, settings.MAX_IMAGE_DIMENSION)
+                )
+
+            if not is_valid:
+                raise HTTPException(
+                    status_code=400,
+                    detail={
+                        "status": "error",
+                        "request_id": request_id,
+                        "error_code": "INVALID_DIMENSIONS",
+                        "message": error_msg,
+                        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+                    }
+                )
+
+            # 7. 按像素数计费 (4K 图像消耗更多令牌)，再获取图像信息
+            admission.charge_image(raw_request, *image.shape[:2])
+            image_info = get_image_info(image)
+            logger.info(f"🖼️ 图像验证成功 {request_id} - 尺寸: {image_info['dimensions']}")
 
-        # 6. 获取图像信息
-        image_info = get_image_info(image)
-        logger.info(f"🖼️ 图像验证成功 {request_id} - 尺寸: {image_info['dimensions']}")
+            # 8. 调用模型服务进行预测
+            prediction_result = await model_registry.predict(service.model_version, image, request_id,
+                                                             mode=request.inference_mode,
+                                                             tta=tta_views, tta_map=want_map)
 
-        # 7. 调用模型服务进行预测
-        prediction_result = await model_service.predict(image, request_id)
+            if prediction_result["status"] == "success":
+                await prediction_cache.put(cache_key, build_cache_entry(prediction_result, image_info))
 
         processing_time = time.time() - start_time
 
         # === 新增：数据库保存逻辑 ===
         if prediction_result["status"] == "success":
             try:
-                # 计算近似文件大小 (Base64长度 * 0.75)
-                approx_size = int(len(base64_data) * 0.75)
-
                 # 为Base64图片创建一个虚拟文件名
                 virtual_filename = f"{request_id}.{request.image_format}"
 
-                # 1. 保存图片记录 (仅元数据)
+                # 1. 保存图片记录 (原图按内容哈希存储，后台写入)
                 img_record = Image(
                     patient_id="anonymous_api",  # Base64接口通常没有用户上下文，记为API匿名用户
                     filename=virtual_filename,
-                    file_size=approx_size,
-                    content_type=f"image/{request.image_format}"
+                    file_size=len(image_bytes),
+                    content_type=f"image/{request.image_format}",
+                    filepath=storage_service.store_later(image_bytes, f"image/{request.image_format}",
+                                                         key=content_digest.hexdigest())
+                    if settings.STORAGE_SAVE_ORIGINALS else None
                 )
-                # 异步保存图片
-                image_db_id = await img_record.save()
+                # 登记到写后队列 (预分配 ID，不等待数据库)
+                image_db_id = img_record.save_later()
 
                 # 2. 保存预测记录
                 pred_record = Prediction(
                     request_id=request_id,
-                    model_version=model_service.model_version,
+                    model_version=service.model_version,
                     result_data={
                         "confidence": prediction_result.get("confidence"),
                         "vessel_coverage": prediction_result.get("vessel_coverage"),
                         "processing_time": processing_time,
+                        "cache_hit": prediction_result.get("cache_hit", False),
                         "image_db_id": image_db_id
                     },
-                    patient_id="anonymous_api"
+                    patient_id="anonymous_api",
+                    image_id=image_db_id,
+                    # 保存掩码引用，报告与重新下载无需再次推理
+                    mask_file=storage_service.store_later(prediction_result.get("mask_png"), "image/png")
                 )
-                # 异步保存预测
-                await pred_record.save()
+                pred_record.save_later()
 
-                logger.info(f"💾 [DB] Base64预测记录已保存 (ID: {image_db_id})")
+                logger.info(f"💾 [DB] Base64预测记录已加入写入队列 (ID: {image_db_id})")
 
             except Exception as db_e:
                 # 数据库错误仅记录日志，不阻断返回
@@ -200,7 +337,7 @@ async def predict_from_base64(request: Base64PredictionRequest):
 
         if prediction_result["status"] == "success":
             logger.info(f"✅ 预测成功 {request_id}")
-            return PredictionResponse(
+            payload = dict(
                 status="success",
                 request_id=request_id,
                 message=prediction_result["message"],
@@ -208,8 +345,14 @@ async def predict_from_base64(request: Base64PredictionRequest):
                 image_info=image_info,
                 confidence=prediction_result.get("confidence"),
                 vessel_coverage=prediction_result.get("vessel_coverage"),
-                result_image=prediction_result.get("result_image")
+                inference_mode=prediction_result.get("inference_mode"),
+                model_version=service.model_version,
+                cache_hit=prediction_result.get("cache_hit", False),
+                tta_views=prediction_result.get("tta_views"),
+                tta_agreement=prediction_result.get("tta_agreement"),
+                tta_uncertain_fraction=prediction_result.get("tta_uncertain_fraction")
             )
+            return render_prediction(fmt, payload, prediction_result, PredictionResponse)
         else:
             logger.error(f"❌ 预测失败 {request_id}")
             raise HTTPException(
@@ -225,6 +368,56 @@ async def predict_from_base64(request: Base64PredictionRequest):
 
     except HTTPException:
         raise
+    except ModelVersionError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "MODEL_VERSION_UNAVAILABLE",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        )
+    except RateLimitExceeded as e:
+        # 按像素计费后令牌不足 (大图成本更高)
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "RATE_LIMITED",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except InferenceQueueFullError as e:
+        # 推理队列已满：返回 503 并提示客户端稍后重试
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "QUEUE_FULL",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceeded as e:
+        # 排队中已超过截止时间，推理未执行
+        admission.reject("deadline")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "DEADLINE_EXCEEDED",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        )
     except Exception as e:
         logger.error(f"💥 预测接口异常 {request_id}: {str(e)}")
         raise HTTPException(
@@ -242,7 +435,7 @@ async def predict_from_base64(request: Base64PredictionRequest):
 @router.get("/predict/status")
 async def get_prediction_status():
     """获取预测服务状态"""
-    stats = model_service.get_service_stats()
+    stats = model_registry.default.get_service_stats()
 
     return {
         "status": "success",
@@ -250,5 +443,10 @@ async def get_prediction_status():
         "model_loaded": stats["model_loaded"],
         "total_predictions": stats["total_predictions"],
         "service_status": stats["service_status"],
+        "batching": stats["batching"],
+        "models": model_registry.get_stats(),
+        "cache": prediction_cache.get_stats(),
+        "persistence": write_behind.get_stats(),
+        "storage": storage_service.get_stats(),
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
     }
\ No newline at end of file
@@ -1,56 +1,97 @@
 # api/endpoints/routes_image.py
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-import os
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 import logging
+from urllib.parse import quote
 from models.image import Image
+from services.storage_service import storage_service
+from api.listing import ndjson_response, page_payload, resolve_list_format, validate_cursor
+from api.streaming_upload import UploadRejected, receive_image_upload, multipart_openapi
 
 router = APIRouter(prefix="/images", tags=["Images"])
 logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+@router.post("/upload", openapi_extra=multipart_openapi("file", {"user_id": "上传者 (病人ID)"}, required=["user_id"]))
+async def upload_image(request: Request):
+    """
+    上传图像文件：边接收边校验大小与文件头 (格式、尺寸)，并流式写入内容寻址存储，相同内容只保存一份
+    """
+    if not storage_service.enabled:
+        raise HTTPException(status_code=503, detail="File storage is disabled")
+    try:
+        upload = await receive_image_upload(request, "file", keep_bytes=False, store=True,
+                                            required_fields=["user_id"])
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail={"error_code": e.error_code, "message": str(e)})
 
-@router.post("/upload")
-async def upload_image(
-        user_id: str = Form(...),
-        file: UploadFile = File(...)
-):
-    """上传图像文件 (异步修复版)"""
-    save_path = os.path.join(UPLOAD_DIR, file.filename)
-
-    # 读取文件（异步）
-    content = await file.read()
+    user_id = upload.fields["user_id"]
+    ref = upload.storage_ref
 
-    # 写入文件（同步写法，保持你原逻辑）
-    with open(save_path, "wb") as f:
-        f.write(content)
-
-    # 创建 Image 实例（兼容 user_id 和新增 patient_id 可一并传入）
+    # 创建 Image 实例 (查询接口按 patient_id 检索上传者，user_id 即病人ID)
     img = Image(
-        user_id=user_id,
-        patient_id=None,
-        filename=file.filename,
-        file_size=len(content),
-        content_type=file.content_type,
-        filepath=save_path
+        patient_id=user_id,
+        filename=upload.filename,
+        file_size=ref["size"],
+        content_type=upload.content_type,
+        filepath=ref["key"]
     )
 
     image_id = await img.save()
 
-    return {"image_id": image_id, "message": "Image uploaded successfully"}
+    return {
+        "image_id": image_id,
+        "storage_key": ref["key"],
+        "deduplicated": ref["deduplicated"],
+        "message": "Image uploaded successfully"
+    }
+
+
+def _content_disposition(filename: str) -> str:
+    """
+    Starlette 以 latin-1 编码响应头，中文文件名需按 RFC 6266 放入 filename*；
+    filename 只保留可打印 ASCII (去掉引号与反斜杠) 作为旧客户端的回退
+    """
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+@router.get("/{image_id}/file")
+async def download_image_file(image_id: str):
+    """从存储中流式下载原图"""
+    doc = await Image.find_by_id(image_id)
+    if not doc or not doc.get("filepath"):
+        raise HTTPException(status_code=404, detail="Image file not found")
+    if not await storage_service.exists(doc["filepath"]):
+        raise HTTPException(status_code=404, detail="Image file not found in storage")
+
+    return StreamingResponse(
+        storage_service.open_stream(doc["filepath"]),
+        media_type=doc.get("content_type") or "application/octet-stream",
+        headers={"Content-Disposition": _content_disposition(doc.get("filename") or image_id)}
+    )
 
 
 @router.get("/patient/{patient_id}")
-async def get_images_by_user(patient_id: str):
-    """根据用户ID查询该用户所有图像 (异步修复版)"""
-    images = await Image.find_by_user(patient_id)
+async def get_images_by_user(
+        patient_id: str,
+        request: Request,
+        limit: int = Query(None, ge=1, description="每页条数 (默认 50，最大 500；ndjson 下为空表示不限)"),
+        after: str = Query(None, description="上一页返回的 next_cursor"),
+        fields: str = Query(None, description="逗号分隔的返回字段，如 filename,uploaded_at"),
+        format: str = Query(None, description="json (默认) 或 ndjson 流式输出")
+):
+    """根据用户ID分页查询该用户的图像 (按上传时间倒序)"""
+    fmt = resolve_list_format(request, format)
+    validate_cursor(after)
 
-    if not images:
-        raise HTTPException(status_code=404, detail="No images found for this patient")
+    if fmt == "ndjson":
+        return ndjson_response(Image.iter_by_patient(patient_id, after=after, fields=fields, limit=limit))
+
+    page = await Image.find_by_user(patient_id, limit=limit, after=after, fields=fields)
 
-    # 将 ObjectId 转换为字符串，方便序列化（前端显示）
-    for img in images:
-        img["_id"] = str(img["_id"])
+    if not page["items"] and not after:
+        raise HTTPException(status_code=404, detail="No images found for this patient")
 
-    return {"images": images}
+    # ObjectId / datetime 转换为字符串，方便序列化（前端显示）
+    return page_payload("images", page)
@@ -0,0 +1,208 @@
+"""
+异步任务接口 (Asynchronous Job API)
+----------------------------------
+- POST /jobs:              提交一张或多张图像 (或 zip 压缩包)，立即返回任务 ID
+- GET  /jobs/{id}:         查询任务进度
+- GET  /jobs/{id}/results: NDJSON 流式返回结果，每张图像完成后立即输出一行
+- POST /jobs/{id}/cancel:  取消任务
+"""
+import asyncio
+import json
+import logging
+import os
+import zipfile
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from api.listing import NDJSON_MEDIA_TYPE
+from core.config import settings, SUPPORTED_FORMATS
+from core.pagination import serialize_doc
+from models.job import Job, ITEM_PENDING, TERMINAL_STATUSES
+from services.job_service import job_worker
+from services.model_service import INFERENCE_MODES
+from services.storage_service import storage_service, iter_upload
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+def _is_zip(file: UploadFile) -> bool:
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def _zip_image_entries(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """zip 中的图像文件 (跳过目录与 macOS 元数据)"""
+    entries = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+            continue
+        ext = os.path.splitext(name)[1].lstrip(".").lower()
+        if ext in SUPPORTED_FORMATS:
+            entries.append(info)
+    return entries
+
+
+async def _store_zip(file: UploadFile, items: List[Dict[str, Any]]):
+    """逐个解压 zip 中的图像写入存储 (每次只在内存中保留一张)"""
+    try:
+        archive = await run_in_threadpool(zipfile.ZipFile, file.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail=f"无效的 zip 文件: {file.filename}")
+
+    with archive:
+        for info in await run_in_threadpool(_zip_image_entries, archive):
+            if len(items) >= settings.JOB_MAX_ITEMS:
+                raise HTTPException(status_code=400, detail=f"单个任务最多 {settings.JOB_MAX_ITEMS} 张图像")
+            if info.file_size > settings.MAX_FILE_SIZE:
+                raise HTTPException(status_code=400, detail=f"文件过大: {info.filename}")
+            data = await run_in_threadpool(archive.read, info)
+            ext = os.path.splitext(info.filename)[1].lstrip(".").lower()
+            content_type = f"image/{'jpeg' if ext == 'jpg' else ext}"
+            ref = await storage_service.store_bytes(data, content_type)
+            items.append({"filename": info.filename, "content_type": content_type, "storage_key": ref["key"]})
+
+
+async def _iter_limited(file: UploadFile, max_size: int):
+    """按块读取上传文件；超过大小上限或为空时在提交到存储之前中止 (临时文件由存储后端清理)"""
+    size = 0
+    async for chunk in iter_upload(file, settings.STORAGE_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=413, detail=f"文件过大: {file.filename}")
+        yield chunk
+    if size == 0:
+        raise HTTPException(status_code=400, detail=f"文件为空: {file.filename}")
+
+
+async def _store_image(file: UploadFile, items: List[Dict[str, Any]]):
+    if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.filename} ({file.content_type})")
+    if len(items) >= settings.JOB_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单个任务最多 {settings.JOB_MAX_ITEMS} 张图像")
+    ref = await storage_service.store_stream(_iter_limited(file, settings.MAX_FILE_SIZE), file.content_type)
+    items.append({"filename": file.filename, "content_type": file.content_type, "storage_key": ref["key"]})
+
+
+def _job_summary(doc: Dict[str, Any]) -> Dict[str, Any]:
+    total = doc.get("total", 0)
+    finished = doc.get("completed", 0) + doc.get("failed", 0) + doc.get("skipped", 0)
+    return {
+        "job_id": str(doc["_id"]),
+        "status": doc["status"],
+        "total": total,
+        "completed": doc.get("completed", 0),
+        "failed": doc.get("failed", 0),
+        "skipped": doc.get("skipped", 0),
+        "progress": round(finished / total, 4) if total else 1.0,
+        "cancel_requested": doc.get("cancel_requested", False),
+        "inference_mode": doc.get("inference_mode"),
+        "created_at": serialize_doc(doc.get("created_at")),
+        "started_at": serialize_doc(doc.get("started_at")),
+        "finished_at": serialize_doc(doc.get("finished_at")),
+    }
+
+
+def _item_line(job_id: str, item: Dict[str, Any]) -> bytes:
+    payload = {
+        "job_id": job_id,
+        "index": item["index"],
+        "filename": item.get("filename"),
+        "status": item["status"],
+        "result": item.get("result"),
+        "error": item.get("error"),
+    }
+    return (json.dumps(serialize_doc(payload), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@router.post("", status_code=202)
+async def create_job(
+        files: List[UploadFile] = File(..., description="一张或多张眼底图像，或包含图像的 zip 压缩包"),
+        inference_mode: Optional[str] = Form(None, description="推理模式：resize / tiled / auto"),
+        patient_id: Optional[str] = Form(None)
+):
+    """提交异步分割任务，立即返回任务 ID"""
+    if not storage_service.enabled:
+        raise HTTPException(status_code=503, detail="异步任务需要启用文件存储 (STORAGE_BACKEND)")
+    if inference_mode and inference_mode.lower() not in INFERENCE_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的推理模式: {inference_mode}")
+    if await Job.count_active() >= settings.JOB_MAX_ACTIVE:
+        raise HTTPException(status_code=429, detail="排队中的任务过多，请稍后再试",
+                            headers={"Retry-After": str(int(settings.JOB_POLL_INTERVAL * 5))})
+
+    items: List[Dict[str, Any]] = []
+    for file in files:
+        if _is_zip(file):
+            await _store_zip(file, items)
+        else:
+            await _store_image(file, items)
+    if not items:
+        raise HTTPException(status_code=400, detail="未找到可处理的图像")
+
+    job_id = await Job(items, inference_mode=inference_mode, patient_id=patient_id).save()
+    job_worker.notify()
+    logger.info(f"📋 已创建任务 {job_id} ({len(items)} 张图像)")
+
+    return {
+        "status": "queued",
+        "job_id": job_id,
+        "total": len(items),
+        "status_url": f"{settings.API_V1_STR}/jobs/{job_id}",
+        "results_url": f"{settings.API_V1_STR}/jobs/{job_id}/results",
+    }
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """查询任务进度及每张图像的状态"""
+    doc = await Job.find_by_id(job_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    summary = _job_summary(doc)
+    summary["items"] = [
+        {"index": item["index"], "filename": item.get("filename"), "status": item["status"],
+         "error": item.get("error")}
+        for item in doc["items"]
+    ]
+    return summary
+
+
+@router.get("/{job_id}/results")
+async def stream_job_results(job_id: str):
+    """
+    NDJSON 流式返回结果：每张图像完成后输出一行，任务结束时输出一行汇总 (含 "done": true)
+    结果来自任务文档，由哪个工作进程执行都能读取。
+    """
+    if not await Job.find_by_id(job_id, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def lines():
+        sent = set()
+        while True:
+            doc = await Job.find_by_id(job_id)
+            if doc is None:
+                return
+            for item in doc["items"]:
+                if item["status"] != ITEM_PENDING and item["index"] not in sent:
+                    sent.add(item["index"])
+                    yield _item_line(job_id, item)
+            if doc["status"] in TERMINAL_STATUSES:
+                yield (json.dumps({**_job_summary(doc), "done": True}, ensure_ascii=False) + "\n").encode("utf-8")
+                return
+            await asyncio.sleep(settings.JOB_RESULT_POLL_INTERVAL)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消任务：排队中的任务立即取消，执行中的任务在当前图像完成后停止"""
+    doc = await Job.request_cancel(job_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_summary(doc)
@@ -1,26 +1,105 @@
 # api/endpoints/routes_model.py
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pydantic import BaseModel, ConfigDict
+from core.config import settings
 from models.model import ModelInfo
+from api.listing import page_payload, validate_cursor
+from services.model_registry import model_registry, ModelVersionError, confine_artifact
 
 router = APIRouter(prefix="/api/v1/models", tags=["Models"])
 
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """模型管理接口 (注册 / 加载 / 切换 / 卸载 / 影子) 需要 X-Admin-Token 与 MODEL_ADMIN_TOKEN 一致；未配置时禁用"""
+    if not settings.MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model management is disabled (MODEL_ADMIN_TOKEN not set)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), settings.MODEL_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
 class ModelRegister(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
     model_version: str
     model_metadata: dict = {}
+    artifact_path: Optional[str] = None  # MODEL_ARTIFACT_DIR 内的权重文件 (TorchScript 或 state_dict)，登记后该版本可被加载和选择
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(require_admin)])
 async def register_model(payload: ModelRegister):
     exists = await ModelInfo.find_by_version(payload.model_version)
     if exists:
         raise HTTPException(status_code=400, detail="Model version exists")
-    m = ModelInfo(model_version=payload.model_version, model_metadata=payload.model_metadata)
+    artifact_path = None
+    if payload.artifact_path:
+        artifact_path = confine_artifact(payload.artifact_path)
+        if artifact_path is None:
+            raise HTTPException(status_code=400, detail="Artifact must be inside MODEL_ARTIFACT_DIR")
+        if not os.path.isfile(artifact_path):
+            raise HTTPException(status_code=400, detail=f"Artifact not found: {payload.artifact_path}")
+    m = ModelInfo(model_version=payload.model_version, model_metadata=payload.model_metadata,
+                  artifact_path=artifact_path)
     mid = await m.save()
     return {"status":"success","model_id": mid}
 
 @router.get("")
-async def list_models():
-    docs = await ModelInfo.list_models()
-    for d in docs:
-        d["_id"] = str(d["_id"])
-    return {"count": len(docs), "data": docs}
+async def list_models(limit: int = Query(None, ge=1), after: str = Query(None)):
+    validate_cursor(after)
+    page = await ModelInfo.list_models(limit=limit, after=after)
+    return page_payload("data", page)
+
+@router.get("/resident")
+async def resident_models():
+    """常驻版本 (按最近使用排序)、默认版本、内存预算与正在加载 / 切换的版本"""
+    return {"status": "success", **model_registry.get_stats()}
+
+@router.get("/lifecycle")
+async def model_lifecycle(limit: int = Query(None, ge=1)):
+    """最近的加载 / 预热 / 切换 / 卸载记录 (含耗时)"""
+    return {"status": "success", "data": model_registry.get_history(limit)}
+
+@router.get("/shadow")
+async def shadow_status():
+    """影子推理的配置与对比统计 (平均 Dice、置信度差、延迟差，丢弃计数)"""
+    return {"status": "success", **model_registry.shadow.get_stats()}
+
+@router.delete("/shadow", dependencies=[Depends(require_admin)])
+async def disable_shadow():
+    model_registry.shadow.configure(None)
+    return {"status": "success", **model_registry.shadow.get_stats()}
+
+@router.post("/{version}/shadow", dependencies=[Depends(require_admin)])
+async def enable_shadow(version: str, sample_rate: float = Query(0.05, gt=0, le=1)):
+    """把 version 设为影子推理的候选版本：按 sample_rate 抽样线上请求在其上低优先级重跑并与当前结果对比"""
+    if version == model_registry.default_version:
+        raise HTTPException(status_code=400, detail="Candidate must differ from the default version")
+    model_registry.shadow.configure(version, sample_rate)
+    return {"status": "success", **model_registry.shadow.get_stats()}
+
+@router.post("/{version}/load", dependencies=[Depends(require_admin)])
+async def load_model(version: str):
+    """加载并预热指定版本 (不改变默认版本)，完成后返回"""
+    try:
+        service = await model_registry.load(version)
+    except ModelVersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"status": "success", "model": service.get_model_info()}
+
+@router.post("/{version}/activate", status_code=202, dependencies=[Depends(require_admin)])
+async def activate_model(version: str):
+    """后台加载并预热指定版本，完成后原子地切换为默认版本；进行中的请求不受影响"""
+    started = model_registry.activate_in_background(version)
+    return {"status": "accepted" if started else "in_progress", "version": version,
+            "default_version": model_registry.default_version}
+
+@router.delete("/{version}/load", dependencies=[Depends(require_admin)])
+async def unload_model(version: str):
+    """等待该版本的在途请求完成后卸载 (默认版本不可卸载)"""
+    try:
+        seconds = await model_registry.unload(version)
+    except ModelVersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"status": "success", "version": version, "unload_seconds": seconds}
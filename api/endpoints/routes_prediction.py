@@ -1,6 +1,9 @@
 # api/endpoints/routes_prediction.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from models.prediction import Prediction
+from services.storage_service import storage_service
+from api.listing import ndjson_response, page_payload, resolve_list_format, validate_cursor
 
 router = APIRouter(prefix="/predictions", tags=["Predictions"])
 
@@ -30,15 +33,37 @@ async def add_prediction(
 
 
 @router.get("/image/{image_id}")
-async def get_prediction_by_image(image_id: str):
-    """查询该图像的全部预测记录 (异步修复版)"""
-    preds = await Prediction.find_by_image(image_id)
+async def get_prediction_by_image(
+        image_id: str,
+        request: Request,
+        limit: int = Query(None, ge=1, description="每页条数 (默认 50，最大 500；ndjson 下为空表示不限)"),
+        after: str = Query(None, description="上一页返回的 next_cursor"),
+        fields: str = Query(None, description="逗号分隔的返回字段，如 model_version,result_data"),
+        format: str = Query(None, description="json (默认) 或 ndjson 流式输出")
+):
+    """分页查询该图像的预测记录 (按创建时间倒序)"""
+    fmt = resolve_list_format(request, format)
+    validate_cursor(after)
+
+    if fmt == "ndjson":
+        return ndjson_response(Prediction.iter_by_image(image_id, after=after, fields=fields, limit=limit))
+
+    page = await Prediction.find_by_image(image_id, limit=limit, after=after, fields=fields)
 
-    if not preds:
+    if not page["items"] and not after:
         raise HTTPException(status_code=404, detail="No prediction found for this image")
 
-    # 序列化 _id
-    for p in preds:
-        p["_id"] = str(p["_id"])
+    # 序列化 _id / 时间字段
+    return page_payload("predictions", page)
+
+
+@router.get("/{pred_id}/mask")
+async def download_prediction_mask(pred_id: str):
+    """从存储中流式下载预测掩码 (PNG)，无需重新推理"""
+    pred = await Prediction.find_by_id(pred_id)
+    if not pred or not pred.get("mask_file"):
+        raise HTTPException(status_code=404, detail="Mask not found for this prediction")
+    if not await storage_service.exists(pred["mask_file"]):
+        raise HTTPException(status_code=404, detail="Mask not found in storage")
 
-    return {"predictions": preds}
+    return StreamingResponse(storage_service.open_stream(pred["mask_file"]), media_type="image/png")
@@ -6,6 +6,8 @@ from models.prediction import Prediction
 from models.image import Image
 from core.database import db
 from services.report_service import report_service
+from services.storage_service import storage_service, BlobNotFoundError
+import base64
 from bson.objectid import ObjectId
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
@@ -60,11 +62,20 @@ async def download_report_pdf(report_id: str):
     # 模拟一张空白图的 Base64 防止报错
     dummy_image = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
 
+    # 预测记录保存了掩码引用时，直接从存储读取血管图，无需重新推理
+    mask_image = dummy_image
+    if prediction_data and prediction_data.get("mask_file"):
+        try:
+            mask_bytes = await storage_service.read_bytes(prediction_data["mask_file"])
+            mask_image = base64.b64encode(mask_bytes).decode("ascii")
+        except BlobNotFoundError:
+            pass
+
     pdf_buffer = report_service.generate_pdf(
         patient_data=patient_data or {},
         prediction_data=prediction_data or {},
         report_data=report_data,
-        image_base64=dummy_image  # 这里以后要替换成真实的血管图 Base64
+        image_base64=mask_image
     )
 
     # 返回 PDF 文件流
@@ -3,23 +3,31 @@
 ------------------------------------------
 本模块负责处理通过文件上传方式进行的血管分割请求。
 它包含以下核心功能：
-1. 接收前端上传的图片文件 (PNG, JPG, GIF, TIFF 等)。
-2. 进行严格的文件校验 (大小、格式、有效性)。
-3. 调用 ModelService 进行 AI 推理。
+1. 流式接收前端上传的图片文件 (PNG, JPG, GIF, TIFF 等)，不经过 UploadFile 的整体缓冲。
+2. 进行严格的文件校验：大小超限时在接收过程中立即中止，格式与尺寸在解码前按文件头嗅探，解码后再做有效性校验。
+3. 查询预测缓存，未命中时调用 ModelService 进行 AI 推理。
 4. 将原始图片和预测结果异步存入数据库。
-5. 返回包含 Base64 结果图和医学指标的 JSON 响应。
+5. 按 output_format / Accept 头返回结果 (默认为包含 Base64 结果图和医学指标的 JSON)。
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, Dict, Any, List
 import time
 import logging
 import uuid
-import base64
 
-from core.config import settings, ALLOWED_CONTENT_TYPES
-from services.model_service import model_service
-from utils.image_utils import base64_to_image, validate_image_size, format_file_size, get_image_info
+from core.config import settings
+from core.metrics import stage_timer
+from core.rate_limit import admission, DeadlineExceeded, RateLimitExceeded
+from services.model_service import INFERENCE_MODES
+from services.model_registry import model_registry, ModelVersionError
+from services.inference_executor import InferenceQueueFullError
+from services.prediction_cache import prediction_cache, build_cache_entry, cache_entry_to_result
+from services.tta import parse_views
+from services.storage_service import storage_service
+from api.response_formats import OUTPUT_FORMATS, resolve_output_format, render_prediction
+from api.streaming_upload import UploadRejected, receive_image_upload, multipart_openapi
+from utils.image_utils import bytes_to_image, validate_image_size, format_file_size, get_image_info
 
 from models.image import Image
 from models.prediction import Prediction
@@ -30,6 +38,8 @@ router = APIRouter()
 
 
 class FileUploadResponse(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
     status: str
     request_id: str
     message: str
@@ -41,6 +51,16 @@ class FileUploadResponse(BaseModel):
     result_image: Optional[str] = None
     confidence: Optional[float] = None
     vessel_coverage: Optional[float] = None
+    inference_mode: Optional[str] = None
+    model_version: Optional[str] = None
+    cache_hit: bool = False
+    output_format: str = "json"
+    mask_rle: Optional[Dict[str, Any]] = None
+    mask_packbits: Optional[Dict[str, Any]] = None
+    tta_views: Optional[List[str]] = None
+    tta_agreement: Optional[float] = None
+    tta_uncertain_fraction: Optional[float] = None
+    uncertainty_image: Optional[str] = None
 
 
 @router.post("/upload/predict",
@@ -50,50 +70,107 @@ class FileUploadResponse(BaseModel):
              responses={
                  500: {"model": ErrorResponse},
                  400: {"model": ErrorResponse},
+                 404: {"model": ErrorResponse},
+                 413: {"model": ErrorResponse},
+                 415: {"model": ErrorResponse},
+                 429: {"model": ErrorResponse},
+                 503: {"model": ErrorResponse},
              },
+             openapi_extra=multipart_openapi("file", {
+                 "patient_id": "病人ID",
+                 "inference_mode": "推理模式：resize / tiled / auto",
+                 "tta": "测试时增强：flips / rotations / d4 或逗号分隔的视图",
+                 "tta_uncertainty_map": "启用 TTA 时在 JSON 中返回不确定性图 (true / false)",
+                 "model_version": "使用的模型版本，默认使用当前默认版本",
+             }),
              )
 async def predict_from_upload(
-        file: UploadFile = File(...),
-        #user_id: Optional[str] = Form(None),
-        patient_id: Optional[str] = Form(None)
+        raw_request: Request,
+        output_format: Optional[str] = Query(
+            None, description=f"输出格式：{', '.join(OUTPUT_FORMATS)}；未指定时按 Accept 头选择，默认 json")
 ):
     start_time = time.time()
     request_id = f"file_{int(time.time())}_{uuid.uuid4().hex[:8]}"
 
-    logger.info(f"📤 文件上传请求 {request_id} - 文件名: {file.filename}")
-
     try:
-        # --- 验证阶段 ---
-        if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
-            raise HTTPException(status_code=400, detail={"status": "error", "message": "Unsupported file type"})
+        # --- 接收阶段 (边接收边校验大小、文件头格式与尺寸，并增量计算哈希) ---
+        fmt = resolve_output_format(raw_request, output_format)
+        if fmt is None:
+            raise HTTPException(status_code=400, detail={"status": "error", "message": f"Unsupported output format: {output_format}"})
 
-        contents = await file.read()
-        file_size = len(contents)
+        upload = await receive_image_upload(
+            raw_request, "file",
+            min_dimension=100,
+            max_dimension=settings.MAX_IMAGE_DIMENSION,
+            keep_bytes=True
+        )
+        contents = upload.data
+        file_size = upload.size
+        patient_id = upload.fields.get("patient_id") or None
+        inference_mode = upload.fields.get("inference_mode") or None
+        tta = upload.fields.get("tta") or None
+        tta_uncertainty_map = upload.fields.get("tta_uncertainty_map", "").lower() in ("1", "true", "yes", "on")
+        model_version = upload.fields.get("model_version") or None
 
-        if file_size > settings.MAX_FILE_SIZE or file_size == 0:
-            raise HTTPException(status_code=400, detail={"status": "error", "message": "File size invalid"})
+        logger.info(f"📤 文件上传请求 {request_id} - 文件名: {upload.filename}")
 
-        detected_format = ALLOWED_CONTENT_TYPES.get(file.content_type, "unknown")
+        # --- 验证阶段 ---
+        if inference_mode and inference_mode.lower() not in INFERENCE_MODES:
+            raise HTTPException(status_code=400, detail={"status": "error", "message": f"Unsupported inference mode: {inference_mode}"})
 
-        # 转换图像
-        image_base64 = base64.b64encode(contents).decode('utf-8')
-        image = base64_to_image(image_base64)
+        try:
+            tta_views = parse_views(tta, settings.TTA_MAX_VIEWS)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail={"status": "error", "message": str(e)})
 
-        if image is None:
-            raise HTTPException(status_code=400, detail={"status": "error", "message": "Invalid image data"})
+        detected_format = upload.header.format
 
-        is_valid, error_msg = validate_image_size(
-            image,
-            min_size=(100, 100),
-            max_size=(settings.MAX_IMAGE_DIMENSION, settings.MAX_IMAGE_DIMENSION)
+        # --- 缓存查询 (命中时跳过解码与推理) ---
+        service = await model_registry.resolve(model_version)
+        cache_key = prediction_cache.make_key(
+            contents, service.model_version, service.inference_params(inference_mode, tta_views),
+            content_digest=upload.digest
         )
-        if not is_valid:
-            raise HTTPException(status_code=400, detail={"status": "error", "message": error_msg})
+        # 不确定性图不进入缓存，需要时总是重新推理
+        want_map = bool(tta_views) and tta_uncertainty_map
+        cached = None if want_map else await prediction_cache.get(cache_key)
+
+        if cached is not None:
+            image_info = cached["image_info"]
+            prediction_result = cache_entry_to_result(cached, request_id)
+            logger.info(f"⚡ 预测缓存命中 {request_id} ({cached['cache_tier']})")
+        else:
+            # 文件头已给出尺寸时在解码前按像素数计费 (4K 图像消耗更多令牌)
+            if upload.header.has_size:
+                admission.charge_image(raw_request, upload.header.height, upload.header.width)
+
+            # 直接从上传的字节解码 (不再经过 base64 编码/解码)
+            with stage_timer("decode"):
+                image = bytes_to_image(memoryview(contents))
 
-        image_info = get_image_info(image)
+            if image is None:
+                raise HTTPException(status_code=400, detail={"status": "error", "message": "Invalid image data"})
+
+            with stage_timer("validate"):
+                is_valid, error_msg = validate_image_size(
+                    image,
+                    min_size=(100, 100),
+                    max_size=(settings.MAX_IMAGE_DIMENSION, settings.MAX_IMAGE_DIMENSION)
+                )
+            if not is_valid:
+                raise HTTPException(status_code=400, detail={"status": "error", "message": error_msg})
+
+            if not upload.header.has_size:
+                admission.charge_image(raw_request, *image.shape[:2])
+            image_info = get_image_info(image)
+
+            # --- 预测阶段 ---
+            prediction_result = await model_registry.predict(service.model_version, image, request_id,
+                                                             mode=inference_mode, tta=tta_views, tta_map=want_map)
+
+            if prediction_result["status"] == "success":
+                await prediction_cache.put(cache_key, build_cache_entry(prediction_result, image_info))
 
-        # --- 预测阶段 ---
-        prediction_result = await model_service.predict(image, request_id)
         processing_time = time.time() - start_time
         formatted_size = format_file_size(file_size)
 
@@ -103,27 +180,31 @@ async def predict_from_upload(
                 img_record = Image(
                     #user_id=user_id or "anonymous",
                     patient_id=patient_id or "anonymous",
-                    filename=file.filename,
+                    filename=upload.filename,
                     file_size=file_size,
-                    content_type=file.content_type
+                    content_type=upload.content_type,
+                    filepath=storage_service.store_later(contents, upload.content_type, key=upload.sha256)
+                    if settings.STORAGE_SAVE_ORIGINALS else None
                 )
-                image_db_id = await img_record.save()
+                image_db_id = img_record.save_later()
 
                 pred_record = Prediction(
                     request_id=request_id,
-                    model_version=getattr(model_service, "model_version", "unknown"),
+                    model_version=service.model_version,
                     result_data={
                         "confidence": prediction_result.get("confidence"),
                         "vessel_coverage": prediction_result.get("vessel_coverage"),
                         "processing_time": processing_time,
+                        "cache_hit": prediction_result.get("cache_hit", False),
                         "image_db_id": image_db_id
                     },
                     #user_id=user_id or "anonymous",
                     patient_id=patient_id or "anonymous",
-                    image_id=image_db_id
+                    image_id=image_db_id,
+                    mask_file=storage_service.store_later(prediction_result.get("mask_png"), "image/png")
                 )
-                await pred_record.save()
-                logger.info(f"💾 [DB] 已保存记录 (ID: {image_db_id})")
+                pred_record.save_later()
+                logger.info(f"💾 [DB] 记录已加入写入队列 (ID: {image_db_id})")
             except Exception as db_e:
                 logger.error(f"⚠️ [DB] 保存失败: {db_e}")
 
@@ -132,22 +213,90 @@ async def predict_from_upload(
 
         logger.info(f"✅ 预测成功 {request_id}")
 
-        return FileUploadResponse(
+        payload = dict(
             status="success",
             request_id=request_id,
-            message=f"文件 '{file.filename}' 处理成功",
-            filename=file.filename,
+            message=f"文件 '{upload.filename}' 处理成功",
+            filename=upload.filename,
             file_size=formatted_size,
             detected_format=detected_format,
             image_info=image_info,
             processing_time=processing_time,
-            result_image=prediction_result.get("result_image"),
             confidence=prediction_result.get("confidence"),
-            vessel_coverage=prediction_result.get("vessel_coverage")
+            vessel_coverage=prediction_result.get("vessel_coverage"),
+            inference_mode=prediction_result.get("inference_mode"),
+            model_version=service.model_version,
+            cache_hit=prediction_result.get("cache_hit", False),
+            tta_views=prediction_result.get("tta_views"),
+            tta_agreement=prediction_result.get("tta_agreement"),
+            tta_uncertain_fraction=prediction_result.get("tta_uncertain_fraction")
         )
+        return render_prediction(fmt, payload, prediction_result, FileUploadResponse)
 
     except HTTPException:
         raise
+    except UploadRejected as e:
+        # 接收过程中被拒绝：超大 (413)、格式不支持 (415)、尺寸不合法或 multipart 格式错误 (400)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": e.error_code,
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        )
+    except ModelVersionError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "MODEL_VERSION_UNAVAILABLE",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        )
+    except RateLimitExceeded as e:
+        # 按像素计费后令牌不足 (大图成本更高)
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "RATE_LIMITED",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except InferenceQueueFullError as e:
+        # 推理队列已满：返回 503 并提示客户端稍后重试
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "QUEUE_FULL",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceeded as e:
+        # 排队中已超过截止时间，推理未执行
+        admission.reject("deadline")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "error",
+                "request_id": request_id,
+                "error_code": "DEADLINE_EXCEEDED",
+                "message": str(e),
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        )
     except Exception as e:
         logger.error(f"💥 异常: {str(e)}")
         raise HTTPException(
@@ -0,0 +1,59 @@
+"""
+列表响应模块 (Listing Responses)
+-------------------------------
+列表接口的两种输出：
+- json:   单页结果 {"<key>": [...], "count", "next_cursor", "has_more"}，客户端用 next_cursor 作为 after 翻页
+- ndjson: application/x-ndjson 流式输出，每行一条文档，边从 MongoDB 游标读取边发送，内存占用与结果总数无关
+查询参数 format=ndjson 或 Accept: application/x-ndjson 选择流式输出。
+"""
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from core.pagination import InvalidCursorError, decode_cursor, serialize_doc
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+LIST_FORMATS = ("json", "ndjson")
+
+
+def resolve_list_format(request: Request, format: Optional[str] = None) -> str:
+    """查询参数优先，其次 Accept 头，默认 json"""
+    if format:
+        fmt = format.lower()
+        if fmt not in LIST_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的输出格式: {format}。支持: {', '.join(LIST_FORMATS)}")
+        return fmt
+    accept = request.headers.get("accept", "")
+    if NDJSON_MEDIA_TYPE in accept.lower():
+        return "ndjson"
+    return "json"
+
+
+def validate_cursor(after: Optional[str]):
+    """提前校验游标 (流式输出开始后无法再返回 400)"""
+    if after:
+        try:
+            decode_cursor(after)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def page_payload(key: str, page: Dict[str, Any]) -> Dict[str, Any]:
+    items = [serialize_doc(doc) for doc in page["items"]]
+    return {
+        key: items,
+        "count": len(items),
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"],
+    }
+
+
+async def _ndjson_lines(docs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    async for doc in docs:
+        yield (json.dumps(serialize_doc(doc), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def ndjson_response(docs: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    return StreamingResponse(_ndjson_lines(docs), media_type=NDJSON_MEDIA_TYPE)
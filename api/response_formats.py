@@ -0,0 +1,112 @@
+"""
+预测响应格式模块 (Prediction Response Formats)
+--------------------------------------------
+预测接口默认在 JSON 中内嵌 data:image/png;base64 掩码。对于 4K 掩码这会让响应体膨胀，
+JSON 序列化成为主要耗时。本模块根据 output_format 查询参数或 Accept 头选择输出格式：
+- json:      JSON + base64 PNG 掩码 (默认，兼容旧客户端)
+- png:       原始 image/png 二进制，指标放在 X-* 响应头中
+- multipart: multipart/mixed，第一部分为 JSON 指标，第二部分为 PNG 掩码
+- rle:       JSON + COCO 风格 RLE 掩码 (mask_rle)
+- packbits:  JSON + 位打包掩码 (mask_packbits)
+- none:      仅返回 JSON 指标，不包含掩码
+"""
+import json
+import uuid
+from typing import Any, Dict, Optional, Type
+
+import cv2
+import numpy as np
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from utils.image_utils import bytes_to_base64
+from utils.mask_encoding import mask_to_rle, mask_to_packbits
+
+OUTPUT_FORMATS = ("json", "png", "multipart", "rle", "packbits", "none")
+
+# Accept 头到输出格式的映射 (按出现顺序匹配)
+ACCEPT_FORMATS = {
+    "image/png": "png",
+    "multipart/mixed": "multipart",
+    "application/vnd.retina.rle+json": "rle",
+    "application/vnd.retina.packbits+json": "packbits",
+    "application/vnd.retina.metrics+json": "none",
+}
+
+
+def resolve_output_format(request: Request, output_format: Optional[str] = None) -> Optional[str]:
+    """
+    确定输出格式：查询参数优先，其次 Accept 头，默认 json
+    返回 None 表示查询参数中的格式不受支持。
+    """
+    if output_format:
+        fmt = output_format.lower()
+        return fmt if fmt in OUTPUT_FORMATS else None
+
+    accept = request.headers.get("accept", "")
+    for media_type in (part.split(";")[0].strip().lower() for part in accept.split(",")):
+        if media_type in ACCEPT_FORMATS:
+            return ACCEPT_FORMATS[media_type]
+    return "json"
+
+
+def _result_mask(prediction_result: Dict[str, Any]) -> np.ndarray:
+    """取得 (H, W) 掩码：优先使用推理结果中的数组，缓存命中时从 PNG 解码"""
+    mask = prediction_result.get("mask")
+    if mask is None:
+        mask = cv2.imdecode(np.frombuffer(prediction_result["mask_png"], np.uint8), cv2.IMREAD_GRAYSCALE)
+    return mask
+
+
+def _metric_headers(payload: Dict[str, Any]) -> Dict[str, str]:
+    headers = {}
+    for key in ("request_id", "confidence", "vessel_coverage", "processing_time", "inference_mode", "model_version",
+                "cache_hit"):
+        if payload.get(key) is not None:
+            headers["X-" + key.replace("_", "-").title()] = str(payload[key])
+    return headers
+
+
+def render_prediction(fmt: str,
+                      payload: Dict[str, Any],
+                      prediction_result: Dict[str, Any],
+                      response_model: Type[BaseModel]):
+    """
+    按输出格式构造响应
+
+    Args:
+        fmt: 输出格式 (OUTPUT_FORMATS 之一)
+        payload: 不含掩码的响应字段 (与 response_model 对应)
+        prediction_result: ModelService.predict / 缓存返回的结果，含 mask_png
+        response_model: JSON 格式使用的 Pydantic 响应模型
+    """
+    mask_png = prediction_result.get("mask_png", b"")
+    payload = dict(payload, output_format=fmt)
+
+    if fmt == "png":
+        return Response(content=mask_png, media_type="image/png", headers=_metric_headers(payload))
+
+    if fmt == "multipart":
+        boundary = uuid.uuid4().hex
+        metrics = json.dumps(jsonable_encoder(response_model(**payload)), ensure_ascii=False).encode("utf-8")
+        body = b"".join([
+            f"--{boundary}\r\nContent-Type: application/json; charset=utf-8\r\n\r\n".encode(),
+            metrics,
+            f"\r\n--{boundary}\r\nContent-Type: image/png\r\n"
+            f"Content-Disposition: attachment; filename=\"mask.png\"\r\n\r\n".encode(),
+            mask_png,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        return Response(content=body, media_type=f"multipart/mixed; boundary={boundary}")
+
+    if fmt == "json":
+        payload["result_image"] = bytes_to_base64(mask_png, "png") if mask_png else None
+        if prediction_result.get("uncertainty_png"):
+            payload["uncertainty_image"] = bytes_to_base64(prediction_result["uncertainty_png"], "png")
+    elif fmt == "rle":
+        payload["mask_rle"] = mask_to_rle(_result_mask(prediction_result))
+    elif fmt == "packbits":
+        payload["mask_packbits"] = mask_to_packbits(_result_mask(prediction_result))
+
+    return response_model(**payload)
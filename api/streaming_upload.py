@@ -0,0 +1,349 @@
+"""
+流式上传接收模块 (Streaming Multipart Ingestion)
+----------------------------------------------
+FastAPI 的 UploadFile 要等整个 multipart 请求体被接收并落入临时文件后才调用接口，
+超大文件只能在全部接收之后才被拒绝。本模块直接从 request.stream() 按块解析 multipart
+(与 Starlette 相同的 python-multipart 解析器)，在接收过程中完成校验：
+1. Content-Length 超过 MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD 时不读取请求体直接返回 413；
+   分块传输时按已接收字节数计数，一旦超出立即中止。
+2. 根据前几个块嗅探图像头 (utils.image_sniff)：格式不支持返回 415，宽高超出范围返回 400，
+   此时尚未解码，也尚未写入存储。
+3. 边接收边增量计算 SHA-256 (预测缓存键与内容寻址存储键复用同一个哈希)。
+4. store=True 时通过有界队列把数据块交给 storage_service.store_stream 并发写入 (线程池 / GridFS)，
+   不阻塞事件循环；中止时取消写入任务，临时文件由存储后端清理。
+"""
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import multipart
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from fastapi import Request
+
+from core.config import settings, SUPPORTED_FORMATS
+from core.metrics import stage_timer
+from services.storage_service import storage_service
+from utils.image_sniff import MAGIC_BYTES, ImageHeader, sniff_image
+
+# 非文件字段 (patient_id、tta 等) 单个值的大小上限
+MAX_FIELD_SIZE = 16 * 1024
+# 写入存储的有界队列长度 (存储写入跟不上时对客户端形成背压)
+STORAGE_QUEUE_SIZE = 4
+
+
+class UploadRejected(Exception):
+    """上传在接收过程中被拒绝 (status_code / error_code 直接用于 HTTP 响应)"""
+
+    def __init__(self, status_code: int, error_code: str, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+
+
+class StreamedUpload:
+    """接收完成的上传：表单字段、文件元数据、嗅探到的图像头，以及 (按需) 字节内容与存储引用"""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.size = 0
+        self.header: Optional[ImageHeader] = None
+        self.digest = None  # hashlib.sha256 对象 (store=True 时由存储后端计算)
+        self.data: Optional[bytearray] = None
+        self.storage_ref: Optional[Dict[str, Any]] = None
+
+    @property
+    def sha256(self) -> str:
+        if self.storage_ref is not None:
+            return self.storage_ref["key"]
+        return self.digest.hexdigest()
+
+
+async def _iter_queue(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+class _ImagePartReceiver:
+    """处理 multipart 解析事件，对文件部分做计数、嗅探、哈希与存储写入"""
+
+    def __init__(self, file_field: str, max_size: int, allowed_types: Sequence[str],
+                 min_dimension: int, max_dimension: int, sniff_bytes: int,
+                 keep_bytes: bool, store: bool, required_fields: Sequence[str] = ()):
+        self.file_field = file_field
+        self.required_fields = required_fields
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.min_dimension = min_dimension
+        self.max_dimension = max_dimension
+        self.sniff_bytes = max(sniff_bytes, MAGIC_BYTES)
+        self.keep_bytes = keep_bytes
+        self.store = store and storage_service.enabled
+
+        self.upload = StreamedUpload()
+        self.events: List[Tuple[str, bytes]] = []
+
+        # 当前 part 的状态
+        self._headers: Dict[str, str] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._field_name: Optional[str] = None
+        self._field_value: Optional[bytearray] = None
+        self._in_file = False
+        self._file_seen = False
+
+        # 文件部分的状态
+        self._head: Optional[bytearray] = bytearray()
+        self._pending = bytearray()
+        self._queue: Optional[asyncio.Queue] = None
+        self._store_task: Optional[asyncio.Task] = None
+
+    def callbacks(self) -> Dict[str, Any]:
+        """解析器回调只记录事件，随后在协程中处理 (写入存储需要 await)"""
+
+        def event(name):
+            return lambda *args: self.events.append((name, args[0][args[1]:args[2]] if args else b""))
+
+        return {name: event(name) for name in (
+            "on_part_begin", "on_part_data", "on_part_end", "on_header_field",
+            "on_header_value", "on_header_end", "on_headers_finished")}
+
+    async def process_events(self):
+        events, self.events = self.events, []
+        for name, data in events:
+            if name == "on_part_data":
+                if self._in_file:
+                    await self._file_data(data)
+                elif self._field_value is not None:
+                    self._field_value += data
+                    if len(self._field_value) > MAX_FIELD_SIZE:
+                        raise UploadRejected(413, "FIELD_TOO_LARGE", f"Form field too large: {self._field_name}")
+            elif name == "on_part_begin":
+                self._headers = {}
+            elif name == "on_header_field":
+                self._header_field += data
+            elif name == "on_header_value":
+                self._header_value += data
+            elif name == "on_header_end":
+                self._headers[self._header_field.decode("latin-1").lower()] = self._header_value.decode("latin-1")
+                self._header_field, self._header_value = b"", b""
+            elif name == "on_headers_finished":
+                self._begin_part()
+            elif name == "on_part_end":
+                await self._end_part()
+
+    def _begin_part(self):
+        _, options = parse_options_header(self._headers.get("content-disposition", ""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        self._field_name, self._field_value, self._in_file = name, None, False
+
+        if name != self.file_field:
+            if filename is None:
+                self._field_value = bytearray()
+            return  # 多余的文件部分：丢弃内容，但仍计入请求体大小
+        if self._file_seen:
+            raise UploadRejected(400, "INVALID_MULTIPART", f"Duplicate file field: {name}")
+
+        content_type = self._headers.get("content-type")
+        if content_type not in self.allowed_types:
+            raise UploadRejected(415, "UNSUPPORTED_FILE_TYPE", f"Unsupported file type: {content_type}")
+        self._file_seen = self._in_file = True
+        self.upload.filename = filename.decode("utf-8", "replace") if filename is not None else ""
+        self.upload.content_type = content_type
+        if not self.store:
+            self.upload.digest = hashlib.sha256()
+        if self.keep_bytes:
+            self.upload.data = bytearray()
+
+    async def _end_part(self):
+        if self._in_file:
+            if self.upload.header is None:
+                await self._check_header(final=True)
+            self._in_file = False
+        elif self._field_value is not None:
+            self.upload.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
+            self._field_value = None
+
+    # ------------------------------------------------------------------
+    # 文件内容
+    # ------------------------------------------------------------------
+    async def _file_data(self, chunk: bytes):
+        upload = self.upload
+        upload.size += len(chunk)
+        if upload.size > self.max_size:
+            raise UploadRejected(413, "FILE_TOO_LARGE", f"File exceeds {self.max_size} bytes")
+        if upload.digest is not None:
+            upload.digest.update(chunk)
+        if upload.data is not None:
+            upload.data += chunk
+
+        if upload.header is None:
+            self._head += chunk
+            await self._check_header(final=False)
+        else:
+            await self._write(chunk)
+
+    async def _check_header(self, final: bool):
+        """头部字节足够时嗅探格式与尺寸；通过后开始写入存储"""
+        head = self._head
+        if final and not head:
+            raise UploadRejected(400, "EMPTY_FILE", "File is empty")
+        if len(head) < MAGIC_BYTES and not final:
+            return
+        header = sniff_image(head)
+        if header is None or header.format not in SUPPORTED_FORMATS:
+            raise UploadRejected(415, "UNSUPPORTED_IMAGE_FORMAT",
+                                 f"Unsupported image format: {header.format if header else 'unknown'}")
+        if header.has_size:
+            if not (self.min_dimension <= header.width <= self.max_dimension
+                    and self.min_dimension <= header.height <= self.max_dimension):
+                raise UploadRejected(400, "INVALID_IMAGE_DIMENSIONS",
+                                     f"Image size {header.width}x{header.height} outside "
+                                     f"[{self.min_dimension}, {self.max_dimension}]")
+        elif not final and len(head) < self.sniff_bytes:
+            return  # 尺寸可能在后续字节中 (如较大的 EXIF 段之后)
+        # 尺寸仍未知时放行，由完整解码后的校验兜底
+
+        self.upload.header = header
+        self._head = None
+        if self.store:
+            self._queue = asyncio.Queue(maxsize=STORAGE_QUEUE_SIZE)
+            self._store_task = asyncio.create_task(
+                storage_service.store_stream(_iter_queue(self._queue), self.upload.content_type))
+        await self._write(head)
+
+    async def _write(self, chunk: bytes, flush: bool = False):
+        """凑满 STORAGE_CHUNK_SIZE 再交给存储，减少线程池调用次数"""
+        if self._queue is None:
+            return
+        self._pending += chunk
+        if len(self._pending) < storage_service.chunk_size and not flush:
+            return
+        block, self._pending = bytes(self._pending), bytearray()
+        if block:
+            await self._put(block)
+
+    async def _put(self, item: Optional[bytes]):
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        # 队列已满：等待存储消费，同时留意写入任务失败 (否则会一直等待)
+        put = asyncio.ensure_future(self._queue.put(item))
+        done, _ = await asyncio.wait({put, self._store_task}, return_when=asyncio.FIRST_COMPLETED)
+        if put not in done:
+            put.cancel()
+            await self._store_task
+            raise RuntimeError("Storage writer stopped unexpectedly")
+
+    async def finish(self) -> StreamedUpload:
+        if not self._file_seen:
+            raise UploadRejected(400, "MISSING_FILE", f"Missing file field: {self.file_field}")
+        if self._in_file:
+            raise UploadRejected(400, "INVALID_MULTIPART", "Incomplete multipart body")
+        if self.upload.size == 0:
+            raise UploadRejected(400, "EMPTY_FILE", "File is empty")
+        # 必填字段可能在文件之后才出现：在结束写入 (提交到存储) 之前检查，缺失时由 abort() 丢弃临时文件
+        missing = [name for name in self.required_fields if not self.upload.fields.get(name)]
+        if missing:
+            raise UploadRejected(400, "MISSING_FIELD", f"Missing form field: {', '.join(missing)}")
+        if self._store_task is not None:
+            await self._write(b"", flush=True)
+            await self._put(None)
+            self.upload.storage_ref = await self._store_task
+        return self.upload
+
+    async def abort(self):
+        """中止写入：取消存储任务，存储后端在取消时删除临时文件"""
+        if self._store_task is not None and not self._store_task.done():
+            self._store_task.cancel()
+            await asyncio.gather(self._store_task, return_exceptions=True)
+
+
+async def receive_image_upload(request: Request,
+                               file_field: str = "file",
+                               max_size: Optional[int] = None,
+                               allowed_types: Optional[Sequence[str]] = None,
+                               min_dimension: int = 1,
+                               max_dimension: Optional[int] = None,
+                               keep_bytes: bool = True,
+                               store: bool = False,
+                               required_fields: Sequence[str] = ()) -> StreamedUpload:
+    """
+    流式接收 multipart/form-data 图像上传，边接收边校验
+
+    Args:
+        request: 原始请求 (请求体尚未被读取)
+        file_field: 图像文件的字段名
+        max_size: 文件大小上限，默认 MAX_FILE_SIZE
+        allowed_types: 允许的 Content-Type，默认 ALLOWED_IMAGE_TYPES
+        min_dimension / max_dimension: 宽高范围 (头部可读出尺寸时在解码前校验)
+        keep_bytes: 是否在内存中保留完整内容 (需要解码推理时为 True)
+        store: 是否边接收边写入内容寻址存储 (结果在 storage_ref 中)
+        required_fields: 必填的表单字段；缺失时在内容提交到存储之前拒绝
+
+    Raises:
+        UploadRejected: 大小、格式、尺寸或 multipart 格式不合法
+    """
+    max_size = max_size or settings.MAX_FILE_SIZE
+    max_body = max_size + settings.UPLOAD_FORM_OVERHEAD
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type.strip().lower() != b"multipart/form-data" or not boundary:
+        raise UploadRejected(400, "INVALID_MULTIPART", "Expected multipart/form-data with a boundary")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise UploadRejected(413, "FILE_TOO_LARGE", f"Request body exceeds {max_body} bytes")
+
+    receiver = _ImagePartReceiver(
+        file_field, max_size,
+        allowed_types if allowed_types is not None else settings.ALLOWED_IMAGE_TYPES,
+        min_dimension, max_dimension or settings.MAX_IMAGE_DIMENSION,
+        settings.UPLOAD_SNIFF_BYTES, keep_bytes, store, required_fields
+    )
+    parser = multipart.MultipartParser(boundary, receiver.callbacks())
+    received = 0
+
+    with stage_timer("receive"):
+        try:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_body:
+                    raise UploadRejected(413, "FILE_TOO_LARGE", f"Request body exceeds {max_body} bytes")
+                parser.write(chunk)
+                await receiver.process_events()
+            parser.finalize()
+            await receiver.process_events()
+            return await receiver.finish()
+        except MultipartParseError as e:
+            await receiver.abort()
+            raise UploadRejected(400, "INVALID_MULTIPART", f"Malformed multipart body: {str(e)}")
+        except BaseException:
+            await receiver.abort()
+            raise
+
+
+def multipart_openapi(file_field: str = "file", fields: Optional[Dict[str, str]] = None,
+                      required: Sequence[str] = ()) -> Dict[str, Any]:
+    """为直接读取 request.stream() 的接口补充 OpenAPI 中的 multipart 请求体描述 (openapi_extra)"""
+    properties: Dict[str, Any] = {file_field: {"type": "string", "format": "binary"}}
+    for name, description in (fields or {}).items():
+        properties[name] = {"type": "string", "description": description}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": properties,
+                               "required": [file_field, *required]}
+                }
+            }
+        }
+    }
@@ -0,0 +1,4 @@
+"""
+性能基准测试模块
+预处理、推理后端与 API 负载测试脚本
+"""
@@ -0,0 +1,343 @@
+"""
+预测接口负载测试 (Prediction API Load Test)
+------------------------------------------
+以可配置的并发度驱动 /api/v1/predict (Base64) 与 /api/v1/upload/predict (multipart)，
+统计每个 (接口, 图像尺寸) 组合的吞吐量、p50/p95/p99 延迟、状态码分布与进程 RSS。
+两种运行方式：
+1. 进程内 (默认)：httpx.ASGITransport 直接调用 main.app，不经过网络与 uvicorn。
+   --model stub   单层卷积，只测 API 开销 (解码 / 校验 / 编码 / 入队)
+   --model unet   随机初始化的完整 U-Net，无需权重文件即可得到真实的推理耗时
+   --model checkpoint  加载 ai_core/bestmodel.pt (与线上一致)
+   进程内模式下 MongoDB 写入替换为空操作 (--persist 保留真实写入)，文件存储关闭，预测缓存关闭；
+   所有请求来自同一个客户端 (ip:127.0.0.1)，因此默认关闭准入控制的限流、并发上限与截止时间 (--admission 保留)。
+2. 远程：--url http://host:8000 压测已启动的服务；--server-pid 可同时采样服务进程的 RSS。
+合成眼底图按 benchmarks.synthetic 生成 (256 / 512 / 1024 / 4096 px)，
+结果写成 JSON (--json) 以便跨提交对比 (--compare 上一次的结果文件)。
+
+用法:
+    python -m benchmarks.bench_load --model unet --sizes 256 512 1024 --concurrency 8 --requests 64 --json bench.json
+    python -m benchmarks.bench_load --url http://localhost:8000 --concurrency 16 --server-pid 1234 --compare bench.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+import psutil
+
+from benchmarks.synthetic import make_fundus_image
+
+ENDPOINTS = {
+    "predict": "/api/v1/predict",
+    "upload": "/api/v1/upload/predict",
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩百分位 (sorted_values 需已排序)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    values = sorted(latencies_ms)
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(statistics.fmean(values), 2),
+        "max": round(values[-1], 2),
+    }
+
+
+class RssSampler:
+    """后台线程定期采样进程 RSS，记录峰值 (MB)"""
+
+    def __init__(self, pid: Optional[int] = None, interval: float = 0.05):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.start_mb = self._rss()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self) -> float:
+        return self.process.memory_info().rss / (1024 * 1024)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.peak_mb = max(self.peak_mb, self._rss())
+            except psutil.Error:
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = self._rss()
+
+    def result(self) -> Dict[str, float]:
+        return {"start": round(self.start_mb, 1), "peak": round(self.peak_mb, 1), "end": round(self.end_mb, 1)}
+
+
+# ----------------------------------------------------------------------
+# 进程内模式：模型与外部依赖
+# ----------------------------------------------------------------------
+class _NullCollection:
+    async def insert_many(self, docs, ordered=True):
+        return None
+
+
+class _NullDatabase:
+    """写后队列的空操作 MongoDB 替身 (不测量数据库本身)"""
+
+    def __getitem__(self, name):
+        return _NullCollection()
+
+
+def build_model(kind: str):
+    import torch
+    from ai_core.Unet import UNet
+
+    if kind == "stub":
+        model = torch.nn.Conv2d(3, 2, kernel_size=1)
+    else:
+        torch.manual_seed(0)
+        model = UNet(3, 2)
+    return model.eval()
+
+
+async def prepare_in_process(args):
+    """配置进程内服务：安装模型，关闭缓存、文件存储与准入控制，按需替换 MongoDB 写入"""
+    from core.rate_limit import admission
+    from services.model_service import model_service
+    from services.prediction_cache import prediction_cache
+    from services.storage_service import storage_service
+    from services import persistence_queue
+
+    prediction_cache.enabled = False
+    storage_service.backend_name = "none"
+    if not args.persist:
+        persistence_queue.db = _NullDatabase()
+    if not args.admission:
+        # 否则测到的主要是单个客户端的 429 / 503 / 504，而不是服务本身
+        admission.limiter.rate = 0
+        admission.max_concurrency = 0
+        admission.request_timeout = 0
+
+    if args.model == "checkpoint":
+        from core.config import settings
+        if not await model_service.load_model(settings.MODEL_PATH):
+            raise SystemExit("❌ 模型加载失败")
+    else:
+        model_service.model = build_model(args.model).to(model_service.device)
+        model_service.model_backend = f"benchmark-{args.model}"
+        model_service.model_loaded = True
+        model_service.executor.start()
+    return model_service
+
+
+# ----------------------------------------------------------------------
+# 压测
+# ----------------------------------------------------------------------
+def encode_image_bytes(image, image_format: str) -> bytes:
+    import cv2
+
+    success, encoded = cv2.imencode(f".{image_format}", image)
+    if not success:
+        raise RuntimeError(f"{image_format} 编码失败")
+    return encoded.tobytes()
+
+
+def build_request(endpoint: str, data: bytes, args) -> Dict[str, Any]:
+    """返回 httpx 请求参数；output_format=none 时响应只含指标，避免把掩码传输计入客户端开销"""
+    params = {"output_format": "none"}
+    if endpoint == "predict":
+        body = {"image_data": base64.b64encode(data).decode("ascii"), "image_format": args.image_format}
+        if args.mode:
+            body["inference_mode"] = args.mode
+        return {"json": body, "params": params}
+    form = {"inference_mode": args.mode} if args.mode else {}
+    content_type = "image/png" if args.image_format == "png" else "image/jpeg"
+    return {"files": {"file": (f"bench.{args.image_format}", data, content_type)}, "data": form, "params": params}
+
+
+async def run_scenario(client: httpx.AsyncClient, endpoint: str, images: List[bytes], args) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    errors: Counter = Counter()
+    counter = iter(range(args.requests))
+
+    async def worker():
+        for i in counter:
+            kwargs = build_request(endpoint, images[i % len(images)], args)
+            start = time.perf_counter()
+            try:
+                response = await client.post(ENDPOINTS[endpoint], **kwargs)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    detail = response.json().get("detail") if "json" in response.headers.get("content-type", "") else None
+                    code = detail.get("error_code") if isinstance(detail, dict) else None
+                    errors[code or f"HTTP_{response.status_code}"] += 1
+            except httpx.HTTPError as e:
+                statuses["exception"] += 1
+                errors[type(e).__name__] += 1
+
+    # 预热 (首个请求会创建线程缓冲区、启动微批调度器)
+    for _ in range(args.warmup):
+        await client.post(ENDPOINTS[endpoint], **build_request(endpoint, images[0], args))
+
+    with RssSampler(args.server_pid) as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "ok": len(latencies),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+        "errors": dict(errors),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "rss_mb": rss.result(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(report: Dict[str, Any], baseline: Dict[str, Any]):
+    """按 (接口, 尺寸) 打印吞吐量与 p95 相对基线的变化"""
+    base = {(r["endpoint"], r["size"]): r for r in baseline.get("results", [])}
+    print(f"🔍 对比基线: {baseline.get('meta', {}).get('commit')}")
+    for row in report["results"]:
+        old = base.get((row["endpoint"], row["size"]))
+        if old is None:
+            continue
+        rps_old, rps_new = old["throughput_rps"], row["throughput_rps"]
+        p95_old, p95_new = old["latency_ms"]["p95"], row["latency_ms"]["p95"]
+        rps_delta = (rps_new / rps_old - 1) * 100 if rps_old else 0.0
+        print(f"   {row['endpoint']:>7} {row['size']:>5}px | {rps_old:8.2f} -> {rps_new:8.2f} req/s "
+              f"({rps_delta:+.1f}%) | p95 {p95_old:9.2f} -> {p95_new:9.2f} ms")
+
+
+async def _main(args) -> Dict[str, Any]:
+    from core.config import settings
+
+    images = {
+        size: [encode_image_bytes(make_fundus_image((size, size), seed=seed), args.image_format)
+               for seed in range(args.variants)]
+        for size in args.sizes
+    }
+    print(f"🖼️ 合成图像已生成: {', '.join(f'{s}px' for s in args.sizes)} (每种 {args.variants} 张)")
+    for size, payloads in images.items():
+        if max(len(p) for p in payloads) > settings.MAX_FILE_SIZE:
+            print(f"⚠️ {size}px 图像超过 MAX_FILE_SIZE，上传接口将返回 400 (可改用 --image-format jpg)")
+
+    service = None
+    if args.url:
+        transport = None
+        base_url = args.url.rstrip("/")
+    else:
+        service = await prepare_in_process(args)
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://benchmark"
+
+    results = []
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+            for endpoint in args.endpoints:
+                for size in args.sizes:
+                    row = await run_scenario(client, endpoint, images[size], args)
+                    row.update({"endpoint": endpoint, "size": size})
+                    results.append(row)
+                    lat = row["latency_ms"]
+                    print(f"📊 {endpoint:>7} {size:>5}px | {row['throughput_rps']:8.2f} req/s | "
+                          f"p50 {lat['p50']:8.2f} | p95 {lat['p95']:8.2f} | p99 {lat['p99']:8.2f} ms | "
+                          f"ok {row['ok']}/{row['requests']} | RSS peak {row['rss_mb']['peak']:.0f} MB")
+    finally:
+        if service is not None:
+            from services.persistence_queue import write_behind
+            await service.shutdown()
+            await write_behind.stop()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "target": args.url or "in-process",
+            "model": None if args.url else args.model,
+            "inference_mode": args.mode or "default",
+            "image_format": args.image_format,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "batching": service.get_service_stats()["batching"] if service is not None else None,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预测接口负载测试")
+    parser.add_argument("--url", help="压测已启动的服务 (如 http://localhost:8000)；默认进程内 ASGI")
+    parser.add_argument("--model", choices=("stub", "unet", "checkpoint"), default="unet",
+                        help="进程内模式使用的模型")
+    parser.add_argument("--persist", action="store_true", help="进程内模式保留真实的 MongoDB 写入")
+    parser.add_argument("--admission", action="store_true",
+                        help="进程内模式保留限流、推理并发上限与截止时间 (默认关闭)")
+    parser.add_argument("--endpoints", nargs="+", choices=tuple(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 512, 1024, 4096])
+    parser.add_argument("--mode", choices=("resize", "tiled", "auto"), default=None, help="推理模式")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64, help="每个 (接口, 尺寸) 的请求数")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--image-format", choices=("png", "jpg"), default="png")
+    parser.add_argument("--variants", type=int, default=4, help="每种尺寸的不同图像数")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--server-pid", type=int, default=None, help="远程模式下采样 RSS 的服务进程 PID")
+    parser.add_argument("--json", help="结果输出为 JSON 文件")
+    parser.add_argument("--compare", help="用于对比的上一次结果 JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 结果已写入 {args.json}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
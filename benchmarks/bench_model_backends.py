@@ -0,0 +1,88 @@
+"""
+模型后端延迟基准 (Eager vs Frozen TorchScript)
+---------------------------------------------
+在 CPU 上对比以下后端的前向延迟：
+- eager:  torch.load 的原始 pickle 模型
+- frozen: python -m ai_core.export 导出的冻结 TorchScript 模型 (Conv+BN 已折叠)
+输入形状：
+- 512x512 单张 (缩放模式)
+- TILE_BATCH_SIZE 张 TILE_SIZE 图块 (分块模式的一组)
+
+用法:
+    python -m benchmarks.bench_model_backends [--checkpoint ai_core/bestmodel.pt] [--iterations 20] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import torch
+
+from ai_core.export import AI_CORE_PATH, export_frozen, load_checkpoint, optimized_model_path
+from core.config import settings
+
+
+def time_forward(model, batch: torch.Tensor, iterations: int, warmup: int = 3) -> dict:
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(sorted(timings)[max(0, int(len(timings) * 0.95) - 1)], 2),
+        "per_image_ms": round(statistics.median(timings) / batch.shape[0], 2),
+    }
+
+
+def build_backends(checkpoint: str) -> dict:
+    """返回 {后端名称: 模型}；冻结模型不存在时现场导出 (不落盘)"""
+    example = torch.rand(1, 3, 512, 512)
+    frozen_path = optimized_model_path(checkpoint)
+    if os.path.exists(frozen_path):
+        frozen = torch.jit.load(frozen_path, map_location="cpu").eval()
+    else:
+        frozen = export_frozen(load_checkpoint(checkpoint), example)
+    return {
+        "eager": load_checkpoint(checkpoint),
+        "frozen": frozen,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型后端 CPU 延迟基准")
+    parser.add_argument("--checkpoint", default=os.path.join(AI_CORE_PATH, "bestmodel.pt"))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op 线程数，0 表示默认")
+    parser.add_argument("--json", help="结果输出为 JSON 文件")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    shapes = {
+        "512x512": torch.rand(1, 3, 512, 512),
+        f"tiled {settings.TILE_BATCH_SIZE}x{settings.TILE_SIZE}": torch.rand(
+            settings.TILE_BATCH_SIZE, 3, settings.TILE_SIZE, settings.TILE_SIZE),
+    }
+
+    results = {}
+    for backend, model in build_backends(args.checkpoint).items():
+        results[backend] = {}
+        for name, batch in shapes.items():
+            stats = time_forward(model, batch, args.iterations)
+            results[backend][name] = stats
+            print(f"{backend:>8} | {name:<16} | median {stats['median_ms']:9.2f} ms | "
+                  f"p95 {stats['p95_ms']:9.2f} ms | {stats['per_image_ms']:8.2f} ms/img")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+预处理微基准 (Preprocessing Microbenchmark)
+------------------------------------------
+对比原始逐步预处理 (cvtColor -> resize -> astype -> min/max -> 归一化 -> transpose -> from_numpy)
+与 services.preprocessing.Preprocessor 的融合实现：
+- 每张图的预处理耗时 (中位数 / 平均)
+- 每次调用的临时内存峰值 (tracemalloc，numpy 与 OpenCV 的数组分配都会被追踪)
+- 折算成「整幅 float32 输入」的临时数组个数
+
+用法:
+    python -m benchmarks.bench_preprocess --sizes 512 1024 2048 --iterations 200 [--json out.json]
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+
+from benchmarks.synthetic import make_fundus_image
+from services.preprocessing import Preprocessor
+
+
+def legacy_preprocess(image: np.ndarray) -> torch.Tensor:
+    """原 ModelService.predict 中的预处理实现 (对照组)"""
+    img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    img_resized = cv2.resize(img_rgb, (512, 512))
+
+    img_float = img_resized.astype(np.float32)
+    min_val = np.min(img_float)
+    max_val = np.max(img_float)
+    if max_val - min_val > 1e-5:
+        img_normalized = (img_float - min_val) / (max_val - min_val)
+    else:
+        img_normalized = img_float / 255.0
+
+    img_transposed = img_normalized.transpose((2, 0, 1))
+    return torch.from_numpy(np.ascontiguousarray(img_transposed)).unsqueeze(0)
+
+
+def measure(fn, image: np.ndarray, iterations: int) -> dict:
+    # 预热 (首次调用会分配复用缓冲区)
+    for _ in range(3):
+        fn(image)
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(image)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    temp_bytes = max(0, peak - base)
+    full_input_bytes = 3 * 512 * 512 * 4
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "peak_temp_bytes": temp_bytes,
+        "full_image_temporaries": round(temp_bytes / full_input_bytes, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预处理微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--json", help="结果输出为 JSON 文件")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    preprocessor = Preprocessor(input_size=(512, 512))
+    slot = preprocessor.batch_buffer(1, (3, 512, 512))
+
+    def fused(image):
+        preprocessor.resize_into(image, slot[0])
+
+    results = []
+    for size in args.sizes:
+        image = make_fundus_image((size, size))
+
+        # 两种实现的输出应一致 (仅有浮点舍入差异)
+        fused(image)
+        max_diff = float(np.abs(legacy_preprocess(image)[0].numpy() - slot[0]).max())
+
+        row = {
+            "size": size,
+            "max_abs_diff": max_diff,
+            "before": measure(legacy_preprocess, image, args.iterations),
+            "after": measure(fused, image, args.iterations),
+        }
+        results.append(row)
+        print(f"{size:>5}px | before {row['before']['median_ms']:8.3f} ms, "
+              f"{row['before']['full_image_temporaries']:5.2f} temps | "
+              f"after {row['after']['median_ms']:8.3f} ms, "
+              f"{row['after']['full_image_temporaries']:5.2f} temps | diff {max_diff:.2e}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+合成眼底图像生成 (与 frontend_demo/create_test_data.py 的绘制方式一致)
+用于基准测试，不依赖真实数据集。
+"""
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def make_fundus_image(size: Tuple[int, int], seed: int = 0) -> np.ndarray:
+    """
+    生成 (高, 宽, 3) 的 BGR 合成眼底图
+
+    Args:
+        size: (宽, 高)
+        seed: 随机种子，保证同一尺寸的图像可复现
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+
+    # 眼底背景 + 视盘
+    center = (width // 2, height // 2)
+    cv2.circle(image, center, min(width, height) // 2 - 4, (40, 60, 150), -1)
+    cv2.circle(image, center, min(width, height) // 12, (150, 190, 230), -1)
+
+    # 从视盘辐射出的血管
+    thickness = max(1, min(width, height) // 170)
+    for j in range(8):
+        angle = j * 45 + rng.uniform(-10, 10)
+        end_x = center[0] + int(np.cos(np.radians(angle)) * min(width, height) // 3)
+        end_y = center[1] + int(np.sin(np.radians(angle)) * min(width, height) // 3)
+        cv2.line(image, center, (end_x, end_y), (20, 30, 110), thickness)
+
+    # 轻微噪声，避免 PNG 压缩得过小
+    noise = rng.integers(0, 8, size=image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    success, encoded = cv2.imencode(".png", image)
+    if not success:
+        raise RuntimeError("PNG 编码失败")
+    return encoded.tobytes()
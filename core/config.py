@@ -1,5 +1,5 @@
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -28,14 +28,111 @@ class Settings(BaseSettings):
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_IMAGE_TYPES: List[str] = ["image/jpeg", "image/jpg", "image/png", "image/tiff", "image/gif", "image/tif"]
     MAX_IMAGE_DIMENSION: int = 4096  # 最大图像尺寸
+    UPLOAD_SNIFF_BYTES: int = 64 * 1024  # 流式上传时用于嗅探格式与尺寸的头部字节数上限
+    UPLOAD_FORM_OVERHEAD: int = 64 * 1024  # 请求体中除图像外允许的表单字段与 multipart 边界字节数
 
     # 模型配置
     MODEL_PATH: str = "models/retina_unet.pth"
     MODEL_INPUT_SIZE: tuple = (512, 512)
+    MODEL_PREFER_OPTIMIZED: bool = True  # 存在 bestmodel.frozen.pt 时优先加载冻结的 TorchScript 模型
+    MODEL_DEFAULT_PRECISION: str = "fp32"  # fp32 / int8 / bf16
+    MODEL_PRECISION_BY_VERSION: Dict[str, str] = {}  # 按模型版本覆盖推理精度，如 {"1.0.0-release": "int8"}
+    QUANTIZATION_BACKEND: str = "x86"  # int8 量化后端 (需与导出时一致)
 
-    # 性能配置
-    MAX_REQUESTS_PER_MINUTE: int = 60
-    REQUEST_TIMEOUT: int = 30
+    # 模型注册表配置 (多版本常驻、按请求选择版本、后台加载后原子切换)
+    MODEL_VERSION: str = "1.0.0-release"  # 启动时加载并默认服务的版本 (权重为 MODEL_PATH)
+    MODEL_ARTIFACT_DIR: str = "models/artifacts"  # 注册版本的权重文件必须位于该目录内 (相对路径相对该目录解析)
+    MODEL_ADMIN_TOKEN: str = ""  # 模型管理接口 (注册 / 加载 / 切换 / 卸载 / 影子) 的凭据 (X-Admin-Token 请求头)，为空表示禁用这些接口
+    MODEL_MEMORY_BUDGET_MB: int = 2048  # 常驻模型权重的内存预算，超出时按 LRU 卸载 (默认版本除外)；0 表示不限
+    MODEL_MAX_RESIDENT: int = 3  # 同时常驻的模型版本数上限
+    MODEL_LOAD_ON_DEMAND: bool = False  # 预测请求指定的版本未常驻时按需加载；默认只有管理接口可加载，未常驻返回 404
+    MODEL_DRAIN_TIMEOUT: float = 30.0  # 卸载前等待该版本在途请求完成的最长时间 (秒)
+    MODEL_LIFECYCLE_HISTORY: int = 50  # 保留的加载 / 卸载 / 切换记录条数
+
+    # 影子推理配置 (抽样线上请求在候选版本上低优先级重跑并对比)
+    SHADOW_MODEL_VERSION: str = ""  # 候选版本，空表示关闭 (也可通过 /models/{version}/shadow 运行时设置)
+    SHADOW_SAMPLE_RATE: float = 0.0  # 抽样比例 0~1
+    SHADOW_MAX_PENDING: int = 4  # 等待执行的影子任务上限，超出直接丢弃
+    SHADOW_PRESSURE_THRESHOLD: float = 0.25  # 在途推理请求数 >= 该比例 * INFERENCE_MAX_QUEUE 时丢弃影子任务
+    SHADOW_PERSIST: bool = True  # 对比结果写入 predictions 集合 (result_data.shadow=True)
+
+    # 推理模式配置
+    INFERENCE_MODE: str = "resize"  # resize: 缩放到 512 推理; tiled: 全分辨率重叠分块; auto: 按尺寸自动选择
+    TILE_SIZE: int = 512  # 图块边长 (需为 16 的倍数)
+    TILE_OVERLAP: int = 64  # 相邻图块重叠像素
+    TILE_BATCH_SIZE: int = 4  # 每组同时送入推理的图块数 (限制峰值内存)
+    TILE_AUTO_THRESHOLD: int = 1024  # auto 模式下长边超过该值时使用分块推理
+
+    # 测试时增强 (TTA) 配置
+    TTA_MAX_VIEWS: int = 8  # 单个请求的测试时增强视图数上限 (推理成本按视图数倍增)
+
+    # 推理执行器配置 (推理在专用线程池中执行，不阻塞事件循环)
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_TORCH_THREADS: int = 0  # 0 = 自动 (CPU 核数 / 推理线程数)
+    INFERENCE_MAX_QUEUE: int = 32  # 在途推理请求上限，超出返回 503
+    INFERENCE_RETRY_AFTER: int = 2  # 503 响应中的 Retry-After (秒)
+    INFERENCE_EXECUTOR: str = "thread"  # thread: 进程内线程池; process: 多进程推理池 (共享内存权重)
+    INFERENCE_PROCESSES: int = 4  # 多进程模式下的推理子进程数
+
+    # 微批调度配置 (并发请求合并为一次前向推理)
+    BATCH_ENABLED: bool = True
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: float = 10.0
+
+    # 预测结果缓存配置 (按图像内容 + 模型版本 + 推理参数缓存)
+    CACHE_MEMORY_MAX_MB: int = 256  # 内存 LRU 层容量，0 表示关闭
+    CACHE_DISK_DIR: Optional[str] = None  # 磁盘层目录，为空表示关闭
+    CACHE_DISK_MAX_MB: int = 2048  # 磁盘层容量上限
+
+    # 写后持久化配置 (预测记录批量写入 MongoDB，不阻塞响应)
+    PERSIST_BATCH_SIZE: int = 100  # 每次 insert_many 的最大文档数
+    PERSIST_FLUSH_INTERVAL_MS: float = 200.0  # 凑批等待窗口
+    PERSIST_MAX_QUEUE: int = 10000  # 内存队列上限，超出直接写入本地日志
+    PERSIST_JOURNAL_PATH: str = "data/persistence_journal.jsonl"  # MongoDB 不可达时的本地日志
+    PERSIST_RETRY_INTERVAL: float = 30.0  # 日志重放间隔 (秒)
+    PERSIST_SHUTDOWN_TIMEOUT: float = 10.0  # 关闭时排空队列的最长等待 (秒)
+
+    # 文件存储配置 (原图与掩码按内容 SHA-256 去重存储)
+    STORAGE_BACKEND: str = "local"  # local: 本地目录; gridfs: MongoDB GridFS; none: 不保存文件
+    STORAGE_DIR: str = "uploads/blobs"  # local 后端的根目录
+    STORAGE_GRIDFS_BUCKET: str = "blobs"  # gridfs 后端的 bucket 名
+    STORAGE_CHUNK_SIZE: int = 256 * 1024  # 流式读写的分块大小
+    STORAGE_SAVE_ORIGINALS: bool = True  # 预测接口是否保存原图
+
+    # 异步任务配置 (批量 / 长耗时分割)
+    JOB_WORKER_ENABLED: bool = True  # 是否在本进程内运行任务工作者 (单机部署)
+    JOB_MAX_CONCURRENT_JOBS: int = 1  # 本工作者同时执行的任务数
+    JOB_ITEM_CONCURRENCY: int = 2  # 单个任务内并行处理的图像数
+    JOB_MAX_ITEMS: int = 500  # 单个任务的图像数上限 (含 zip 内文件)
+    JOB_MAX_ACTIVE: int = 50  # 排队中 + 执行中的任务上限，超出返回 429
+    JOB_LEASE_SECONDS: float = 120.0  # 任务租约时长，工作进程崩溃后超时由其他进程接管
+    JOB_POLL_INTERVAL: float = 2.0  # 工作者轮询新任务的间隔 (秒)
+    JOB_RESULT_POLL_INTERVAL: float = 0.5  # 结果流接口检查新结果的间隔 (秒)
+
+    # 启动预热配置 (首个请求不再承担内核初始化与缓冲区分配)
+    WARMUP_ENABLED: bool = True
+    WARMUP_BATCH_SIZES: List[int] = []  # 预热的批大小，空表示 1..BATCH_MAX_SIZE 全部 (未启用微批时为 1)
+
+    # 系统监控配置 (后台采样，健康检查接口读取缓存快照)
+    SYSTEM_STATS_INTERVAL: float = 5.0  # 采样间隔 (秒)
+    SYSTEM_STATS_HISTORY: int = 120  # 保留的历史快照条数
+    SYSTEM_STATS_CONNECTIONS_INTERVAL: float = 60.0  # net_connections 刷新间隔 (秒)，0 表示不统计
+    MONGO_PING_TIMEOUT: float = 2.0  # 就绪检查中 MongoDB ping 的超时 (秒)
+
+    # 运行指标配置
+    METRICS_ENABLED: bool = True  # 是否提供 /metrics (Prometheus 文本格式)
+
+    # 性能配置 (请求准入控制，见 core/rate_limit.py)
+    MAX_REQUESTS_PER_MINUTE: int = 60  # 每个客户端的令牌补充速率 (令牌/分钟)，0 表示不限流
+    REQUEST_TIMEOUT: int = 30  # 推理接口的截止时间 (秒)，超时取消排队中的推理并返回 504；0 表示不限
+    RATE_LIMIT_BURST: int = 0  # 令牌桶容量 (允许的突发量)，0 表示等于 MAX_REQUESTS_PER_MINUTE
+    RATE_LIMIT_COST_PIXELS: int = 1048576  # 推理请求每多少像素计 1 个令牌 (4K 图约 16 个，最少 1 个)
+    RATE_LIMIT_MAX_CLIENTS: int = 10000  # 内存中保留的客户端令牌桶数 (LRU)
+    RATE_LIMIT_API_KEYS: List[str] = []  # 已登记的 API Key (X-API-Key 头)，各自独立限流；未登记的 Key 按客户端 IP 限流
+    INFERENCE_MAX_CONCURRENCY: int = 16  # 推理接口的全局并发上限 (0 = 不限制)
+    ADMISSION_MAX_WAIT: float = 5.0  # 等待推理并发名额的最长时间 (秒)，超时返回 503
+    ADMISSION_EXEMPT_PATHS: List[str] = ["/health", "/info", "/system", "/metrics", "/docs", "/redoc",
+                                         "/openapi.json"]  # 不限流的路径前缀
 
     class Config:
         env_file = ".env"
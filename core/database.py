@@ -16,6 +16,7 @@ reports_collection = db["reports"]
 images_collection = db["images"]
 predictions_collection = db["predictions"]
 models_collection = db["models"]
+jobs_collection = db["jobs"]
 
 
 async def init_db():
@@ -26,4 +27,13 @@ async def init_db():
 
     await images_collection.create_index("user_id")
     await predictions_collection.create_index("image_id")
+
+    # 键集分页使用的复合索引：等值字段 + (时间, _id) 倒序
+    await images_collection.create_index([("patient_id", 1), ("uploaded_at", -1), ("_id", -1)])
+    await predictions_collection.create_index([("image_id", 1), ("created_at", -1), ("_id", -1)])
+    await predictions_collection.create_index([("patient_id", 1), ("created_at", -1), ("_id", -1)])
+    await models_collection.create_index([("trained_at", -1), ("_id", -1)])
+
+    # 异步任务：工作进程按 状态 + 创建时间 领取任务
+    await jobs_collection.create_index([("status", 1), ("created_at", 1)])
     await models_collection.create_index("model_version", unique=True)
\ No newline at end of file
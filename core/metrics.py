@@ -0,0 +1,316 @@
+"""
+运行指标模块 (Prometheus Metrics)
+--------------------------------
+原先只有响应头 X-Process-Time、中间件日志和 prediction_count 计数，无法看出时间花在请求路径的哪一段。
+本模块提供轻量的 Counter / Gauge / Histogram，以 Prometheus 文本格式在 /metrics 导出：
+1. 热路径上的开销只有一次 perf_counter 差值、一次 bisect 和一次加锁自增，不分配对象。
+2. 带标签的指标按标签值缓存子序列 (labels() 之后的 observe 不再查表可直接复用)。
+3. 队列深度、缓存占用等已有 get_stats() 的数值不在热路径更新，而是在抓取时通过回调读取。
+未引入 prometheus_client 依赖；输出遵循 text/plain; version=0.0.4 格式。
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认的延迟分桶 (秒)：覆盖亚毫秒级的阈值化到数秒级的 4K 分块推理
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """指标基类：管理标签子序列与注册"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values: str) -> "_Metric":
+        """返回某组标签值对应的子序列 (首次访问时创建)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}，收到 {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def _series(self) -> Iterable[Tuple[Tuple[str, ...], "_Metric"]]:
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+
+    def _new_child(self) -> "Counter":
+        child = Counter.__new__(Counter)
+        child._lock = threading.Lock()
+        child._value = 0.0
+        return child
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total counter"]
+        for labelvalues, child in self._series():
+            lines.append(f"{self.name}_total{_label_str(self.labelnames, labelvalues)} "
+                         f"{_format_value(child._value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值；传入 fn 时在抓取时调用 fn() 取值"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None, fn: Callable[[], float] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._value = 0.0
+        self._fn = fn
+
+    def _new_child(self) -> "Gauge":
+        child = Gauge.__new__(Gauge)
+        child._lock = threading.Lock()
+        child._value = 0.0
+        child._fn = None
+        return child
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        if self._fn is not None:
+            return float(self._fn())
+        return self._value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labelvalues, child in self._series():
+            try:
+                value = child.value
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_label_str(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """累积分桶直方图 (导出 _bucket / _sum / _count)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self._buckets = tuple(sorted(float(b) for b in buckets))
+        self._init_state()
+
+    def _init_state(self):
+        # 每个桶只记录落在 (上一个上界, 本上界] 的次数，导出时再累加，observe 只改一个槽位
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        child = Histogram.__new__(Histogram)
+        child._lock = threading.Lock()
+        child._buckets = self._buckets
+        child._init_state()
+        return child
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """with hist.time(): ... 记录代码块耗时 (秒)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, child in self._series():
+            with child._lock:
+                counts = list(child._counts)
+                total_sum = child._sum
+            cumulative = 0
+            for bound, count in zip(child._buckets + (math.inf,), counts):
+                cumulative += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, labelvalues, le)} {cumulative}")
+            label = _label_str(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{label} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{label} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表：按注册顺序导出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"指标重复注册: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表
+registry = MetricsRegistry()
+
+# === 请求路径各阶段耗时 ===
+# stage: b64decode / decode / validate / preprocess / forward / postprocess / png_encode / db_save
+STAGE_SECONDS = Histogram(
+    "retina_stage_duration_seconds", "Time spent in each stage of the prediction path",
+    ["stage"], registry=registry
+)
+REQUEST_SECONDS = Histogram(
+    "retina_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], registry=registry
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "retina_http_requests_in_flight", "HTTP requests currently being processed", registry=registry
+)
+ERRORS = Counter(
+    "retina_errors", "Error responses by error_code", ["error_code"], registry=registry
+)
+PREDICTIONS = Counter(
+    "retina_predictions", "Model predictions by inference mode and outcome", ["mode", "status"],
+    registry=registry
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "retina_model_load_seconds", "Duration of the last model load", registry=registry
+)
+MODEL_LOADED = Gauge(
+    "retina_model_loaded", "1 if the segmentation model is loaded", registry=registry
+)
+MODEL_LIFECYCLE_SECONDS = Histogram(
+    "retina_model_lifecycle_seconds", "Duration of model registry load / warmup / unload operations",
+    ["action"], registry=registry, buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+ADMISSION_REJECTIONS = Counter(
+    "retina_admission_rejections", "Requests rejected or cancelled by admission control, by reason",
+    ["reason"], registry=registry
+)
+SHADOW_RUNS = Counter(
+    "retina_shadow_runs", "Shadow inference runs by outcome (completed / shed_* / error)", ["outcome"],
+    registry=registry
+)
+SHADOW_DICE = Histogram(
+    "retina_shadow_dice", "Dice between baseline and candidate masks", registry=registry,
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99, 0.995, 1.0)
+)
+SHADOW_CONFIDENCE_DELTA = Histogram(
+    "retina_shadow_confidence_delta", "Candidate minus baseline mean vessel probability", registry=registry,
+    buckets=(-0.1, -0.05, -0.02, -0.01, -0.005, 0.0, 0.005, 0.01, 0.02, 0.05, 0.1)
+)
+SHADOW_LATENCY_DELTA_SECONDS = Histogram(
+    "retina_shadow_latency_delta_seconds", "Candidate minus baseline prediction latency", registry=registry,
+    buckets=(-1.0, -0.25, -0.1, -0.05, -0.01, 0.0, 0.01, 0.05, 0.1, 0.25, 1.0)
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """with stage_timer("decode"): ... 记录请求路径某一阶段的耗时"""
+    child = STAGE_SECONDS.labels(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        child.observe(time.perf_counter() - start)
+
+
+def register_stats_gauges(prefix: str, documentation: str, stats_fn: Callable[[], Dict], keys: Sequence[str]):
+    """
+    把已有 get_stats() 字典中的数值导出为 Gauge (抓取时读取，热路径零开销)
+    例: register_stats_gauges("retina_cache", "...", prediction_cache.get_stats, ["memory_items"])
+    """
+    for key in keys:
+        name = f"{prefix}_{key}"
+        if registry.get(name) is not None:
+            continue
+        Gauge(name, f"{documentation} ({key})", registry=registry,
+              fn=lambda key=key: stats_fn().get(key, 0) or 0)
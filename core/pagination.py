@@ -0,0 +1,130 @@
+"""
+游标分页模块 (Keyset Pagination)
+-------------------------------
+列表查询原先统一 to_list(length=100) 并返回完整文档：超过 100 条的结果被静默截断，且每个字段都加载进内存。
+本模块提供基于 (时间字段, _id) 的键集分页：
+1. 按 时间字段 降序、_id 降序排序 (_id 作为同一时间戳下的决胜键)，由复合索引支撑。
+2. 下一页的起点编码为不透明游标 (after)，查询条件为「严格排在游标之后」，翻页开销与页码无关。
+3. fields 参数转换为 MongoDB 投影，只取需要的字段。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from bson.objectid import ObjectId
+
+# 单页条数上限
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 流式输出时每次从 MongoDB 取回的文档数
+STREAM_BATCH_SIZE = 200
+
+
+class InvalidCursorError(ValueError):
+    """after 游标无法解析"""
+
+
+def encode_cursor(doc: Dict[str, Any], sort_field: str) -> str:
+    """把文档的 (sort_field, _id) 编码为 URL 安全的游标字符串"""
+    value = doc.get(sort_field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps({"v": value, "id": str(doc["_id"])}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    """解析游标，返回 (排序字段值, _id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value = data["v"]
+        if isinstance(value, dict) and "$date" in value:
+            value = datetime.fromisoformat(value["$date"])
+        return value, ObjectId(data["id"])
+    except Exception as e:
+        raise InvalidCursorError(f"无效的分页游标: {cursor}") from e
+
+
+def keyset_filter(query: Dict[str, Any], sort_field: str, after: Optional[str]) -> Dict[str, Any]:
+    """在查询条件上追加「排在游标之后」的条件 (降序)"""
+    if not after:
+        return query
+    value, last_id = decode_cursor(after)
+    return {
+        **query,
+        "$or": [
+            {sort_field: {"$lt": value}},
+            {sort_field: value, "_id": {"$lt": last_id}},
+        ],
+    }
+
+
+def build_projection(fields: Optional[str], allowed: Sequence[str], sort_field: str) -> Optional[Dict[str, int]]:
+    """
+    把逗号分隔的字段列表转换为投影
+    未知字段被忽略；排序字段始终保留 (生成下一页游标需要)。为空时返回 None (完整文档)。
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip() in allowed]
+    projection = {name: 1 for name in names}
+    projection[sort_field] = 1
+    return projection
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if not limit or limit <= 0:
+        return DEFAULT_PAGE_SIZE
+    return min(int(limit), MAX_PAGE_SIZE)
+
+
+def serialize_doc(value: Any) -> Any:
+    """ObjectId 转字符串、datetime 转 ISO 格式，便于 JSON / NDJSON 输出"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: serialize_doc(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [serialize_doc(v) for v in value]
+    return value
+
+
+async def find_page(collection, query: Dict[str, Any], sort_field: str,
+                    limit: Optional[int] = None, after: Optional[str] = None,
+                    projection: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    查询一页文档
+    多取一条用于判断是否还有下一页；返回 {"items", "next_cursor", "has_more"}。
+    """
+    limit = clamp_limit(limit)
+    cursor = (collection.find(keyset_filter(query, sort_field, after), projection)
+              .sort([(sort_field, -1), ("_id", -1)])
+              .limit(limit + 1))
+    docs: List[Dict[str, Any]] = await cursor.to_list(length=limit + 1)
+
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "items": docs,
+        "next_cursor": encode_cursor(docs[-1], sort_field) if has_more else None,
+        "has_more": has_more,
+    }
+
+
+async def iter_documents(collection, query: Dict[str, Any], sort_field: str,
+                         after: Optional[str] = None,
+                         projection: Optional[Dict[str, int]] = None,
+                         limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """按相同排序逐条迭代文档 (流式输出用)，limit 为空时不限制条数"""
+    cursor = (collection.find(keyset_filter(query, sort_field, after), projection)
+              .sort([(sort_field, -1), ("_id", -1)])
+              .batch_size(STREAM_BATCH_SIZE))
+    if limit:
+        cursor = cursor.limit(int(limit))
+    async for doc in cursor:
+        yield doc
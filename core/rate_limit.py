@@ -0,0 +1,365 @@
+"""
+请求准入控制模块 (Admission Control)
+----------------------------------
+settings.MAX_REQUESTS_PER_MINUTE 与 REQUEST_TIMEOUT 原先只是配置项，单个客户端批量上传即可占满推理资源。
+本模块提供 ASGI 中间件，在请求进入路由之前完成准入：
+1. 按客户端的令牌桶限流：X-API-Key 在 RATE_LIMIT_API_KEYS 中登记时按 Key 计数，否则一律按客户端 IP 计数
+   (未经校验的请求头不能作为身份，否则每次换一个值即可绕过限流并挤占其他客户端的令牌桶)。
+   只对修改类请求 (POST / PUT / PATCH / DELETE) 计费，列表查询与任务进度轮询等 GET 请求不扣令牌。
+   每个请求先扣 1 个令牌；推理接口在解码出图像尺寸后按像素数补扣 (每 RATE_LIMIT_COST_PIXELS 像素 1 个令牌)，
+   4K 图像的成本约为普通眼底图的十几倍。令牌不足返回 429 + Retry-After。
+2. 推理接口的全局并发上限 (INFERENCE_MAX_CONCURRENCY，0 表示不限)：超出的请求最多等待 ADMISSION_MAX_WAIT 秒，仍无名额返回 503。
+3. 截止时间传递：推理请求的截止时间取 REQUEST_TIMEOUT 与客户端 X-Request-Timeout 头的较小值，
+   存入 request_deadline 上下文变量。微批调度器在组批后、推理执行器在任务开始执行前检查该截止时间，
+   已过期的输入不再进入前向推理 (抛出 DeadlineExceeded，接口层返回 504)；
+   超时或客户端断开时同时取消请求任务，排队中的微批条目 (Future 已取消) 随之被丢弃。
+   请求中惰性启动的后台协程 (微批调度、影子推理、模型加载) 会继承上下文，需在开始时清除截止时间。
+4. 所有拒绝计入 retina_admission_rejections{reason} 与 retina_errors{error_code}。
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+# 当前推理请求的截止时间 (event loop 时间)，请求之外为 None
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+# 只读请求不计入限流
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class DeadlineExceeded(Exception):
+    """请求已超过截止时间，排队中的推理不再执行"""
+
+    def __init__(self):
+        super().__init__("请求处理超时，已取消")
+
+
+class RateLimitExceeded(Exception):
+    """客户端令牌不足，调用方应在 retry_after 秒后重试"""
+
+    def __init__(self, key: str, retry_after: float):
+        self.key = key
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"请求过于频繁，请 {self.retry_after}s 后重试")
+
+
+class TokenBucketLimiter:
+    """
+    按客户端的令牌桶 (惰性补充，无后台任务)
+    只保留最近活跃的 max_clients 个令牌桶 (LRU)，被淘汰的客户端下次以满桶重新开始。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 0, max_clients: int = 10000):
+        self.rate = float(rate_per_minute) / 60.0
+        self.capacity = float(burst or rate_per_minute)
+        self.max_clients = max(1, int(max_clients))
+        # key -> (令牌数, 上次补充时间)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def try_acquire(self, key: str, cost: float = 1.0) -> float:
+        """扣除 cost 个令牌；成功返回 0，不足时不扣除并返回需等待的秒数"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        cost = min(cost, self.capacity)
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            return (cost - tokens) / self.rate
+
+        self._buckets[key] = (tokens - cost, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.capacity,
+            "tracked_clients": len(self._buckets),
+        }
+
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_key(scope: Dict[str, Any], api_keys: Iterable[str] = ()) -> str:
+    """限流维度：已登记的 API Key > 客户端 IP (未登记的 Key 与病人 ID 不作为身份)"""
+    api_key = _header(scope, b"x-api-key")
+    if api_key and api_key in api_keys:
+        return "key:" + api_key
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionController:
+    """限流器 + 推理并发上限 + 截止时间的配置与统计 (全局实例 admission)"""
+
+    def __init__(self,
+                 rate_per_minute: float = 60,
+                 burst: int = 0,
+                 max_clients: int = 10000,
+                 cost_pixels: int = 1024 * 1024,
+                 max_concurrency: int = 16,
+                 max_wait: float = 5.0,
+                 request_timeout: float = 30.0,
+                 inference_paths: Iterable[str] = (),
+                 exempt_paths: Iterable[str] = (),
+                 api_keys: Iterable[str] = ()):
+        self.limiter = TokenBucketLimiter(rate_per_minute, burst, max_clients)
+        self.api_keys = frozenset(k for k in api_keys if k)
+        self.cost_pixels = max(1, int(cost_pixels))
+        self.max_concurrency = max(0, int(max_concurrency))  # 0 = 不限制并发
+        self.max_wait = float(max_wait)
+        self.request_timeout = float(request_timeout)
+        self.inference_paths = set(inference_paths)
+        self.exempt_paths = tuple(exempt_paths)
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected: Dict[str, int] = {}
+
+    def is_exempt(self, path: str) -> bool:
+        return path == "/" or any(path == p or path.startswith(p + "/") for p in self.exempt_paths)
+
+    def reject(self, reason: str, error_code: Optional[str] = None):
+        """记录一次拒绝；中间件直接构造的响应不经过异常处理器，需同时计入 retina_errors"""
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        metrics.ADMISSION_REJECTIONS.labels(reason).inc()
+        if error_code is not None:
+            metrics.ERRORS.labels(error_code).inc()
+
+    # ------------------------------------------------------------------
+    # 按像素计费 (推理接口在解码出图像后调用)
+    # ------------------------------------------------------------------
+    def image_cost(self, height: int, width: int) -> float:
+        return max(1.0, height * width / self.cost_pixels)
+
+    def charge_image(self, request, height: int, width: int):
+        """
+        按图像像素数补扣令牌 (中间件已扣除 1 个)；令牌不足时抛出 RateLimitExceeded，由接口层返回 429
+        未经中间件的请求 (如测试或中间件关闭) 不计费。
+        """
+        key = getattr(request.state, "client_key", None)
+        extra = self.image_cost(height, width) - 1
+        if key is None or extra <= 0:
+            return
+        retry_after = self.limiter.try_acquire(key, extra)
+        if retry_after:
+            # 接口层转换为 HTTPException，retina_errors 由异常处理器计数
+            self.reject("rate_limited")
+            raise RateLimitExceeded(key, retry_after)
+
+    # ------------------------------------------------------------------
+    # 并发名额
+    # ------------------------------------------------------------------
+    async def acquire_slot(self, timeout: float) -> bool:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        return True
+
+    def release_slot(self):
+        self.inflight -= 1
+        self._slots.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.limiter.get_stats(),
+            "max_concurrency": self.max_concurrency,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "rejected": dict(self.rejected),
+            "rejected_total": sum(self.rejected.values()),
+        }
+
+
+async def _send_error(send, status_code: int, error_code: str, message: str, retry_after: Optional[int] = None):
+    """与 HTTPException(detail={...}) 相同结构的错误响应"""
+    body = json.dumps({"detail": {
+        "status": "error",
+        "error_code": error_code,
+        "message": message,
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+    }}, ensure_ascii=False).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI 准入中间件 (纯 ASGI 实现，以便包装 receive 感知客户端断开)
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if scope["type"] != "http" or scope.get("method") in SAFE_METHODS or controller.is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        key = client_key(scope, controller.api_keys)
+        scope.setdefault("state", {})["client_key"] = key
+        retry_after = controller.limiter.try_acquire(key, 1.0)
+        if retry_after:
+            controller.reject("rate_limited", "RATE_LIMITED")
+            error = RateLimitExceeded(key, retry_after)
+            await _send_error(send, 429, "RATE_LIMITED", str(error), error.retry_after)
+            return
+
+        if scope["path"] not in controller.inference_paths:
+            await self.app(scope, receive, send)
+            return
+        await self._admit_inference(scope, receive, send)
+
+    def _timeout(self, scope) -> float:
+        timeout = self.controller.request_timeout or math.inf
+        client_timeout = _header(scope, b"x-request-timeout")
+        if client_timeout:
+            try:
+                timeout = min(timeout, max(0.0, float(client_timeout)))
+            except ValueError:
+                pass
+        return timeout
+
+    async def _admit_inference(self, scope, receive, send):
+        controller = self.controller
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._timeout(scope)
+        limited = controller.max_concurrency > 0
+
+        if limited and not await controller.acquire_slot(min(controller.max_wait, deadline - loop.time())):
+            controller.reject("concurrency", "SERVER_BUSY")
+            await _send_error(send, 503, "SERVER_BUSY", "推理请求过多，请稍后重试",
+                              max(1, math.ceil(controller.max_wait)))
+            return
+
+        token = request_deadline.set(deadline)
+        try:
+            await self._run_with_deadline(scope, receive, send, deadline)
+        finally:
+            request_deadline.reset(token)
+            if limited:
+                controller.release_slot()
+
+    async def _run_with_deadline(self, scope, receive, send, deadline: float):
+        """执行请求；截止时间已过或客户端断开时取消请求任务 (连带取消其排队中的推理)"""
+        body_received = asyncio.Event()
+        disconnected = asyncio.Event()
+        state = {"started": False, "complete": False}
+
+        async def wrapped_receive():
+            if body_received.is_set():
+                # 请求体读完后由监听协程独占底层 receive，这里只转发断开事件
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_received.set()
+            return message
+
+        async def wrapped_send(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        async def watch_disconnect():
+            await body_received.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        handler = asyncio.create_task(self.app(scope, wrapped_receive, wrapped_send))
+        watcher = asyncio.create_task(watch_disconnect())
+        waiter = asyncio.create_task(disconnected.wait())
+        try:
+            timeout = deadline - asyncio.get_running_loop().time()
+            done, _ = await asyncio.wait({handler, waiter}, timeout=timeout if timeout != math.inf else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if handler in done:
+                handler.result()
+                return
+            if disconnected.is_set() and state["complete"]:
+                # 响应已发送完毕后的断开是正常结束
+                await handler
+                return
+
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+            if disconnected.is_set():
+                self.controller.reject("client_disconnected", "CLIENT_DISCONNECTED")
+                logger.info(f"🔌 客户端已断开，取消推理请求 {scope['path']}")
+            else:
+                self.controller.reject("deadline", "DEADLINE_EXCEEDED")
+                logger.warning(f"⏰ 推理请求超过截止时间，已取消 {scope['path']}")
+                if not state["started"]:
+                    await _send_error(send, 504, "DEADLINE_EXCEEDED", "请求处理超时，已取消")
+        finally:
+            for task in (watcher, waiter):
+                task.cancel()
+            await asyncio.gather(watcher, waiter, return_exceptions=True)
+
+
+def _build_admission() -> AdmissionController:
+    from core.config import settings
+
+    return AdmissionController(
+        rate_per_minute=settings.MAX_REQUESTS_PER_MINUTE,
+        burst=settings.RATE_LIMIT_BURST,
+        max_clients=settings.RATE_LIMIT_MAX_CLIENTS,
+        cost_pixels=settings.RATE_LIMIT_COST_PIXELS,
+        max_concurrency=settings.INFERENCE_MAX_CONCURRENCY,
+        max_wait=settings.ADMISSION_MAX_WAIT,
+        request_timeout=settings.REQUEST_TIMEOUT,
+        inference_paths=(f"{settings.API_V1_STR}/predict", f"{settings.API_V1_STR}/upload/predict"),
+        exempt_paths=settings.ADMISSION_EXEMPT_PATHS,
+        api_keys=settings.RATE_LIMIT_API_KEYS
+    )
+
+
+# 创建全局准入控制实例
+admission = _build_admission()
@@ -1,15 +1,23 @@
+import time
+
+# 启动计时：从导入 main 开始 (包含 torch / cv2 等依赖的导入)
+_IMPORT_START = time.perf_counter()
+
 from fastapi import FastAPI, Request
+from fastapi.exception_handlers import http_exception_handler
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
 import logging
 import uvicorn
-import time
 import uuid
 import contextvars  # <--- 新增导入
 
 # 导入配置
 from core.config import settings
 from core.database import init_db
+from core import metrics
+from core.rate_limit import AdmissionMiddleware, admission
 from contextlib import asynccontextmanager
 from api.endpoints import routes_report
 # 导入所有路由
@@ -20,7 +28,9 @@ from api.endpoints import (
     routes_image,
     routes_prediction,
     routes_patient,
-    routes_model
+    routes_model,
+    routes_job,
+    metrics as routes_metrics
 )
 
 # === 1. 定义上下文变量 (ContextVar) ===
@@ -57,25 +67,83 @@ logger = logging.getLogger("retina_api")
 for handler in logging.root.handlers:
     handler.addFilter(RequestIDFilter())
 
+# 模块导入耗时 (所有路由及其依赖在此之前已导入)
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+
+class StartupTimer:
+    """按阶段记录启动耗时，启动完成后汇总输出"""
+
+    def __init__(self):
+        self.phases = {"imports": IMPORT_SECONDS}
+        self._start = time.perf_counter()
+
+    @asynccontextmanager
+    async def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+            logger.info(f"⏱️ 启动阶段 {name}: {self.phases[name]:.2f}s")
+
+    def summary(self) -> str:
+        total = IMPORT_SECONDS + time.perf_counter() - self._start
+        parts = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"{total:.2f}s ({parts})"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # === 启动逻辑 (Startup) ===
     logger.info("🚀 服务启动中...")
+    timer = StartupTimer()
 
     # 初始化数据库
-    await init_db()
+    async with timer.phase("init_db"):
+        await init_db()
     logger.info("✅ MongoDB 索引初始化完成")
 
+    # 后台系统状态采样 (健康检查接口读取缓存快照)
+    from services.system_monitor import system_monitor
+    system_monitor.start()
+
+    # 启动写后持久化队列 (并重放上次遗留的本地日志)
+    from services.persistence_queue import write_behind
+    async with timer.phase("persistence"):
+        await write_behind.start()
+
     # 加载 AI 模型
     from services.model_service import model_service
-    await model_service.load_model(settings.MODEL_PATH)
+    async with timer.phase("model_load"):
+        await model_service.load_model(settings.MODEL_PATH)
     logger.info("✅ 模型加载完成")
 
+    # 预热：按所有批大小 / 图块形状各执行一次前向，完成后就绪检查才会通过
+    async with timer.phase("warmup"):
+        await model_service.warmup()
+
+    # 单机部署：在本进程内运行异步任务工作者
+    from services.job_service import job_worker
+    if settings.JOB_WORKER_ENABLED:
+        job_worker.start()
+
+    logger.info(f"🚀 服务启动完成，总耗时 {timer.summary()}")
+
     yield  # 服务运行期间停留在这里
 
     # === 关闭逻辑 (Shutdown) ===
     logger.info("🛑 服务正在关闭...")
+    # 先停止任务工作者 (中断的任务在租约过期后会被重新领取)
+    await job_worker.stop()
+    await system_monitor.stop()
+    from services.model_registry import model_registry
+    await model_registry.shutdown()
+    # 等待后台文件写入完成
+    from services.storage_service import storage_service
+    await storage_service.drain()
+    # 排空写入队列，未写入 MongoDB 的记录转存本地日志
+    await write_behind.stop()
     logger.info("👋 感谢使用视网膜血管分割API服务")
 
 
@@ -108,6 +176,10 @@ app = FastAPI(
     },
 )
 
+# 准入控制：按客户端限流、推理并发上限与截止时间
+# (后添加的中间件在外层：CORS 与请求ID/指标中间件包在它外面，429/503 响应同样带 CORS 头并被计时)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # 配置 CORS
 app.add_middleware(
     CORSMiddleware,
@@ -127,9 +199,12 @@ async def add_request_id(request: Request, call_next):
     # 将 ID 设置到上下文中，这样后续的所有日志都能拿到了
     token = request_id_context.set(request_id)
 
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    status_code = 500
+    start_time = time.time()
     try:
-        start_time = time.time()
         response = await call_next(request)
+        status_code = response.status_code
         process_time = time.time() - start_time
 
         response.headers["X-Request-ID"] = request_id
@@ -137,13 +212,32 @@ async def add_request_id(request: Request, call_next):
 
         logger.info(f"处理完成: {request.method} {request.url.path} - {process_time:.3f}s")
         return response
+    except Exception:
+        metrics.ERRORS.labels("UNHANDLED").inc()
+        raise
     finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        # 按路由模板 (而非实际路径) 打标签，避免 ID 类路径参数导致序列数膨胀
+        route = request.scope.get("route")
+        metrics.REQUEST_SECONDS.labels(
+            request.method, route.path if route is not None else "unmatched", status_code
+        ).observe(time.time() - start_time)
         # 请求结束后，重置上下文，防止内存泄漏或数据混淆
         request_id_context.reset(token)
 
 
+@app.exception_handler(StarletteHTTPException)
+async def count_http_errors(request: Request, exc: StarletteHTTPException):
+    """按 error_code 统计错误响应 (没有 error_code 的按状态码归类)，再交给默认处理器"""
+    detail = exc.detail if isinstance(exc.detail, dict) else {}
+    metrics.ERRORS.labels(detail.get("error_code") or f"HTTP_{exc.status_code}").inc()
+    return await http_exception_handler(request, exc)
+
+
 # 注册路由
 app.include_router(health.router)
+if settings.METRICS_ENABLED:
+    app.include_router(routes_metrics.router)
 app.include_router(routes_report.router, prefix="/api/v1") # 注册
 # 注册病人接口
 app.include_router(routes_patient.router, prefix="/api/v1")
@@ -156,6 +250,7 @@ app.include_router(routes_image.router, prefix="/api/v1")
 app.include_router(routes_prediction.router, prefix="/api/v1")
 app.include_router(predict.router, prefix=settings.API_V1_STR)
 app.include_router(upload.router, prefix=settings.API_V1_STR)
+app.include_router(routes_job.router, prefix=settings.API_V1_STR)
 
 
 @app.get("/", include_in_schema=False)
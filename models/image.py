@@ -2,6 +2,10 @@
 from datetime import datetime
 from core.database import images_collection
 from bson.objectid import ObjectId
+from core.pagination import build_projection, find_page, iter_documents
+
+# 列表查询可投影的字段
+LIST_FIELDS = ("patient_id", "filename", "file_size", "content_type", "filepath", "width", "height", "uploaded_at")
 
 class Image:
     def __init__(self, patient_id: str = None, filename: str = None, file_size: int = 0, content_type: str = None, filepath: str = None, width: int = None, height: int = None):
@@ -19,17 +23,29 @@ class Image:
         result = await images_collection.insert_one(self.__dict__)
         return str(result.inserted_id)
 
+    def save_later(self) -> str:
+        """登记到写后持久化队列，立即返回预分配的 ID (不等待数据库)"""
+        from services.persistence_queue import write_behind
+        return write_behind.enqueue("images", self.__dict__)
+
+    @classmethod
+    async def find_by_user(cls, patient_id: str, limit: int = None, after: str = None, fields: str = None):
+        """按原逻辑保留：根据上传者 user_id 查询 (分页)"""
+        return await cls.find_by_patient(patient_id, limit=limit, after=after, fields=fields)
+
     @classmethod
-    async def find_by_user(cls, patient_id: str):
-        """按原逻辑保留：根据上传者 user_id 查询"""
-        cursor = images_collection.find({"patient_id": patient_id})
-        return await cursor.to_list(length=100)
+    async def find_by_patient(cls, patient_id: str, limit: int = None, after: str = None, fields: str = None):
+        """根据 patient_id 分页查询该病人的图像 (按上传时间倒序)，返回 {"items", "next_cursor", "has_more"}"""
+        return await find_page(images_collection, {"patient_id": patient_id}, "uploaded_at",
+                               limit=limit, after=after,
+                               projection=build_projection(fields, LIST_FIELDS, "uploaded_at"))
 
     @classmethod
-    async def find_by_patient(cls, patient_id: str):
-        """新增：根据 patient_id 查询该病人的所有图像"""
-        cursor = images_collection.find({"patient_id": patient_id})
-        return await cursor.to_list(length=100)
+    def iter_by_patient(cls, patient_id: str, after: str = None, fields: str = None, limit: int = None):
+        """逐条迭代该病人的图像 (流式输出用)"""
+        return iter_documents(images_collection, {"patient_id": patient_id}, "uploaded_at",
+                              after=after, projection=build_projection(fields, LIST_FIELDS, "uploaded_at"),
+                              limit=limit)
 
     @classmethod
     async def find_by_id(cls, image_id: str):
@@ -0,0 +1,147 @@
+# models/job.py
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from core.database import jobs_collection
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# 单张图像的状态
+ITEM_PENDING = "pending"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+ITEM_SKIPPED = "skipped"
+
+
+class Job:
+    """
+    异步分割任务
+    items 中每一项对应一张输入图像：{index, filename, content_type, storage_key, status, result, error}
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], inference_mode: str = None, patient_id: str = None):
+        self.items = [
+            {**item, "index": i, "status": ITEM_PENDING, "result": None, "error": None}
+            for i, item in enumerate(items)
+        ]
+        self.inference_mode = inference_mode
+        self.patient_id = patient_id
+        self.status = JOB_QUEUED
+        self.total = len(self.items)
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cancel_requested = False
+        self.worker_id = None
+        self.lease_until = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+
+    async def save(self):
+        """异步保存任务"""
+        result = await jobs_collection.insert_one(self.__dict__)
+        return str(result.inserted_id)
+
+    @classmethod
+    async def find_by_id(cls, job_id: str, projection: Dict[str, int] = None):
+        try:
+            return await jobs_collection.find_one({"_id": ObjectId(job_id)}, projection)
+        except Exception:
+            return None
+
+    @classmethod
+    async def count_active(cls) -> int:
+        """排队中与执行中的任务数"""
+        return await jobs_collection.count_documents({"status": {"$in": [JOB_QUEUED, JOB_RUNNING]}})
+
+    @classmethod
+    async def claim_next(cls, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        原子领取下一个任务：排队中的任务，或租约已过期 (工作进程崩溃) 的执行中任务
+        多个工作进程同时领取时，find_one_and_update 保证每个任务只被一个进程拿到。
+        """
+        now = datetime.utcnow()
+        return await jobs_collection.find_one_and_update(
+            {"$or": [
+                {"status": JOB_QUEUED},
+                {"status": JOB_RUNNING, "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {
+                "status": JOB_RUNNING,
+                "worker_id": worker_id,
+                "lease_until": now + timedelta(seconds=lease_seconds),
+                "started_at": now,
+            }},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @classmethod
+    async def renew_lease(cls, job_id: ObjectId, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """续约并返回 cancel_requested 等最新状态；任务已被其他进程接管时返回 None"""
+        return await jobs_collection.find_one_and_update(
+            {"_id": job_id, "worker_id": worker_id, "status": JOB_RUNNING},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=lease_seconds)}},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @classmethod
+    async def record_item(cls, job_id: ObjectId, index: int, status: str,
+                          result: Dict[str, Any] = None, error: str = None):
+        """写入单张图像的结果并累加进度计数"""
+        counter = {ITEM_DONE: "completed", ITEM_FAILED: "failed", ITEM_SKIPPED: "skipped"}[status]
+        await jobs_collection.update_one(
+            {"_id": job_id, f"items.{index}.status": ITEM_PENDING},
+            {"$set": {
+                f"items.{index}.status": status,
+                f"items.{index}.result": result,
+                f"items.{index}.error": error,
+                f"items.{index}.finished_at": datetime.utcnow(),
+            }, "$inc": {counter: 1}}
+        )
+
+    @classmethod
+    async def finish(cls, job_id: ObjectId, status: str):
+        await jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": status, "finished_at": datetime.utcnow(), "lease_until": None}}
+        )
+
+    @classmethod
+    async def request_cancel(cls, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取消任务：排队中的任务直接标记为已取消；执行中的任务设置 cancel_requested，
+        由工作进程在处理下一张图像前停止。已结束的任务不变。
+        """
+        try:
+            oid = ObjectId(job_id)
+        except Exception:
+            return None
+        now = datetime.utcnow()
+        doc = await jobs_collection.find_one_and_update(
+            {"_id": oid, "status": JOB_QUEUED},
+            {"$set": {"status": JOB_CANCELLED, "cancel_requested": True, "finished_at": now}},
+            projection={"items": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            doc = await jobs_collection.find_one_and_update(
+                {"_id": oid, "status": JOB_RUNNING},
+                {"$set": {"cancel_requested": True}},
+                projection={"items": 0},
+                return_document=ReturnDocument.AFTER
+            )
+        if doc is None:
+            doc = await jobs_collection.find_one({"_id": oid}, {"items": 0})
+        return doc
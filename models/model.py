@@ -1,11 +1,14 @@
 from datetime import datetime
 from core.database import models_collection
-from typing import List, Dict, Any
+from typing import Dict, Any, Optional
+from core.pagination import find_page
 
 class ModelInfo:
-    def __init__(self, model_version: str, model_metadata: dict):
+    def __init__(self, model_version: str, model_metadata: dict, artifact_path: Optional[str] = None):
         self.model_version = model_version
         self.model_metadata = model_metadata
+        # 权重文件路径 (模型注册表按版本加载时使用)
+        self.artifact_path = artifact_path
         self.trained_at = datetime.utcnow()
 
     async def save(self):
@@ -18,7 +21,11 @@ class ModelInfo:
         return await models_collection.find_one({"model_version": version})
 
     @classmethod
-    async def list_models(cls) -> List[Dict[str, Any]]:
-        """获取所有模型记录"""
-        cursor = models_collection.find({}).sort("trained_at", -1)
-        return await cursor.to_list(length=100)
\ No newline at end of file
+    async def record_runtime(cls, version: str, fields: Dict[str, Any]):
+        """记录版本的运行时信息 (最近一次加载 / 卸载的耗时与时间、常驻内存)"""
+        await models_collection.update_one({"model_version": version}, {"$set": {f"runtime.{k}": v for k, v in fields.items()}})
+
+    @classmethod
+    async def list_models(cls, limit: int = None, after: str = None) -> Dict[str, Any]:
+        """分页获取模型记录 (按训练时间倒序)，返回 {"items", "next_cursor", "has_more"}"""
+        return await find_page(models_collection, {}, "trained_at", limit=limit, after=after)
\ No newline at end of file
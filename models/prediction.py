@@ -2,6 +2,11 @@
 from datetime import datetime
 from core.database import predictions_collection
 from bson.objectid import ObjectId
+from core.pagination import build_projection, find_page, iter_documents
+
+# 列表查询可投影的字段
+LIST_FIELDS = ("request_id", "model_version", "result_data", "patient_id", "image_id",
+               "mask_file", "overlay_file", "created_at")
 
 class Prediction:
     def __init__(self, request_id: str, model_version: str, result_data: dict, patient_id: str = None, image_id: str = None, mask_file: str = None, overlay_file: str = None):
@@ -19,16 +24,30 @@ class Prediction:
         result = await predictions_collection.insert_one(self.__dict__)
         return str(result.inserted_id)
 
+    def save_later(self) -> str:
+        """登记到写后持久化队列，立即返回预分配的 ID (不等待数据库)"""
+        from services.persistence_queue import write_behind
+        return write_behind.enqueue("predictions", self.__dict__)
+
+    @classmethod
+    async def find_by_image(cls, image_id: str, limit: int = None, after: str = None, fields: str = None):
+        """分页查询某张图的预测记录 (按创建时间倒序)，返回 {"items", "next_cursor", "has_more"}"""
+        return await find_page(predictions_collection, {"image_id": image_id}, "created_at",
+                               limit=limit, after=after,
+                               projection=build_projection(fields, LIST_FIELDS, "created_at"))
+
     @classmethod
-    async def find_by_image(cls, image_id: str):
-        """异步查询某张图的所有预测记录"""
-        cursor = predictions_collection.find({"image_id": image_id})
-        return await cursor.to_list(length=100)
+    def iter_by_image(cls, image_id: str, after: str = None, fields: str = None, limit: int = None):
+        """逐条迭代某张图的预测记录 (流式输出用)"""
+        return iter_documents(predictions_collection, {"image_id": image_id}, "created_at",
+                              after=after, projection=build_projection(fields, LIST_FIELDS, "created_at"),
+                              limit=limit)
 
     @classmethod
-    async def find_by_patient(cls, patient_id: str):
-        cursor = predictions_collection.find({"patient_id": patient_id})
-        return await cursor.to_list(length=100)
+    async def find_by_patient(cls, patient_id: str, limit: int = None, after: str = None, fields: str = None):
+        return await find_page(predictions_collection, {"patient_id": patient_id}, "created_at",
+                               limit=limit, after=after,
+                               projection=build_projection(fields, LIST_FIELDS, "created_at"))
 
     @classmethod
     async def find_by_id(cls, pred_id: str):
@@ -0,0 +1,236 @@
+"""
+动态微批调度模块 (Dynamic Micro-batching Scheduler)
+-------------------------------------------------
+本模块位于 ModelService 与 U-Net 前向推理之间，负责把并发到达的请求合并成批。
+工作方式：
+1. 每个请求把自己的输入 (payload) 放入队列，并等待一个 Future。
+2. 后台调度协程取出第一个请求后，在 max_wait_ms 窗口内继续收集，直到凑满 max_batch_size。
+3. 整批交给 runner 执行一次前向推理，再把逐条结果分发回各个等待中的请求。
+   最多同时有 max_inflight_batches 个批次在执行 (多个推理线程/进程可并行)。
+   提交时记录请求的截止时间 (request_deadline)，组批后已过期的条目以 DeadlineExceeded 结束，不进入前向推理。
+4. 统计队列深度与批大小分布，便于调优窗口参数。
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from core.rate_limit import DeadlineExceeded, request_deadline
+
+logger = logging.getLogger(__name__)
+
+# 队列深度直方图的桶边界 (Prometheus 风格，含 +Inf)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _BatchItem:
+    """队列中的单个待推理请求"""
+    __slots__ = ("payload", "future", "enqueued_at", "deadline")
+
+    def __init__(self, payload: Any, future: asyncio.Future, deadline: Optional[float] = None):
+        self.payload = payload
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.deadline = deadline  # event loop 时间，None 表示不限
+
+
+class BatchScheduler:
+    """
+    微批调度器
+    runner 接收一个 payload 列表，返回等长的结果列表 (顺序一一对应)。
+    """
+
+    def __init__(self,
+                 runner: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0,
+                 max_inflight_batches: int = 1,
+                 name: str = "unet"):
+        self.runner = runner
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_inflight_batches = max(1, int(max_inflight_batches))
+        self.name = name
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+        # 统计信息
+        self.total_batches = 0
+        self.total_items = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0
+        self.expired_items = 0
+        self.batch_size_histogram: Counter = Counter()
+        self.queue_depth_histogram: Counter = Counter()
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        """在首次提交时于当前事件循环中启动调度协程"""
+        if self._worker_task is None or self._worker_task.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self.max_inflight_batches)
+            self._worker_task = asyncio.create_task(self._worker(), name=f"batch-scheduler-{self.name}")
+            logger.info(f"🧺 微批调度器已启动 [{self.name}] (max_batch={self.max_batch_size}, "
+                        f"max_wait={self.max_wait * 1000:.1f}ms)")
+
+    async def stop(self):
+        """停止调度协程，并让仍在排队的请求以异常结束"""
+        if self._worker_task is None:
+            return
+        self._worker_task.cancel()
+        try:
+            await self._worker_task
+        except asyncio.CancelledError:
+            pass
+        self._worker_task = None
+
+        for task in list(self._batch_tasks):
+            task.cancel()
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("批处理调度器已关闭"))
+        logger.info(f"🧺 微批调度器已停止 [{self.name}]")
+
+    # ------------------------------------------------------------------
+    # 提交与调度
+    # ------------------------------------------------------------------
+    async def submit(self, payload: Any) -> Any:
+        """提交单条输入，等待其所在批次推理完成后返回对应结果"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_BatchItem(payload, future, request_deadline.get()))
+
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+        return await future
+
+    async def _collect_batch(self) -> List[_BatchItem]:
+        """阻塞等待第一条请求，然后在等待窗口内尽量凑满一批"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # 队列里已有的请求直接取走，不必等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        # 调度协程在首个请求中惰性启动，不继承该请求的截止时间
+        request_deadline.set(None)
+        while True:
+            # 先占用一个在途批次名额，再开始收集，保证排队中的请求能并入下一批
+            await self._inflight.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._inflight.release()
+                raise
+
+            # 调用方已取消 (如客户端断开) 或已超过截止时间的请求不再推理
+            batch = self._drop_expired([item for item in batch if not item.future.done()])
+            if not batch:
+                self._inflight.release()
+                continue
+
+            self._record_batch(batch)
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    def _drop_expired(self, batch: List[_BatchItem]) -> List[_BatchItem]:
+        now = asyncio.get_running_loop().time()
+        alive = []
+        for item in batch:
+            if item.deadline is not None and now >= item.deadline:
+                self.expired_items += 1
+                item.future.set_exception(DeadlineExceeded())
+            else:
+                alive.append(item)
+        return alive
+
+    async def _dispatch(self, batch: List[_BatchItem]):
+        try:
+            results = await self.runner([item.payload for item in batch])
+        except asyncio.CancelledError:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("批处理调度器已关闭"))
+            raise
+        except Exception as e:
+            logger.error(f"❌ 批推理失败 [{self.name}] (batch={len(batch)}): {str(e)}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        else:
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+        finally:
+            self._inflight.release()
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+    def _record_batch(self, batch: List[_BatchItem]):
+        now = time.perf_counter()
+        self.total_batches += 1
+        self.total_items += len(batch)
+        self.batch_size_histogram[len(batch)] += 1
+        self.total_wait_time += sum(now - item.enqueued_at for item in batch)
+
+        depth = self.queue_depth
+        for bound in QUEUE_DEPTH_BUCKETS:
+            if depth <= bound:
+                self.queue_depth_histogram[str(bound)] += 1
+                break
+        else:
+            self.queue_depth_histogram["+Inf"] += 1
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        avg_batch = self.total_items / self.total_batches if self.total_batches else 0.0
+        avg_wait_ms = self.total_wait_time / self.total_items * 1000 if self.total_items else 0.0
+        return {
+            "enabled": True,
+            "running": self._worker_task is not None and not self._worker_task.done(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_inflight_batches": self.max_inflight_batches,
+            "inflight_batches": len(self._batch_tasks),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "expired_items": self.expired_items,
+            "avg_batch_size": round(avg_batch, 3),
+            "avg_queue_wait_ms": round(avg_wait_ms, 3),
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+            "queue_depth_histogram": {
+                str(b): self.queue_depth_histogram.get(str(b), 0) for b in QUEUE_DEPTH_BUCKETS
+            } | {"+Inf": self.queue_depth_histogram.get("+Inf", 0)},
+        }
@@ -0,0 +1,130 @@
+"""
+推理执行器模块 (Inference Executor)
+----------------------------------
+把 CPU 密集的预处理、U-Net 前向推理和 PNG 编码从 asyncio 事件循环中移出，
+放到专用线程池中执行，使 /health、数据库写入和中间件在推理期间仍能及时响应。
+主要职责：
+1. 创建固定大小的推理线程池，并固定 torch 的 intra-op 线程数，避免线程过度订阅。
+2. 提供有界的准入队列 (back-pressure)：在途请求数达到上限时抛出 InferenceQueueFullError，
+   由接口层转换为 503 + Retry-After。
+3. 请求设置了截止时间 (request_deadline) 时，提交前与线程开始执行前各检查一次，
+   在线程池中排队到过期的任务抛出 DeadlineExceeded 而不再执行。
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+from core.rate_limit import DeadlineExceeded, request_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFullError(Exception):
+    """推理队列已满，调用方应稍后重试"""
+
+    def __init__(self, retry_after: int, pending: int):
+        self.retry_after = retry_after
+        self.pending = pending
+        super().__init__(f"推理队列已满 (在途请求: {pending})，请 {retry_after}s 后重试")
+
+
+class InferenceExecutor:
+    """
+    推理线程池 + 有界准入队列
+    """
+
+    def __init__(self,
+                 max_workers: int = 2,
+                 torch_threads: int = 0,
+                 max_queue: int = 32,
+                 retry_after: int = 2):
+        self.max_workers = max(1, int(max_workers))
+        # 0 表示自动：把 CPU 核数平均分给各推理线程
+        self.torch_threads = int(torch_threads) or max(1, (os.cpu_count() or 1) // self.max_workers)
+        self.max_queue = max(1, int(max_queue))
+        self.retry_after = int(retry_after)
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+        # 统计信息
+        self.pending = 0
+        self.max_pending = 0
+        self.rejected_count = 0
+        self.completed_count = 0
+        self.expired_count = 0
+
+    def start(self):
+        if self._pool is not None:
+            return
+        torch.set_num_threads(self.torch_threads)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        logger.info(f"🧵 推理线程池已启动 (workers={self.max_workers}, torch_threads={self.torch_threads}, "
+                    f"max_queue={self.max_queue})")
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+        logger.info("🧵 推理线程池已关闭")
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        准入控制：在途请求数超过 max_queue 时立即拒绝，而不是无限排队
+        """
+        if self.pending >= self.max_queue:
+            self.rejected_count += 1
+            logger.warning(f"⚠️ 推理队列已满，拒绝请求 (pending={self.pending})")
+            raise InferenceQueueFullError(self.retry_after, self.pending)
+
+        self.pending += 1
+        if self.pending > self.max_pending:
+            self.max_pending = self.pending
+        try:
+            yield
+        finally:
+            self.pending -= 1
+            self.completed_count += 1
+
+    async def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """在推理线程池中执行同步函数并等待结果 (当前请求已超过截止时间时抛出 DeadlineExceeded)"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        deadline = request_deadline.get()
+        if deadline is None:
+            return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            self.expired_count += 1
+            raise DeadlineExceeded()
+        # 线程中没有事件循环，换算为 time.monotonic 的截止时刻
+        return await loop.run_in_executor(
+            self._pool, partial(self._run_before, time.monotonic() + remaining, fn, *args, **kwargs))
+
+    def _run_before(self, expires_at: float, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        if time.monotonic() >= expires_at:
+            self.expired_count += 1
+            raise DeadlineExceeded()
+        return fn(*args, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "torch_threads": self.torch_threads,
+            "running": self._pool is not None,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected_count,
+            "completed": self.completed_count,
+            "expired": self.expired_count,
+        }
@@ -0,0 +1,315 @@
+"""
+异步任务模块 (Asynchronous Segmentation Jobs)
+-------------------------------------------
+4K 分块推理和批量筛查超出同步 HTTP 请求的时限 (REQUEST_TIMEOUT)。任务子系统的工作方式：
+1. 提交时把输入图像写入内容寻址存储，任务文档 (含每张图像的状态) 保存在 MongoDB，立即返回任务 ID。
+2. 工作进程通过 find_one_and_update 原子领取排队中的任务，并持有带过期时间的租约；
+   进程崩溃后租约过期，任务会被其他工作进程重新领取，已完成的图像不会重复处理。
+3. 每张图像完成后立即写回任务文档，结果接口据此逐条流式返回。
+4. 并发限制：同时执行的任务数 (JOB_MAX_CONCURRENT_JOBS) 与单个任务内并行处理的图像数
+   (JOB_ITEM_CONCURRENCY)；推理本身仍经过 ModelService 的准入队列与微批调度。
+5. 取消：处理每张图像前以及心跳续约 (每 lease_seconds/3) 时读取 cancel_requested，已请求取消则停止领取新图像；
+   心跳保证单张图像耗时超过租约时任务不会被其他工作进程重复领取。
+单机部署时，本模块的 job_worker 随应用在 lifespan 中启动 (JOB_WORKER_ENABLED)。
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, Optional, Set
+
+from core.config import settings
+from models.job import (Job, ITEM_DONE, ITEM_FAILED, ITEM_PENDING, ITEM_SKIPPED,
+                        JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED)
+from models.prediction import Prediction
+from services.inference_executor import InferenceQueueFullError
+from services.model_registry import model_registry
+from services.model_service import model_service
+from services.storage_service import storage_service
+from utils.image_utils import bytes_to_image, validate_image_size
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """进程内任务工作者"""
+
+    def __init__(self,
+                 max_concurrent_jobs: int = 1,
+                 item_concurrency: int = 2,
+                 lease_seconds: float = 60.0,
+                 poll_interval: float = 2.0):
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        self.item_concurrency = max(1, int(item_concurrency))
+        self.lease_seconds = float(lease_seconds)
+        self.poll_interval = float(poll_interval)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._loop_task: Optional[asyncio.Task] = None
+        self._job_tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        # 统计信息
+        self.jobs_done = 0
+        self.items_done = 0
+        self.items_failed = 0
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._loop_task is not None and not self._loop_task.done():
+            return
+        self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run(), name=f"job-worker-{self.worker_id}")
+        logger.info(f"📋 任务工作者已启动 [{self.worker_id}] (jobs={self.max_concurrent_jobs}, "
+                    f"items={self.item_concurrency})")
+
+    async def stop(self):
+        """
+        停止领取新任务并中断执行中的任务
+        被中断的任务保持 running 状态，租约过期后由其他工作进程 (或重启后的本进程) 继续。
+        """
+        if self._loop_task is None:
+            return
+        self._loop_task.cancel()
+        for task in list(self._job_tasks):
+            task.cancel()
+        await asyncio.gather(self._loop_task, *self._job_tasks, return_exceptions=True)
+        self._loop_task = None
+        logger.info(f"📋 任务工作者已停止 [{self.worker_id}]")
+
+    def notify(self):
+        """有新任务提交时唤醒领取循环 (跨进程的工作者靠轮询发现)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # 领取与执行
+    # ------------------------------------------------------------------
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await Job.claim_next(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"❌ 领取任务失败: {str(e)}")
+                job = None
+
+            if job is None:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            self._job_tasks.add(task)
+            task.add_done_callback(self._job_tasks.discard)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id = job["_id"]
+        start = time.perf_counter()
+        logger.info(f"📋 开始执行任务 {job_id} ({job['total']} 张图像)")
+        try:
+            outcome = await self._process_items(job)
+            if outcome == "lost":
+                logger.warning(f"⚠️ 任务 {job_id} 的租约已被其他工作进程接管，停止执行")
+                return
+            final = await Job.find_by_id(str(job_id), {"failed": 1, "total": 1})
+            if outcome == "cancelled":
+                status = JOB_CANCELLED
+            elif final and final["total"] and final["failed"] == final["total"]:
+                status = JOB_FAILED
+            else:
+                status = JOB_COMPLETED
+            await Job.finish(job_id, status)
+            self.jobs_done += 1
+            logger.info(f"📋 任务 {job_id} 结束: {status} ({time.perf_counter() - start:.1f}s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 任务 {job_id} 执行异常: {str(e)}")
+            await Job.finish(job_id, JOB_FAILED)
+        finally:
+            self._slots.release()
+
+    async def _process_items(self, job: Dict[str, Any]) -> Optional[str]:
+        """
+        并行处理尚未完成的图像
+        返回 None (全部处理完)、"cancelled" (已请求取消) 或 "lost" (租约已被其他工作进程接管)。
+        """
+        job_id = job["_id"]
+        pending = [item for item in job["items"] if item["status"] == ITEM_PENDING]
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in pending:
+            queue.put_nowait(item)
+        outcome = None
+
+        async def renew() -> bool:
+            """续约并读取取消标记；返回是否可以继续处理"""
+            nonlocal outcome
+            state = await Job.renew_lease(job_id, self.worker_id, self.lease_seconds)
+            if state is None:
+                outcome = "lost"
+            elif state.get("cancel_requested") and outcome is None:
+                outcome = "cancelled"
+            return outcome is None
+
+        async def lane():
+            while outcome is None and not queue.empty():
+                item = queue.get_nowait()
+                try:
+                    proceed = await renew()
+                except Exception as e:
+                    # 续约的瞬时错误不使整个任务失败：放回队列，稍后重试 (租约真正过期后 renew 返回 lost)
+                    logger.warning(f"⚠️ 任务 {job_id} 续约失败，稍后重试: {str(e)}")
+                    queue.put_nowait(item)
+                    await asyncio.sleep(min(1.0, self.lease_seconds / 3))
+                    continue
+                if proceed:
+                    await self._process_item(job, item)
+                else:
+                    queue.put_nowait(item)
+
+        async def heartbeat():
+            """单张图像 (分块 / TTA) 可能比租约更久：每 lease_seconds/3 续约一次，租约丢失时中断正在处理的图像"""
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                try:
+                    await renew()
+                except Exception as e:
+                    logger.warning(f"⚠️ 任务 {job_id} 续约失败: {str(e)}")
+                    continue
+                if outcome == "lost":
+                    for task in lanes:
+                        task.cancel()
+                    return
+
+        lanes = [asyncio.create_task(lane()) for _ in range(min(self.item_concurrency, len(pending)) or 1)]
+        heartbeat_task = asyncio.create_task(heartbeat())
+        try:
+            results = await asyncio.gather(*lanes, return_exceptions=True)
+        finally:
+            heartbeat_task.cancel()
+            for task in lanes:
+                task.cancel()
+            await asyncio.gather(heartbeat_task, *lanes, return_exceptions=True)
+        if outcome != "lost":
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+        if outcome == "cancelled":
+            while not queue.empty():
+                item = queue.get_nowait()
+                await Job.record_item(job_id, item["index"], ITEM_SKIPPED, error="任务已取消")
+        return outcome
+
+    async def _process_item(self, job: Dict[str, Any], item: Dict[str, Any]):
+        job_id = job["_id"]
+        request_id = f"job_{job_id}_{item['index']}"
+        start = time.time()
+        try:
+            data = await storage_service.read_bytes(item["storage_key"])
+            image = bytes_to_image(data)
+            if image is None:
+                raise ValueError("图像数据格式错误，无法解码")
+            is_valid, error_msg = validate_image_size(
+                image, min_size=(100, 100),
+                max_size=(settings.MAX_IMAGE_DIMENSION, settings.MAX_IMAGE_DIMENSION)
+            )
+            if not is_valid:
+                raise ValueError(error_msg)
+
+            prediction_result = await self._predict(image, request_id, job.get("inference_mode"))
+            if prediction_result["status"] != "success":
+                raise RuntimeError(prediction_result.get("message", "预测失败"))
+
+            mask_ref = await storage_service.store_bytes(prediction_result["mask_png"], "image/png")
+            result = {
+                "confidence": prediction_result.get("confidence"),
+                "vessel_coverage": prediction_result.get("vessel_coverage"),
+                "inference_mode": prediction_result.get("inference_mode"),
+                "processing_time": time.time() - start,
+                "mask_file": mask_ref["key"],
+            }
+            result["prediction_id"] = Prediction(
+                request_id=request_id,
+                model_version=prediction_result.get("model_version", model_registry.default_version),
+                result_data={k: result[k] for k in ("confidence", "vessel_coverage", "processing_time")},
+                patient_id=job.get("patient_id"),
+                mask_file=mask_ref["key"]
+            ).save_later()
+
+            await Job.record_item(job_id, item["index"], ITEM_DONE, result=result)
+            self.items_done += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 任务 {job_id} 第 {item['index']} 张图像失败: {str(e)}")
+            await Job.record_item(job_id, item["index"], ITEM_FAILED, error=str(e))
+            self.items_failed += 1
+
+    async def _predict(self, image, request_id: str, mode: Optional[str]) -> Dict[str, Any]:
+        """推理队列已满时按 Retry-After 退避重试，任务不因瞬时拥塞失败"""
+        while True:
+            try:
+                return await model_registry.predict(None, image, request_id, mode=mode)
+            except InferenceQueueFullError as e:
+                await asyncio.sleep(e.retry_after)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._loop_task is not None and not self._loop_task.done(),
+            "active_jobs": len(self._job_tasks),
+            "max_concurrent_jobs": self.max_concurrent_jobs,
+            "item_concurrency": self.item_concurrency,
+            "jobs_done": self.jobs_done,
+            "items_done": self.items_done,
+            "items_failed": self.items_failed,
+        }
+
+
+# 创建全局任务工作者实例
+job_worker = JobWorker(
+    max_concurrent_jobs=settings.JOB_MAX_CONCURRENT_JOBS,
+    item_concurrency=settings.JOB_ITEM_CONCURRENCY,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    poll_interval=settings.JOB_POLL_INTERVAL
+)
+
+
+async def _run_standalone():
+    """独立工作进程：不启动 HTTP 服务，只领取并执行 MongoDB 中排队的任务"""
+    from core.database import init_db
+    from services.persistence_queue import write_behind
+
+    await init_db()
+    await write_behind.start()
+    await model_service.load_model(settings.MODEL_PATH)
+    await model_service.warmup()
+    job_worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_worker.stop()
+        await model_registry.shutdown()
+        await storage_service.drain()
+        await write_behind.stop()
+
+
+if __name__ == "__main__":
+    # 多节点部署: python -m services.job_service (各 API 节点设置 JOB_WORKER_ENABLED=false)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(_run_standalone())
+    except KeyboardInterrupt:
+        pass
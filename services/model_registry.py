@@ -0,0 +1,361 @@
+"""
+模型注册表 (Model Registry)
+--------------------------
+/api/v1/models/register 原先只记录元数据，服务始终只加载一个写死的权重文件。本模块让注册表真正可用：
+1. 已注册的版本通过 artifact_path 指向 MODEL_ARTIFACT_DIR 内的权重文件 (TorchScript 或 state_dict，
+   不反序列化任意 pickle)；启动版本 (MODEL_VERSION) 使用 MODEL_PATH。
+2. 多个版本可同时常驻：每个版本一个 ModelService (各自的微批调度器)，共享推理线程池与准入队列。
+   常驻权重总量不超过 MODEL_MEMORY_BUDGET_MB、数量不超过 MODEL_MAX_RESIDENT，超出时按 LRU 卸载 (默认版本除外)。
+3. 请求可通过 model_version 选择常驻的版本；加载只由管理接口 (及影子候选) 触发，未常驻的版本返回 404，
+   避免客户端轮换版本号造成反复加载 / 淘汰 (MODEL_LOAD_ON_DEMAND=True 时恢复按需加载)。同一版本的并发加载只执行一次。
+4. activate() 在后台加载并预热新版本，完成后原子地切换默认版本 (单次赋值，事件循环内无竞争)。
+   已路由到旧版本的请求持有旧实例并正常完成；卸载前从常驻表移除实例，再等待其在途请求排空。
+5. 加载 / 预热 / 切换 / 卸载耗时记入 retina_model_lifecycle_seconds、生命周期记录与 models 集合的 runtime 字段。
+6. 配置了候选版本时，成功的在线预测按比例交给影子推理 (services.shadow) 在候选版本上低优先级重跑并对比。
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core import metrics
+from core.config import settings
+from core.rate_limit import request_deadline
+from models.model import ModelInfo
+from services.model_service import ModelService, model_service
+from services.shadow import ShadowRunner
+
+logger = logging.getLogger(__name__)
+
+
+class ModelVersionError(Exception):
+    """请求的模型版本不可用 (未注册、缺少权重文件、加载失败或不允许的操作)，status_code 供接口层使用"""
+
+    def __init__(self, version: str, message: str, status_code: int = 404):
+        self.version = version
+        self.status_code = status_code
+        super().__init__(message)
+
+
+def confine_artifact(artifact_path: str) -> Optional[str]:
+    """
+    把登记的权重路径解析为 MODEL_ARTIFACT_DIR 内的真实路径 (相对路径相对该目录)
+    解析符号链接后位于目录之外时返回 None
+    """
+    root = os.path.realpath(settings.MODEL_ARTIFACT_DIR)
+    real = os.path.realpath(os.path.join(root, artifact_path))
+    if os.path.commonpath([root, real]) != root:
+        return None
+    return real
+
+
+class ModelRegistry:
+    """
+    多版本模型管理器
+    常驻表按最近使用排序 (末尾为最近使用)；在途请求按实例计数，卸载时据此等待排空。
+    """
+
+    def __init__(self,
+                 primary: ModelService,
+                 memory_budget_mb: int = 2048,
+                 max_resident: int = 3,
+                 load_on_demand: bool = False,
+                 drain_timeout: float = 30.0,
+                 history_size: int = 50,
+                 shadow_options: Optional[Dict[str, Any]] = None):
+        self.primary = primary
+        # 0 表示不限制内存，只按数量上限淘汰
+        self.memory_budget = int(memory_budget_mb) * 1024 * 1024 if memory_budget_mb and memory_budget_mb > 0 else None
+        self.max_resident = max(1, int(max_resident))
+        self.load_on_demand = load_on_demand
+        self.drain_timeout = float(drain_timeout)
+
+        self.default_version = primary.model_version
+        self._resident: "OrderedDict[str, ModelService]" = OrderedDict([(primary.model_version, primary)])
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._activations: Dict[str, asyncio.Task] = {}
+        self._inflight: Dict[ModelService, int] = {}
+        self._drained: Dict[ModelService, asyncio.Event] = {}
+        self._runtime_tasks: Set[asyncio.Task] = set()
+        self.history = deque(maxlen=max(1, int(history_size)))
+        # 影子推理 (候选版本对比)，参数见 ShadowRunner
+        self.shadow = ShadowRunner(self, **(shadow_options or {}))
+
+    @property
+    def default(self) -> ModelService:
+        return self._resident[self.default_version]
+
+    # ------------------------------------------------------------------
+    # 请求路由
+    # ------------------------------------------------------------------
+    async def resolve(self, version: Optional[str] = None, allow_load: bool = False) -> ModelService:
+        """
+        返回版本对应的常驻实例 (None 为默认版本)
+        未常驻时：load_on_demand 或 allow_load (管理员配置的影子候选) 为真则加载，否则返回 404
+        """
+        version = version or self.default_version
+        if version not in self._resident and not (self.load_on_demand or allow_load):
+            raise ModelVersionError(version, f"模型版本 {version} 未加载 (需先通过管理接口加载)")
+        return await self._ensure(version)
+
+    async def _ensure(self, version: str) -> ModelService:
+        # 加载完成到本协程恢复之间，其他版本的加载可能已将其淘汰，因此循环直到取到常驻实例
+        while True:
+            service = self._resident.get(version)
+            if service is not None:
+                self._resident.move_to_end(version)
+                return service
+            await self.load(version)
+
+    @asynccontextmanager
+    async def acquire(self, version: Optional[str] = None, allow_load: bool = False):
+        """async with registry.acquire(v) as service: 期间该实例不会被卸载 (卸载会等待计数归零)"""
+        service = await self.resolve(version, allow_load)
+        # resolve 返回后到计数之间没有 await，卸载不会插入其中
+        self._inflight[service] = self._inflight.get(service, 0) + 1
+        try:
+            yield service
+        finally:
+            remaining = self._inflight[service] - 1
+            if remaining:
+                self._inflight[service] = remaining
+            else:
+                del self._inflight[service]
+                event = self._drained.pop(service, None)
+                if event is not None:
+                    event.set()
+
+    async def predict(self, version: Optional[str], image, request_id: str, **kwargs) -> Dict[str, Any]:
+        """在指定版本上推理 (参数同 ModelService.predict)；成功时按比例提交影子推理"""
+        async with self.acquire(version) as service:
+            result = await service.predict(image, request_id, **kwargs)
+        if result["status"] == "success" and self.shadow.enabled:
+            self.shadow.offer(service.model_version, service.executor, image, request_id, result,
+                              mode=kwargs.get("mode"), tta=kwargs.get("tta", ()))
+        return result
+
+    # ------------------------------------------------------------------
+    # 加载 / 切换 / 卸载
+    # ------------------------------------------------------------------
+    async def load(self, version: str) -> ModelService:
+        """加载版本并预热 (已常驻时直接返回；并发调用共享同一次加载)"""
+        service = self._resident.get(version)
+        if service is not None:
+            self._resident.move_to_end(version)
+            return service
+        task = self._loading.get(version)
+        if task is None:
+            task = asyncio.create_task(self._load(version), name=f"model-load-{version}")
+            self._loading[version] = task
+            task.add_done_callback(lambda t, v=version: self._on_load_done(v, t))
+        # 发起请求被取消时不中断共享的加载
+        return await asyncio.shield(task)
+
+    def _on_load_done(self, version: str, task: asyncio.Task):
+        self._loading.pop(version, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ 模型版本 {version} 加载失败: {task.exception()}")
+
+    async def _artifact_for(self, version: str) -> Tuple[str, bool]:
+        """返回 (权重路径, 是否允许回退到 ai_core/bestmodel.pt)"""
+        if version == settings.MODEL_VERSION:
+            return settings.MODEL_PATH, True
+        record = await ModelInfo.find_by_version(version)
+        if record is None:
+            raise ModelVersionError(version, f"模型版本 {version} 未注册")
+        artifact_path = record.get("artifact_path")
+        if not artifact_path:
+            raise ModelVersionError(version, f"模型版本 {version} 未登记权重文件 (artifact_path)", 409)
+        # 登记后目录内的符号链接仍可能被改指向别处，加载前重新校验
+        artifact_path = confine_artifact(artifact_path)
+        if artifact_path is None:
+            raise ModelVersionError(version, f"模型版本 {version} 的权重文件不在 MODEL_ARTIFACT_DIR 内", 409)
+        if not os.path.isfile(artifact_path):
+            raise ModelVersionError(version, f"模型版本 {version} 的权重文件不存在: {artifact_path}", 409)
+        return artifact_path, False
+
+    async def _load(self, version: str) -> ModelService:
+        # 加载任务可能由请求发起 (按需加载 / 影子候选)，预热不受该请求的截止时间限制
+        request_deadline.set(None)
+        artifact_path, fallback = await self._artifact_for(version)
+        resolved = ModelService.resolve_artifact(artifact_path, fallback)
+        # 先按权重文件大小腾出预算，避免新旧模型同时驻留时超出内存
+        await self._evict(protect=version,
+                          incoming_bytes=os.path.getsize(resolved) if resolved else 0)
+
+        service = ModelService(version, executor=self.primary.executor)
+        start = time.perf_counter()
+        # 启动版本的权重来自部署配置，视为可信；注册的版本只按 TorchScript / state_dict 加载
+        if not await service.load_model(artifact_path, fallback=fallback, trusted=fallback):
+            raise ModelVersionError(version, f"模型版本 {version} 加载失败: {artifact_path}", 503)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await service.warmup()
+        warmup_seconds = time.perf_counter() - start
+
+        # 预热完成后才对请求可见
+        self._resident[version] = service
+        self._record(version, "load", load_seconds, memory_bytes=service.memory_bytes,
+                     artifact_path=service.artifact_path)
+        self._record(version, "warmup", warmup_seconds)
+        await self._evict(protect=version)
+        return service
+
+    async def activate(self, version: str) -> Dict[str, Any]:
+        """加载 (如未常驻) 并把默认版本原子地切换为 version；旧默认版本保留常驻，之后可按 LRU 淘汰"""
+        start = time.perf_counter()
+        service = await self._ensure(version)
+        if not service.model_loaded:
+            raise ModelVersionError(version, f"模型版本 {version} 未成功加载", 503)
+
+        previous, self.default_version = self.default_version, version
+        switch_seconds = time.perf_counter() - start
+        self._record(version, "activate", switch_seconds, previous=previous)
+        logger.info(f"🔀 默认模型版本已切换: {previous} -> {version} (耗时 {switch_seconds:.2f}s)")
+        await self._evict()
+        return {"previous_version": previous, "default_version": version, "seconds": round(switch_seconds, 3)}
+
+    def activate_in_background(self, version: str) -> bool:
+        """后台加载并切换，立即返回；同一版本已在切换中时返回 False"""
+        task = self._activations.get(version)
+        if task is not None and not task.done():
+            return False
+        task = asyncio.create_task(self.activate(version), name=f"model-activate-{version}")
+        self._activations[version] = task
+        task.add_done_callback(lambda t, v=version: self._on_activation_done(v, t))
+        return True
+
+    def _on_activation_done(self, version: str, task: asyncio.Task):
+        self._activations.pop(version, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ 切换到模型版本 {version} 失败: {task.exception()}")
+
+    async def unload(self, version: str, reason: str = "manual") -> float:
+        """卸载常驻版本 (默认版本不可卸载)，返回卸载耗时 (秒)"""
+        if version == self.default_version:
+            raise ModelVersionError(version, f"模型版本 {version} 是当前默认版本，请先切换默认版本", 409)
+        service = self._resident.pop(version, None)
+        if service is None:
+            raise ModelVersionError(version, f"模型版本 {version} 未常驻")
+        return await self._retire(version, service, reason)
+
+    async def _retire(self, version: str, service: ModelService, reason: str) -> float:
+        """实例已从常驻表移除 (新请求不再路由到它)，等待在途请求排空后卸载"""
+        start = time.perf_counter()
+        if self._inflight.get(service):
+            event = self._drained.setdefault(service, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ 模型 {version} 排空超时，仍有 {self._inflight.get(service, 0)} 个在途请求，强制卸载")
+        drain_seconds = time.perf_counter() - start
+
+        unload_seconds = await service.unload()
+        self._record(version, "unload", unload_seconds, reason=reason, drain_seconds=round(drain_seconds, 3))
+        return unload_seconds
+
+    def resident_bytes(self) -> int:
+        return sum(service.memory_bytes for service in self._resident.values())
+
+    async def _evict(self, protect: Optional[str] = None, incoming_bytes: Optional[int] = None):
+        """
+        按 LRU 淘汰常驻版本，直到常驻权重 (+ 即将加载的 incoming_bytes) 不超过预算且数量不超过上限
+        默认版本、影子候选版本与 protect 不会被淘汰；无可淘汰的版本时只记录警告。
+        """
+        incoming = 0 if incoming_bytes is None else 1
+        victims: List[Tuple[str, ModelService]] = []
+        while (len(self._resident) + incoming > self.max_resident
+               or (self.memory_budget is not None
+                   and self.resident_bytes() + (incoming_bytes or 0) > self.memory_budget)):
+            candidates = [v for v in self._resident
+                          if v not in (self.default_version, self.shadow.candidate_version, protect)]
+            if not candidates:
+                logger.warning(f"⚠️ 模型常驻内存超出预算 ({self.resident_bytes() / (1024 * 1024):.1f} MB)，"
+                               f"但没有可卸载的版本")
+                break
+            victims.append((candidates[0], self._resident.pop(candidates[0])))
+
+        if victims:
+            logger.info(f"♻️ 按 LRU 卸载模型版本: {', '.join(v for v, _ in victims)}")
+            await asyncio.gather(*(self._retire(v, service, "lru") for v, service in victims))
+
+    # ------------------------------------------------------------------
+    # 记录与统计
+    # ------------------------------------------------------------------
+    def _record(self, version: str, action: str, seconds: float, **extra: Any):
+        """记录一次生命周期操作：指标直方图、内存中的历史，以及 models 集合的 runtime 字段 (后台写入)"""
+        metrics.MODEL_LIFECYCLE_SECONDS.labels(action).observe(seconds)
+        self.history.append({"version": version, "action": action, "seconds": round(seconds, 3),
+                             "timestamp": datetime.now().isoformat(), **extra})
+
+        fields = {f"last_{action}_seconds": round(seconds, 3), f"last_{action}_at": datetime.utcnow()}
+        if "memory_bytes" in extra:
+            fields["memory_bytes"] = extra["memory_bytes"]
+        task = asyncio.create_task(self._save_runtime(version, fields))
+        self._runtime_tasks.add(task)
+        task.add_done_callback(self._runtime_tasks.discard)
+
+    @staticmethod
+    async def _save_runtime(version: str, fields: Dict[str, Any]):
+        try:
+            await ModelInfo.record_runtime(version, fields)
+        except Exception as e:
+            logger.debug(f"模型运行时信息未写入 ({version}): {str(e)}")
+
+    def get_history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        items = list(self.history)
+        return items[-limit:] if limit else items
+
+    def get_stats(self) -> Dict[str, Any]:
+        resident = []
+        for version, service in self._resident.items():
+            info = service.get_model_info()
+            info.update(default=version == self.default_version,
+                        in_flight=self._inflight.get(service, 0),
+                        warmed_up=service.warmed_up,
+                        loaded_at=service.load_time.isoformat() if service.load_time else None)
+            resident.append(info)
+        return {
+            "default_version": self.default_version,
+            "resident_count": len(self._resident),
+            "resident_bytes": self.resident_bytes(),
+            "memory_budget_bytes": self.memory_budget,
+            "max_resident": self.max_resident,
+            "load_on_demand": self.load_on_demand,
+            # 按最近使用排序，末尾为最近使用
+            "resident": resident,
+            "loading": list(self._loading),
+            "activating": list(self._activations),
+            "shadow": self.shadow.get_stats(),
+        }
+
+    async def shutdown(self):
+        """服务关闭：停止影子推理与其他版本的调度器、进程池，最后关闭主实例 (持有共享的推理线程池)"""
+        await self.shadow.stop()
+        for service in list(self._resident.values()):
+            if service is not self.primary:
+                await service.shutdown()
+        await self.primary.shutdown()
+
+
+# 创建全局模型注册表 (启动时加载的 model_service 为初始默认版本)
+model_registry = ModelRegistry(
+    primary=model_service,
+    memory_budget_mb=settings.MODEL_MEMORY_BUDGET_MB,
+    max_resident=settings.MODEL_MAX_RESIDENT,
+    load_on_demand=settings.MODEL_LOAD_ON_DEMAND,
+    drain_timeout=settings.MODEL_DRAIN_TIMEOUT,
+    history_size=settings.MODEL_LIFECYCLE_HISTORY,
+    shadow_options=dict(
+        candidate_version=settings.SHADOW_MODEL_VERSION,
+        sample_rate=settings.SHADOW_SAMPLE_RATE,
+        max_pending=settings.SHADOW_MAX_PENDING,
+        pressure_threshold=settings.SHADOW_PRESSURE_THRESHOLD,
+        persist=settings.SHADOW_PERSIST
+    )
+)
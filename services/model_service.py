@@ -3,15 +3,18 @@ AI 模型服务核心模块 (Model Service Core)
 ---------------------------------------
 本模块封装了 PyTorch 模型的加载、预处理、推理和后处理逻辑。
 主要职责：
-1. 在服务启动时加载 .pt 模型文件到内存/显存。
-2. 对输入图像进行 Resize 和 Min-Max 归一化（与训练时保持一致）。
-3. 执行推理并处理双通道输出。
-4. 将推理结果转换为二值化掩码并编码为 Base64。
+1. 在服务启动时加载 .pt 模型文件到内存/显存 (优先使用导出的冻结 TorchScript 模型)。
+   每个实例对应一个模型版本；多版本常驻与热切换由 services.model_registry 管理。
+2. 对输入图像进行 Resize 和 Min-Max 归一化（与训练时保持一致），直接写入复用的批缓冲区。
+3. 通过微批调度器合并并发请求，执行批量推理并处理双通道输出。
+4. 将推理结果转换为二值化掩码并编码为 PNG (响应格式由接口层决定)。
 """
+import asyncio
+import contextlib
 import logging
 import time
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 import os
 import sys
 import torch
@@ -19,7 +22,17 @@ import cv2
 from datetime import datetime
 
 from core.config import settings
-from utils.image_utils import image_to_base64
+from core import metrics
+from core.rate_limit import DeadlineExceeded
+from utils.image_utils import encode_image
+from services.batch_scheduler import BatchScheduler
+from services.inference_executor import InferenceExecutor
+from services.process_pool import ProcessInferencePool
+from services.tiling import TilePlan, TileAccumulator
+from services.preprocessing import InputSpec, Preprocessor, normalization_params
+from services.tta import fill_views, merge_views
+from ai_core.export import fold_conv_bn, optimized_model_path
+from ai_core.quantize import PRECISIONS, int8_model_path
 
 # === 关键设置 ===
 # 1. 把 ai_core 加入系统路径
@@ -28,6 +41,52 @@ sys.path.append(AI_CORE_PATH)
 
 logger = logging.getLogger(__name__)
 
+# 支持的推理模式
+INFERENCE_MODES = ("resize", "tiled", "auto")
+
+
+def vessel_probabilities(output: torch.Tensor) -> np.ndarray:
+    """
+    把模型原始输出 (N, C, H, W) 转换为 (N, H, W) 的血管概率图
+    (多进程推理池的子进程也复用此函数，保证两种模式结果一致)
+    """
+    # 如果是多分类 (Batch, 2, H, W)，通常 Channel 1 是血管；单通道直接用
+    if output.shape[1] == 2:
+        output_vessel = output[:, 1, :, :]
+    else:
+        output_vessel = output[:, 0, :, :]
+
+    # bf16 autocast 的输出需要先转回 float32 才能交给 NumPy
+    probs = output_vessel.float().cpu().numpy()
+
+    # 动态决策：如果数值在 [0, 1] 之外（比如 -10, +10），说明需要 Sigmoid (逐张判断)
+    for i in range(probs.shape[0]):
+        if probs[i].min() < 0 or probs[i].max() > 1.5:
+            probs[i] = 1 / (1 + np.exp(-probs[i]))  # NumPy 版 Sigmoid
+
+    return probs
+
+
+def model_memory_bytes(model: torch.nn.Module, artifact_path: Optional[str] = None) -> int:
+    """
+    估算模型常驻内存 (参数 + 缓冲区字节数)
+    冻结的 TorchScript 模型参数已内联为常量，parameters() 为空，此时以权重文件大小估算。
+    """
+    size = sum(t.numel() * t.element_size() for t in model.parameters())
+    size += sum(t.numel() * t.element_size() for t in model.buffers())
+    if artifact_path and os.path.exists(artifact_path):
+        size = max(size, os.path.getsize(artifact_path))
+    return int(size)
+
+
+def resolve_precision(model_version: str) -> str:
+    """按模型版本查找推理精度，未配置时使用 MODEL_DEFAULT_PRECISION"""
+    precision = settings.MODEL_PRECISION_BY_VERSION.get(model_version, settings.MODEL_DEFAULT_PRECISION).lower()
+    if precision not in PRECISIONS:
+        logger.warning(f"⚠️ 未知的推理精度 {precision}，使用 fp32")
+        return "fp32"
+    return precision
+
 
 class ModelService:
     """
@@ -35,41 +94,118 @@ class ModelService:
     集成真实的 PyTorch U-Net 模型进行推理
     """
 
-    def __init__(self):
+    def __init__(self, model_version: Optional[str] = None, executor: Optional[InferenceExecutor] = None):
+        """
+        model_version: 模型版本，默认 settings.MODEL_VERSION
+        executor: 共享的推理执行器 (模型注册表加载的其他版本与主实例共用同一线程池与准入队列)
+        """
         self.model = None
         self.model_loaded = False
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model_name = "U-Net (PyTorch)"
-        self.model_version = "1.0.0-release"
+        self.model_version = model_version or settings.MODEL_VERSION
         self.load_time = None
+        self.model_backend = None
+        self.artifact_path = None
+        self.memory_bytes = 0
+        self.load_seconds = None
+        self.unload_seconds = None
+        # 预热完成前就绪检查不通过
+        self.warmed_up = False
+        # 推理精度 (fp32 / int8 / bf16)，按模型版本配置
+        self.precision = resolve_precision(self.model_version)
         self.prediction_count = 0
 
-        logger.info(f"🎯 模型服务初始化 (设备: {self.device})")
-
-    async def load_model(self, model_path: str) -> bool:
-        """加载真实模型权重"""
+        # 预处理器：每个推理线程复用自己的缓冲区；GPU 上批缓冲区使用锁页内存
+        self.preprocessor = Preprocessor(input_size=(512, 512), pin_memory=self.device.type == "cuda")
+
+        # 多进程推理池 (INFERENCE_EXECUTOR="process")：多个子进程共享同一份模型权重
+        self.process_pool = None
+        if settings.INFERENCE_EXECUTOR == "process":
+            self.process_pool = ProcessInferencePool(
+                processes=settings.INFERENCE_PROCESSES,
+                torch_threads=settings.INFERENCE_TORCH_THREADS
+            )
+
+        # 推理执行器：CPU 密集的各阶段都在专用线程池中执行，不阻塞事件循环
+        # 多进程模式下线程只负责预处理/编码并等待子进程，线程数至少与进程数相同
+        inference_workers = settings.INFERENCE_WORKERS
+        if self.process_pool is not None:
+            inference_workers = max(inference_workers, self.process_pool.processes)
+        self._owns_executor = executor is None
+        self.executor = executor or InferenceExecutor(
+            max_workers=inference_workers,
+            torch_threads=settings.INFERENCE_TORCH_THREADS,
+            max_queue=settings.INFERENCE_MAX_QUEUE,
+            retry_after=settings.INFERENCE_RETRY_AFTER
+        )
+
+        # 微批调度器：并发请求在时间窗口内合并为一次前向推理
+        self.batch_scheduler = None
+        if settings.BATCH_ENABLED:
+            self.batch_scheduler = BatchScheduler(
+                runner=self._run_batch,
+                max_batch_size=settings.BATCH_MAX_SIZE,
+                max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+                max_inflight_batches=self.process_pool.processes if self.process_pool else inference_workers,
+                name=f"unet:{self.model_version}"
+            )
+
+        logger.info(f"🎯 模型服务初始化 (版本: {self.model_version}, 设备: {self.device})")
+
+    @staticmethod
+    def resolve_artifact(model_path: Optional[str], fallback: bool = True) -> Optional[str]:
+        """
+        确定实际加载的权重文件：优先使用传入的路径 (settings.MODEL_PATH 或注册表中登记的权重)，
+        文件不存在且允许回退时使用随代码发布的 ai_core/bestmodel.pt。
+        """
+        if model_path and os.path.exists(model_path):
+            return model_path
+        default_path = os.path.join(AI_CORE_PATH, 'bestmodel.pt')
+        if fallback and os.path.exists(default_path):
+            if model_path:
+                logger.warning(f"⚠️ 找不到模型文件 {model_path}，回退到 {default_path}")
+            return default_path
+        return None
+
+    async def load_model(self, model_path: str, fallback: bool = True, trusted: bool = True) -> bool:
+        """
+        加载真实模型权重
+        fallback: model_path 不存在时是否回退到 ai_core/bestmodel.pt (注册表加载指定版本时为 False)
+        trusted: 权重来自部署配置 (MODEL_PATH) 时为 True；通过接口注册的版本为 False，
+                 只接受 TorchScript 或 state_dict，不反序列化任意 pickle 对象
+        """
         try:
-            logger.info(f"🔧 开始加载模型...")
+            logger.info(f"🔧 开始加载模型 {self.model_version}...")
             start_time = time.time()
 
-            real_model_path = os.path.join(AI_CORE_PATH, 'bestmodel.pt')
+            real_model_path = self.resolve_artifact(model_path, fallback)
 
-            if not os.path.exists(real_model_path):
-                logger.error(f"❌ 找不到模型文件: {real_model_path}")
+            if real_model_path is None:
+                logger.error(f"❌ 找不到模型文件: {model_path}")
                 return False
 
-            # 2. 加载完整模型
-            # weights_only=False 解决 FutureWarning
-            self.model = torch.load(real_model_path, map_location=self.device, weights_only=False)
-
-            self.model.to(self.device)
-            self.model.eval()
+            # 2. 加载模型 (优先使用 python -m ai_core.export 导出的冻结 TorchScript 模型)
+            self.model, self.model_backend = self._load_weights(real_model_path, trusted)
+            self.artifact_path = real_model_path
+            self.memory_bytes = model_memory_bytes(self.model, real_model_path)
 
             self.model_loaded = True
             self.load_time = datetime.now()
+            self.executor.start()
+            if self.process_pool is not None:
+                if self.device.type != "cpu":
+                    logger.warning("⚠️ 多进程推理池仅支持 CPU，已回退到线程池模式")
+                    self.process_pool = None
+                else:
+                    self.process_pool.start(self.model, bf16=self.precision == "bf16")
             load_duration = time.time() - start_time
+            self.load_seconds = round(load_duration, 3)
+            metrics.MODEL_LOAD_SECONDS.set(load_duration)
+            metrics.MODEL_LOADED.set(1)
 
-            logger.info(f"✅ 模型加载成功! 耗时: {load_duration:.2f}s")
+            logger.info(f"✅ 模型 {self.model_version} 加载成功! 耗时: {load_duration:.2f}s "
+                        f"({self.memory_bytes / (1024 * 1024):.1f} MB, {self.model_backend})")
             return True
 
         except Exception as e:
@@ -79,104 +215,450 @@ class ModelService:
             self.model_loaded = False
             return False
 
-    async def predict(self, image: np.ndarray, request_id: str) -> Dict[str, Any]:
-        """使用真实模型进行推理 (Debug 版)"""
-        if not self.model_loaded:
-            return {"status": "error", "message": "模型未加载", "request_id": request_id}
-
-        try:
-            start_time = time.time()
-            self.prediction_count += 1
-
-            # === 1. 图像预处理 ===
-            original_h, original_w = image.shape[:2]
-            img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img_rgb, (512, 512))
-
-            img_float = img_resized.astype(np.float32)
-            min_val = np.min(img_float)
-            max_val = np.max(img_float)
-            if max_val - min_val > 1e-5:
-                img_normalized = (img_float - min_val) / (max_val - min_val)
+    def _load_weights(self, checkpoint_path: str, trusted: bool = True) -> Tuple[torch.nn.Module, str]:
+        """
+        加载模型权重，返回 (模型, 后端名称)
+        - int8 精度：加载 python -m ai_core.quantize 导出的 <checkpoint>.int8.pt (比原始权重旧时回退到 fp32)
+        - 冻结模型存在且不比原始权重旧时直接 torch.jit.load；否则加载 pickle 的完整模型并折叠 Conv+BN。
+        - 非可信权重 (注册的版本) 不走 pickle：见 _load_untrusted。
+        多进程模式需要通过共享内存传递参数，而 TorchScript 模型的参数已内联为常量，因此始终使用 eager 模型。
+        """
+        if self.precision == "int8":
+            int8_path = int8_model_path(checkpoint_path)
+            if self.process_pool is None and os.path.exists(int8_path):
+                if os.path.getmtime(int8_path) >= os.path.getmtime(checkpoint_path):
+                    torch.backends.quantized.engine = settings.QUANTIZATION_BACKEND
+                    model = torch.jit.load(int8_path, map_location="cpu")
+                    logger.info(f"⚡ 使用 int8 量化模型: {int8_path}")
+                    return model.eval(), "torchscript-int8"
+                logger.warning(f"⚠️ int8 模型比原始权重旧 (需重新运行 python -m ai_core.quantize)，回退到 fp32: {int8_path}")
             else:
-                img_normalized = img_float / 255.0
-
-            img_transposed = img_normalized.transpose((2, 0, 1))
-            img_tensor = torch.from_numpy(img_transposed).unsqueeze(0).to(self.device)
+                logger.warning(f"⚠️ int8 模型不可用 (文件缺失或多进程模式)，回退到 fp32: {int8_path}")
+            self.precision = "fp32"
+
+        frozen_path = optimized_model_path(checkpoint_path)
+        use_frozen = (
+            settings.MODEL_PREFER_OPTIMIZED
+            and self.process_pool is None
+            and os.path.exists(frozen_path)
+            and os.path.getmtime(frozen_path) >= os.path.getmtime(checkpoint_path)
+        )
+        if use_frozen:
+            model = torch.jit.load(frozen_path, map_location=self.device)
+            logger.info(f"⚡ 使用冻结 TorchScript 模型: {frozen_path}")
+            return model.eval(), "torchscript-frozen"
+
+        if not trusted:
+            return self._load_untrusted(checkpoint_path)
+
+        # weights_only=False 解决 FutureWarning
+        model = torch.load(checkpoint_path, map_location=self.device, weights_only=False)
+        model.to(self.device)
+        model.eval()
+        folded = fold_conv_bn(model)
+        logger.info(f"🧩 Eager 模型已折叠 Conv+BN: {folded} 层")
+        return model, "eager"
+
+    def _load_untrusted(self, checkpoint_path: str) -> Tuple[torch.nn.Module, str]:
+        """
+        加载注册版本的权重：TorchScript 模型直接 torch.jit.load；
+        否则以 weights_only=True 读取 state_dict 并装入 ai_core.Unet.UNet (输入 / 输出通道数由权重形状推断)
+        """
+        if self.process_pool is None:
+            try:
+                model = torch.jit.load(checkpoint_path, map_location=self.device)
+                logger.info(f"⚡ 使用 TorchScript 模型: {checkpoint_path}")
+                return model.eval(), "torchscript"
+            except RuntimeError:
+                pass  # 不是 TorchScript 归档，按 state_dict 读取
+
+        state_dict = torch.load(checkpoint_path, map_location=self.device, weights_only=True)
+        if not isinstance(state_dict, dict) or "conv1.feature.0.weight" not in state_dict:
+            raise ValueError(f"注册的权重必须是 TorchScript 模型或 UNet 的 state_dict: {checkpoint_path}")
+        from ai_core.Unet import UNet
+        model = UNet(state_dict["conv1.feature.0.weight"].shape[1], state_dict["conv10.weight"].shape[0])
+        model.load_state_dict(state_dict)
+        model.to(self.device)
+        model.eval()
+        folded = fold_conv_bn(model)
+        logger.info(f"🧩 state_dict 已装入 UNet 并折叠 Conv+BN: {folded} 层")
+        return model, "eager"
+
+    def _autocast(self):
+        """bf16 精度时在 CPU 上启用 autocast，其余精度不做处理"""
+        if self.precision == "bf16":
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        """对 (N, 3, H, W) 批输入执行一次前向推理，返回 (N, H, W) 的血管概率图"""
+        # 批缓冲区为锁页内存时可异步拷贝到显存；CPU 上 from_numpy 本身零拷贝
+        img_tensor = torch.from_numpy(batch).to(self.device, non_blocking=True)
+
+        with torch.no_grad(), self._autocast():
+            output = self.model(img_tensor)
+            logger.debug(f"🔍 [Debug] 模型原始输出 Shape: {output.shape}")
+            return vessel_probabilities(output)
+
+    def _forward_batch(self, batch: np.ndarray) -> np.ndarray:
+        if self.process_pool is not None:
+            return self.process_pool.forward(batch)
+        return self._forward(batch)
+
+    @staticmethod
+    def _slot_chunks(payloads: List[InputSpec], indices: List[int]) -> List[List[int]]:
+        """
+        把同形状的输入按槽位数切分为若干次前向 (限制峰值内存)
+        TTA 输入占 len(views) 个槽位且不会被拆开；没有 TTA 输入时整组就是一次前向。
+        """
+        budget = max(settings.BATCH_MAX_SIZE, max(payloads[i].slots for i in indices))
+        chunks, chunk, used = [], [], 0
+        for i in indices:
+            if chunk and used + payloads[i].slots > budget:
+                chunks.append(chunk)
+                chunk, used = [], 0
+            chunk.append(i)
+            used += payloads[i].slots
+        chunks.append(chunk)
+        return chunks
+
+    def _forward_payloads(self, payloads: List[InputSpec]) -> List[np.ndarray]:
+        # 同一批中可能混有不同尺寸的输入 (如非 512 的图块)，按形状分组后各自前向
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for i, payload in enumerate(payloads):
+            groups.setdefault(payload.shape, []).append(i)
+
+        results: List[np.ndarray] = [None] * len(payloads)
+        for shape, indices in groups.items():
+            for chunk in self._slot_chunks(payloads, indices):
+                # 预处理直接写入复用的批缓冲区槽位，不再逐张分配后 np.stack
+                batch = self.preprocessor.batch_buffer(sum(payloads[i].slots for i in chunk), shape)
+                start = time.perf_counter()
+                spans = []
+                slot = 0
+                for i in chunk:
+                    payload = payloads[i]
+                    payload.fill(batch[slot])
+                    if payload.views:
+                        # TTA：其余视图由已预处理的槽位翻转 / 旋转复制，与原图同一次前向
+                        fill_views(batch[slot:slot + payload.slots], payload.views)
+                    spans.append((i, slot))
+                    slot += payload.slots
+                filled = time.perf_counter()
+                probs = self._forward_batch(batch)
+                metrics.observe_stage("preprocess", filled - start)
+                metrics.observe_stage("forward", time.perf_counter() - filled)
+                for i, slot in spans:
+                    payload = payloads[i]
+                    if payload.views:
+                        with metrics.stage_timer("tta_merge"):
+                            results[i] = merge_views(probs[slot:slot + payload.slots], payload.views)
+                    else:
+                        results[i] = probs[slot]
+        return results
+
+    async def _run_batch(self, payloads: List[InputSpec]) -> List[np.ndarray]:
+        """微批调度器的 runner：在推理线程池中把整批预处理进批张量，执行单次前向后拆回逐条结果"""
+        return await self.executor.run(self._forward_payloads, payloads)
+
+    def _encode_result(self, probs: np.ndarray, original_size: Tuple[int, int]) -> Dict[str, Any]:
+        with metrics.stage_timer("postprocess"):
+            post = self._postprocess(probs, original_size)
+        with metrics.stage_timer("png_encode"):
+            post["mask_png"] = encode_image(post["mask"], "png") or b""
+        return post
+
+    def _postprocess(self, probs: np.ndarray, original_size: Tuple[int, int]) -> Dict[str, Any]:
+        """阈值化、还原到原图尺寸，并计算置信度与血管覆盖率"""
+        original_h, original_w = original_size
+        mask = (probs > 0.5).astype(np.uint8) * 255
+
+        if mask.shape != (original_h, original_w):
+            mask = cv2.resize(mask, (original_w, original_h), interpolation=cv2.INTER_NEAREST)
 
-            # === 2. 模型推理 ===
-            with torch.no_grad():
-                output = self.model(img_tensor)
+        return {
+            "mask": mask,
+            "confidence": float(probs.mean()),
+            "vessel_coverage": float(np.count_nonzero(mask) / mask.size),
+        }
 
-                # 🛑【关键 Debug】打印模型输出形状
-                logger.info(f"🔍 [Debug] 模型原始输出 Shape: {output.shape}")
+    @staticmethod
+    def _full_resolution_probs(probs: np.ndarray, original_size: Tuple[int, int]) -> np.ndarray:
+        """概率图双线性还原到原图尺寸 (与掩码的最近邻还原对应)"""
+        original_h, original_w = original_size
+        if probs.shape != (original_h, original_w):
+            probs = cv2.resize(probs, (original_w, original_h), interpolation=cv2.INTER_LINEAR)
+        return probs
+
+    @staticmethod
+    def _tta_summary(uncertainty: np.ndarray, agreement: np.ndarray, original_size: Tuple[int, int],
+                     with_map: bool) -> Dict[str, Any]:
+        """TTA 汇总：平均一致率、存在分歧的像素比例，以及可选的不确定性图 (标准差 0~0.5 映射到 0~255)"""
+        summary = {
+            "tta_agreement": round(float(agreement.mean()), 4),
+            "tta_uncertain_fraction": round(float(np.count_nonzero(agreement < 1.0) / agreement.size), 4),
+        }
+        if with_map:
+            heatmap = np.clip(uncertainty * 510.0, 0, 255).astype(np.uint8)
+            original_h, original_w = original_size
+            if heatmap.shape != (original_h, original_w):
+                heatmap = cv2.resize(heatmap, (original_w, original_h), interpolation=cv2.INTER_LINEAR)
+            summary["uncertainty_png"] = encode_image(heatmap, "png") or b""
+        return summary
+
+    async def _infer(self, img_input: InputSpec) -> np.ndarray:
+        """单个输入的推理入口：经微批调度器合并，或直接单张前向"""
+        if self.batch_scheduler is not None:
+            return await self.batch_scheduler.submit(img_input)
+        return (await self._run_batch([img_input]))[0]
+
+    # ------------------------------------------------------------------
+    # 分块 (Tiled) 全分辨率推理
+    # ------------------------------------------------------------------
+    def _prepare_tiled(self, image: np.ndarray, plan: TilePlan) -> Tuple[np.ndarray, float, float]:
+        """按需反射填充，并计算全图的归一化参数 (各图块使用同一组 Min-Max)"""
+        if plan.needs_padding:
+            image = cv2.copyMakeBorder(image, 0, plan.padded_height - plan.height,
+                                       0, plan.padded_width - plan.width, cv2.BORDER_REFLECT_101)
+        offset, scale = normalization_params(image.min(), image.max())
+        return image, offset, scale
+
+    async def _predict_tiled_probs(self, image: np.ndarray, tta: Tuple[str, ...] = ()) -> np.ndarray:
+        """
+        分块推理：重叠图块按 TILE_BATCH_SIZE 分组流式送入模型，
+        任一时刻只有一组图块张量在内存中，结果用加权窗口融合为全分辨率概率图。
+        启用 TTA 时每个图块的结果为 (3, t, t)，返回 (3, H, W)。
+        """
+        h, w = image.shape[:2]
+        plan = TilePlan(h, w, tile_size=settings.TILE_SIZE, overlap=settings.TILE_OVERLAP)
+        accumulator = TileAccumulator(plan, channels=3 if tta else 0)
+        padded, offset, scale = await self.executor.run(self._prepare_tiled, image, plan)
+
+        for coords in plan.batches(settings.TILE_BATCH_SIZE):
+            # 图块在批推理时才被写入批缓冲区，这里只传递坐标
+            specs = [self.preprocessor.tile_spec(padded, y, x, plan.tile_size, offset, scale, tta)
+                     for y, x in coords]
+            probs = await asyncio.gather(*(self._infer(spec) for spec in specs))
+            await self.executor.run(accumulator.add_many, coords, probs)
+
+        logger.debug(f"🧩 分块推理完成: {w}x{h}, 图块数={plan.num_tiles}")
+        return await self.executor.run(accumulator.result)
+
+    # ------------------------------------------------------------------
+    # 启动预热
+    # ------------------------------------------------------------------
+    def warmup_shapes(self) -> List[Tuple[int, Tuple[int, int, int]]]:
+        """
+        需要预热的 (批大小, 输入形状)
+        缩放模式的 512x512 与分块模式的 TILE_SIZE 图块都会经微批调度器合并，批大小可为 1..BATCH_MAX_SIZE。
+        同一形状按批大小从大到小排列，批缓冲区第一次就按最大批分配，不再扩容。
+        """
+        max_batch = settings.BATCH_MAX_SIZE if self.batch_scheduler is not None else 1
+        sizes = settings.WARMUP_BATCH_SIZES or range(1, max_batch + 1)
+        sizes = sorted({min(max(1, int(n)), max_batch) for n in sizes}, reverse=True)
+        shapes = [(3, 512, 512)]
+        if settings.TILE_SIZE != 512:
+            shapes.append((3, settings.TILE_SIZE, settings.TILE_SIZE))
+        return [(n, shape) for shape in shapes for n in sizes]
+
+    def _warmup_forward(self, batch_size: int, shape: Tuple[int, int, int]):
+        batch = self.preprocessor.batch_buffer(batch_size, shape)
+        batch.fill(0.5)
+        self._forward_batch(batch)
+
+    async def warmup(self) -> Dict[str, float]:
+        """
+        用空白输入按所有配置的批大小 / 图块形状各执行一次前向，并跑一遍后处理与 PNG 编码，
+        把 torch/oneDNN 内核选择、OpenCV 初始化与内存分配器增长的开销留在启动阶段。
+        返回 {"<批大小>x<形状>": 秒}。
+        """
+        if not self.model_loaded or self.warmed_up:
+            return {}
+        if not settings.WARMUP_ENABLED:
+            self.warmed_up = True
+            return {}
+
+        timings: Dict[str, float] = {}
+        for batch_size, shape in self.warmup_shapes():
+            start = time.perf_counter()
+            await self.executor.run(self._warmup_forward, batch_size, shape)
+            timings[f"{batch_size}x{shape[1]}x{shape[2]}"] = round(time.perf_counter() - start, 3)
+
+        # 输出尺寸与输入不同，顺带触发 cv2.resize 的初始化
+        start = time.perf_counter()
+        await self.executor.run(self._encode_result, np.full((512, 512), 0.5, dtype=np.float32), (1024, 1024))
+        timings["postprocess"] = round(time.perf_counter() - start, 3)
+
+        self.warmed_up = True
+        logger.info(f"🔥 模型预热完成: {len(timings) - 1} 个输入形状, 共 {sum(timings.values()):.2f}s")
+        return timings
+
+    def inference_params(self, mode: Optional[str] = None, tta: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """影响推理结果的参数集合 (用作预测缓存键的一部分)"""
+        params = {
+            "mode": (mode or settings.INFERENCE_MODE).lower(),
+            "precision": self.precision,
+            "input_size": "512x512",
+            "tile_size": settings.TILE_SIZE,
+            "tile_overlap": settings.TILE_OVERLAP,
+            "tile_auto_threshold": settings.TILE_AUTO_THRESHOLD,
+        }
+        if tta:
+            params["tta"] = list(tta)
+        return params
+
+    def resolve_mode(self, image: np.ndarray, mode: Optional[str] = None) -> str:
+        """确定推理模式：resize (缩放到 512) / tiled (全分辨率分块)；auto 按图像尺寸自动选择"""
+        mode = (mode or settings.INFERENCE_MODE).lower()
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"不支持的推理模式: {mode}。支持: {', '.join(INFERENCE_MODES)}")
+        if mode == "auto":
+            return "tiled" if max(image.shape[:2]) > settings.TILE_AUTO_THRESHOLD else "resize"
+        return mode
+
+    async def predict(self, image: np.ndarray, request_id: str, mode: Optional[str] = None,
+                      return_probs: bool = False, tta: Tuple[str, ...] = (),
+                      tta_map: bool = False) -> Dict[str, Any]:
+        """
+        使用真实模型进行推理 (并发请求经微批调度器合并为一次前向)
+        mode: resize / tiled / auto，默认取 settings.INFERENCE_MODE。
+        return_probs: 结果中附带原图尺寸的血管概率图 probs (评估 ROC-AUC 用)。
+        tta: 测试时增强视图 (services.tta.parse_views 的结果)，同一输入的所有视图在一次前向中完成；
+             tta_map 为真时附带不确定性图 uncertainty_png。
+        推理队列已满时抛出 InferenceQueueFullError，由接口层返回 503。
+        """
+        if not self.model_loaded:
+            return {"status": "error", "message": "模型未加载", "request_id": request_id}
 
-                # 处理输出
-                # 如果是多分类 (Batch, 2, H, W)，通常 Channel 1 是血管
-                if output.shape[1] == 2:
-                    logger.info("🔍 [Debug] 检测到双通道输出，取第2个通道 (Index 1) 作为血管")
-                    # 取出血管通道，并保留维度以便后续处理
-                    output_vessel = output[:, 1, :, :].unsqueeze(1)
-                else:
-                    # 单通道直接用
-                    output_vessel = output
+        async with self.executor.admit():
+            return await self._predict_admitted(image, request_id, mode, return_probs, tta, tta_map)
 
-                # ⚠️ 尝试移除 Sigmoid，直接看原始值分布
-                # 很多 U-Net 最后一层已经是 Sigmoid 了，或者输出就是概率
-                probs = output_vessel.squeeze().cpu().numpy()
+    async def predict_shadow(self, image: np.ndarray, request_id: str, mode: Optional[str] = None,
+                             tta: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """
+        影子推理 (services.shadow 调用)：不经过准入队列，不占用在线请求的名额，也不计入预测统计
+        是否执行由调用方按推理队列压力决定。
+        """
+        if not self.model_loaded:
+            return {"status": "error", "message": "模型未加载", "request_id": request_id}
+        return await self._predict_admitted(image, request_id, mode, tta=tta, record=False)
 
-                # 🛑【关键 Debug】打印数值范围，判断是否需要 Sigmoid
-                logger.info(f"🔍 [Debug] 输出数值范围: Min={probs.min():.4f}, Max={probs.max():.4f}")
+    async def _predict_admitted(self, image: np.ndarray, request_id: str, mode: Optional[str],
+                                return_probs: bool = False, tta: Tuple[str, ...] = (),
+                                tta_map: bool = False, record: bool = True) -> Dict[str, Any]:
+        try:
+            start_time = time.time()
+            if record:
+                self.prediction_count += 1
+            original_size = image.shape[:2]
+            mode = self.resolve_mode(image, mode)
+
+            if mode == "tiled":
+                # === 1+2. 全分辨率分块推理 ===
+                probs = await self._predict_tiled_probs(image, tta)
+            else:
+                # === 1+2. 预处理 (在批推理时写入批张量槽位) + 模型推理 (微批) ===
+                probs = await self._infer(self.preprocessor.resize_spec(image, tta))
 
-                # 动态决策：如果数值在 [0, 1] 之外（比如 -10, +10），说明需要 Sigmoid
-                if probs.min() < 0 or probs.max() > 1.5:
-                    logger.info("🔍 [Debug] 数值超出 [0,1]，应用 Sigmoid 激活")
-                    probs = 1 / (1 + np.exp(-probs))  # NumPy 版 Sigmoid
+            tta_result = None
+            if tta:
+                # 融合结果为 [平均概率, 不确定性, 一致率]
+                tta_result = await self.executor.run(self._tta_summary, probs[1], probs[2], original_size, tta_map)
+                probs = probs[0]
 
             # === 3. 后处理 ===
-            # 阈值化
-            mask = (probs > 0.5).astype(np.uint8) * 255
-
-            if mask.shape != (original_h, original_w):
-                mask = cv2.resize(mask, (original_w, original_h), interpolation=cv2.INTER_NEAREST)
-
-            confidence = float(probs.mean())
-            vessel_coverage = float(np.count_nonzero(mask) / mask.size)
-
-            result_base64 = image_to_base64(mask, "png")
+            post = await self.executor.run(self._encode_result, probs, original_size)
+            if return_probs:
+                post["probs"] = await self.executor.run(self._full_resolution_probs, probs, original_size)
             actual_time = time.time() - start_time
 
-            logger.info(f"✅ 真实预测完成 [{request_id}]")
+            if record:
+                logger.info(f"✅ 真实预测完成 [{request_id}]")
+                metrics.PREDICTIONS.labels(mode, "success").inc()
 
-            return {
+            result = {
                 "status": "success",
                 "request_id": request_id,
-                "result_image": result_base64,
+                "model_version": self.model_version,
+                "mask": post["mask"],
+                "mask_png": post["mask_png"],
                 "processing_time": actual_time,
-                "confidence": round(confidence, 4),
-                "vessel_coverage": round(vessel_coverage, 4),
+                "confidence": round(post["confidence"], 4),
+                "vessel_coverage": round(post["vessel_coverage"], 4),
+                "inference_mode": mode,
                 "message": "预测成功"
             }
-
+            if return_probs:
+                result["probs"] = post["probs"]
+            if tta_result is not None:
+                result.update(tta_result, tta_views=list(tta))
+            return result
+
+        except DeadlineExceeded:
+            # 交给接口层返回 504，不作为推理异常记录
+            raise
         except Exception as e:
             logger.error(f"❌ 预测异常: {str(e)}")
+            if record:
+                metrics.PREDICTIONS.labels(mode or "unknown", "error").inc()
             import traceback
             logger.error(traceback.format_exc())
             return {"status": "error", "request_id": request_id, "message": str(e)}
 
+    async def unload(self) -> float:
+        """
+        卸载模型：停止本版本的微批调度器与多进程推理池并释放权重 (共享的推理线程池保持运行)
+        调用方 (模型注册表) 需先等待本版本的在途请求完成。返回耗时 (秒)。
+        """
+        start = time.perf_counter()
+        self.model_loaded = False
+        self.warmed_up = False
+        if self.batch_scheduler is not None:
+            await self.batch_scheduler.stop()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+        self.model = None
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        self.unload_seconds = round(time.perf_counter() - start, 3)
+        logger.info(f"📤 模型 {self.model_version} 已卸载 (耗时 {self.unload_seconds:.2f}s)")
+        return self.unload_seconds
+
+    async def shutdown(self):
+        """服务关闭时停止后台调度器与推理线程池"""
+        if self.batch_scheduler is not None:
+            await self.batch_scheduler.stop()
+        if self._owns_executor:
+            self.executor.shutdown()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+
     def get_model_info(self) -> Dict[str, Any]:
         return {
             "model_name": self.model_name,
             "version": self.model_version,
             "status": "loaded" if self.model_loaded else "error",
             "device": str(self.device),
-            "input_size": "512x512"
+            "backend": self.model_backend,
+            "precision": self.precision,
+            "artifact_path": self.artifact_path,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 1),
+            "load_seconds": self.load_seconds,
+            "input_size": "512x512",
+            "inference_mode": settings.INFERENCE_MODE,
+            "tile_size": settings.TILE_SIZE,
+            "tile_overlap": settings.TILE_OVERLAP
         }
 
     def get_service_stats(self) -> Dict[str, Any]:
         return {
+            "model_loaded": self.model_loaded,
+            "service_status": "running" if self.model_loaded else "model_not_loaded",
             "total_predictions": self.prediction_count,
-            "uptime": str(datetime.now() - self.load_time) if self.load_time else "N/A"
+            "uptime": str(datetime.now() - self.load_time) if self.load_time else "N/A",
+            "executor": self.executor.get_stats(),
+            "process_pool": self.process_pool.get_stats() if self.process_pool else {"enabled": False},
+            "batching": self.batch_scheduler.get_stats() if self.batch_scheduler else {"enabled": False}
         }
 
 
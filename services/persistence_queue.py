@@ -0,0 +1,373 @@
+"""
+写后持久化队列 (Write-behind Persistence Queue)
+---------------------------------------------
+原先每次预测成功后都要依次 await Image.save() 与 Prediction.save()，两次 MongoDB 往返都在请求的关键路径上。
+本模块把这些文档放入内存队列，由后台协程批量写入：
+1. enqueue() 预先分配 ObjectId 并立即返回 (响应不再等待数据库)，Prediction 仍能引用 Image 的 ID。
+2. 后台协程取出第一条文档后，在 flush_interval 窗口内继续收集，凑满 batch_size 或超时即刷写；
+   同一批内按集合分组 (保持入队顺序)，每组一次 insert_many(ordered=True)。
+3. MongoDB 不可达时，未写入的文档以 Extended JSON 追加到本地日志文件 (journal)，
+   之后每隔 retry_interval 尝试重放，成功后截断日志；重复键 (已写入过的文档) 直接跳过。
+4. stop() 在应用关闭时排空队列，超时仍未写入的文档同样落入日志，不会丢失。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+from bson.objectid import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from core.config import settings
+from core.metrics import stage_timer
+from core.database import db
+
+logger = logging.getLogger(__name__)
+
+# MongoDB 重复键错误码
+DUPLICATE_KEY_ERROR = 11000
+
+_STOP = object()
+
+
+class _Journal:
+    """本地日志文件：每行一条 {"collection": ..., "doc": ...} (Extended JSON)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, entries: List[Tuple[str, Dict[str, Any]]]):
+        if not entries:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = "".join(json_util.dumps({"collection": c, "doc": d}) + "\n" for c, d in entries)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json_util.loads(line)
+            except ValueError:
+                # 进程崩溃时可能留下半行，跳过
+                logger.warning("⚠️ [DB] 日志中存在无法解析的行，已跳过")
+                continue
+            entries.append((record["collection"], record["doc"]))
+        return entries
+
+    def truncate(self, count: int):
+        """删除已重放的前 count 行 (重放期间新追加的行保留)"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            remaining = lines[count:]
+            if remaining:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(remaining)
+                os.replace(tmp_path, self.path)
+            else:
+                os.remove(self.path)
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+class WriteBehindQueue:
+    """
+    写后持久化队列
+    enqueue() 只在事件循环中调用；实际写入由后台协程完成。
+    """
+
+    def __init__(self,
+                 batch_size: int = 100,
+                 flush_interval_ms: float = 200.0,
+                 max_queue: int = 10000,
+                 journal_path: str = "data/persistence_journal.jsonl",
+                 retry_interval: float = 30.0,
+                 shutdown_timeout: float = 10.0):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.retry_interval = float(retry_interval)
+        self.shutdown_timeout = float(shutdown_timeout)
+        self.journal = _Journal(journal_path)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._current: List[Tuple[str, Dict[str, Any]]] = []
+        self._mongo_available = True
+        self._last_replay_attempt = 0.0
+
+        # 统计信息
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.journaled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._worker_task is None or self._worker_task.done():
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.create_task(self._worker(), name="write-behind-persistence")
+            logger.info(f"💾 写后持久化队列已启动 (batch={self.batch_size}, "
+                        f"interval={self.flush_interval * 1000:.0f}ms)")
+
+    async def start(self):
+        """启动后台写入协程，并尝试重放上次遗留的日志"""
+        self._ensure_started()
+        await self._replay_journal(force=True)
+
+    async def stop(self):
+        """排空队列后停止；超时未写入的文档写入本地日志"""
+        if self._worker_task is None:
+            return
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker_task), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ [DB] 关闭时刷写超时，剩余记录转存本地日志")
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+        self._worker_task = None
+
+        # 被取消时正在写入的批次可能只写入了一部分，重放时重复键会被跳过
+        pending = self._current
+        self._current = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                pending.append(item)
+        if pending:
+            await self._spill(pending)
+        logger.info("💾 写后持久化队列已停止")
+
+    # ------------------------------------------------------------------
+    # 入队
+    # ------------------------------------------------------------------
+    def enqueue(self, collection: str, document: Dict[str, Any]) -> str:
+        """
+        登记一条待写入的文档，立即返回其 ID 字符串
+        文档没有 _id 时预先分配 ObjectId；队列已满时直接追加到本地日志。
+        """
+        doc = dict(document)
+        doc.setdefault("_id", ObjectId())
+        self.enqueued += 1
+
+        self._ensure_started()
+        if self._queue.qsize() >= self.max_queue:
+            logger.warning("⚠️ [DB] 写入队列已满，记录直接写入本地日志")
+            self.journal.append([(collection, doc)])
+            self.journaled += 1
+        else:
+            self._queue.put_nowait((collection, doc))
+        return str(doc["_id"])
+
+    # ------------------------------------------------------------------
+    # 后台写入
+    # ------------------------------------------------------------------
+    async def _collect_batch(self) -> Tuple[List[Tuple[str, Dict[str, Any]]], bool]:
+        """
+        阻塞等待第一条文档，然后在刷写窗口内尽量凑满一批；返回 (批次, 是否收到停止信号)
+        本地日志中有待重放的文档时最多等待 retry_interval，超时返回空批次，使没有新流量时也能重放。
+        """
+        loop = asyncio.get_running_loop()
+        if self._mongo_available:
+            first = await self._queue.get()
+        else:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), self.retry_interval)
+            except asyncio.TimeoutError:
+                return [], False
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _worker(self):
+        while True:
+            batch, stopping = await self._collect_batch()
+            if batch:
+                self._current = batch
+                await self._flush(batch)
+                self._current = []
+            if stopping:
+                # 停止信号之后仍在队列中的文档也要写完
+                rest = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        rest.append(item)
+                for start in range(0, len(rest), self.batch_size):
+                    self._current = rest[start:]
+                    await self._flush(rest[start:start + self.batch_size])
+                self._current = []
+                return
+            await self._replay_journal()
+
+    async def _flush(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        """按集合分组写入；MongoDB 不可达时整批转存本地日志"""
+        if not self._mongo_available:
+            await self._spill(batch)
+            return
+
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for collection, doc in batch:
+            groups.setdefault(collection, []).append(doc)
+
+        for index, (collection, docs) in enumerate(groups.items()):
+            try:
+                with stage_timer("db_save"):
+                    self.written += await self._insert_ordered(collection, docs)
+            except PyMongoError as e:
+                logger.error(f"❌ [DB] MongoDB 写入失败，转存本地日志: {str(e)}")
+                self._mongo_available = False
+                self._last_replay_attempt = time.monotonic()
+                remaining = [(c, d) for c, ds in list(groups.items())[index:] for d in ds]
+                await self._spill(remaining)
+                return
+        self.batches += 1
+
+    async def _insert_ordered(self, collection: str, docs: List[Dict[str, Any]]) -> int:
+        """
+        ordered insert_many；遇到写错误时跳过出错的那条文档并继续写入其后的文档
+        重复键说明文档已写入 (日志重放或重试)，其他写错误无法通过重试修复，记录后丢弃。
+        连接类错误原样抛出，由调用方转存日志。
+        """
+        inserted = 0
+        while docs:
+            try:
+                await db[collection].insert_many(docs, ordered=True)
+                return inserted + len(docs)
+            except BulkWriteError as e:
+                details = e.details or {}
+                inserted += details.get("nInserted", 0)
+                errors = details.get("writeErrors") or []
+                if not errors:
+                    raise
+                error = errors[0]
+                if error.get("code") != DUPLICATE_KEY_ERROR:
+                    self.dropped += 1
+                    logger.error(f"❌ [DB] 文档写入被拒绝 ({collection}): {error.get('errmsg')}")
+                docs = docs[error["index"] + 1:]
+        return inserted
+
+    async def _spill(self, entries: List[Tuple[str, Dict[str, Any]]]):
+        await run_in_threadpool(self.journal.append, entries)
+        self.journaled += len(entries)
+
+    async def _replay_journal(self, force: bool = False):
+        """MongoDB 不可达期间定期重放本地日志，全部写入后恢复正常写入路径"""
+        if not force and self._mongo_available:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_replay_attempt < self.retry_interval:
+            return
+        self._last_replay_attempt = now
+
+        entries = await run_in_threadpool(self.journal.read)
+        if not entries:
+            self._mongo_available = True
+            return
+
+        replayed = 0
+        try:
+            for start in range(0, len(entries), self.batch_size):
+                chunk = entries[start:start + self.batch_size]
+                groups: Dict[str, List[Dict[str, Any]]] = {}
+                for collection, doc in chunk:
+                    groups.setdefault(collection, []).append(doc)
+                for collection, docs in groups.items():
+                    await self._insert_ordered(collection, docs)
+                replayed += len(chunk)
+        except PyMongoError as e:
+            logger.warning(f"⚠️ [DB] 日志重放失败，稍后重试: {str(e)}")
+            self._mongo_available = False
+        else:
+            self._mongo_available = True
+            logger.info(f"💾 [DB] 已从本地日志重放 {replayed} 条记录")
+        finally:
+            if replayed:
+                await run_in_threadpool(self.journal.truncate, replayed)
+                self.replayed += replayed
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._worker_task is not None and not self._worker_task.done(),
+            "mongo_available": self._mongo_available,
+            "queue_depth": self.queue_depth,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "journaled": self.journaled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "journal_bytes": self.journal.size(),
+        }
+
+
+# 创建全局写后队列实例
+write_behind = WriteBehindQueue(
+    batch_size=settings.PERSIST_BATCH_SIZE,
+    flush_interval_ms=settings.PERSIST_FLUSH_INTERVAL_MS,
+    max_queue=settings.PERSIST_MAX_QUEUE,
+    journal_path=settings.PERSIST_JOURNAL_PATH,
+    retry_interval=settings.PERSIST_RETRY_INTERVAL,
+    shutdown_timeout=settings.PERSIST_SHUTDOWN_TIMEOUT
+)
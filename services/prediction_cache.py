@@ -0,0 +1,292 @@
+"""
+预测结果缓存模块 (Content-addressed Prediction Cache)
+---------------------------------------------------
+临床场景中经常重复提交同一张眼底图 (重新打开报告、上传重试等)。
+本模块以「图像文件字节的 SHA-256 + 模型版本 + 推理参数」为键缓存预测结果，
+命中时跳过图像解码与 U-Net 推理。
+两级存储：
+1. 内存 LRU 层：按字节数限制容量，最久未使用的条目先淘汰。
+2. 磁盘层 (可选)：<key>.png 保存掩码，<key>.json 保存指标，按总大小做 LRU 淘汰。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    # 掩码 PNG 占绝大部分，其余字段按固定开销估算
+    return len(entry.get("mask_png", b"")) + 512
+
+
+class _DiskTier:
+    """磁盘缓存层：文件读写都在线程池中执行"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _paths(self, key: str):
+        return os.path.join(self.directory, f"{key}.png"), os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        """启动时扫描目录，按修改时间重建 LRU 顺序"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                # 上次进程在写入中途退出留下的临时文件
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            png_path, meta_path = self._paths(key)
+            try:
+                size = os.path.getsize(png_path) + os.path.getsize(meta_path)
+                entries.append((os.path.getmtime(meta_path), key, size))
+            except OSError:
+                continue
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+        logger.info(f"💽 磁盘缓存已加载: {len(self._index)} 条, {self.total_bytes / 1024 / 1024:.1f} MB")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        png_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            with open(png_path, "rb") as f:
+                entry["mask_png"] = f.read()
+            os.utime(meta_path)
+            return entry
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        """先写同目录下的临时文件再 os.replace，读取方不会看到写了一半的文件"""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        png_path, meta_path = self._paths(key)
+        meta = {k: v for k, v in entry.items() if k != "mask_png"}
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        try:
+            # meta 最后写入：启动扫描以 .json 为准，只会看到完整的条目
+            self._write_atomic(png_path, entry["mask_png"])
+            self._write_atomic(meta_path, meta_bytes)
+            size = len(entry["mask_png"]) + len(meta_bytes)
+        except OSError as e:
+            logger.error(f"⚠️ 写入磁盘缓存失败: {str(e)}")
+            return
+
+        with self._lock:
+            self.total_bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+        self._evict()
+
+    def _remove(self, key: str):
+        with self._lock:
+            self.total_bytes -= self._index.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or not self._index:
+                    return
+                key = next(iter(self._index))
+                self.evictions += 1
+            self._remove(key)
+
+
+class PredictionCache:
+    """
+    两级预测结果缓存
+    缓存条目字段：mask_png, confidence, vessel_coverage, inference_mode, image_info
+    """
+
+    def __init__(self, memory_max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.enabled = memory_max_bytes > 0 or bool(disk_dir)
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_bytes = 0
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._disk: Optional[_DiskTier] = None
+        self._disk_dir = disk_dir
+        self._disk_max_bytes = disk_max_bytes
+
+        # 统计信息
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.memory_evictions = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str, params: Dict[str, Any], content_digest=None) -> str:
+        """
+        缓存键：图像文件字节 + 模型版本 + 推理参数
+        content_digest 为已对图像字节增量计算的 hashlib.sha256 对象 (流式上传) 时从其副本继续，不再重复哈希。
+        """
+        if content_digest is not None:
+            digest = content_digest.copy()
+        else:
+            digest = hashlib.sha256()
+            digest.update(image_bytes)
+        digest.update(b"\0" + model_version.encode("utf-8"))
+        digest.update(b"\0" + json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _disk_tier(self) -> Optional[_DiskTier]:
+        # 首次使用时再创建，避免导入模块时扫描目录
+        if self._disk is None and self._disk_dir:
+            self._disk = _DiskTier(self._disk_dir, self._disk_max_bytes)
+        return self._disk
+
+    def _memory_put(self, key: str, entry: Dict[str, Any]):
+        if self.memory_max_bytes <= 0:
+            return
+        size = _entry_size(entry)
+        if size > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= _entry_size(old)
+        self._memory[key] = entry
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= _entry_size(evicted)
+            self.memory_evictions += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查询缓存，返回的条目带有 cache_tier 字段 (memory / disk)"""
+        if not self.enabled:
+            return None
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return dict(entry, cache_tier="memory")
+
+        disk = self._disk_tier()
+        if disk is not None:
+            entry = await run_in_threadpool(disk.get, key)
+            if entry is not None:
+                # 提升到内存层
+                self._memory_put(key, entry)
+                self.hits["disk"] += 1
+                return dict(entry, cache_tier="disk")
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, entry: Dict[str, Any]):
+        if not self.enabled or not entry.get("mask_png"):
+            return
+        self._memory_put(key, entry)
+        disk = self._disk_tier()
+        if disk is not None:
+            await run_in_threadpool(disk.put, key, entry)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total_hits = self.hits["memory"] + self.hits["disk"]
+        lookups = total_hits + self.misses
+        stats = {
+            "enabled": self.enabled,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(total_hits / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "memory_max_bytes": self.memory_max_bytes,
+            "memory_evictions": self.memory_evictions,
+        }
+        if self._disk is not None:
+            stats.update({
+                "disk_items": len(self._disk._index),
+                "disk_bytes": self._disk.total_bytes,
+                "disk_max_bytes": self._disk.max_bytes,
+                "disk_evictions": self._disk.evictions,
+            })
+        return stats
+
+
+def build_cache_entry(prediction_result: Dict[str, Any], image_info: Dict[str, Any]) -> Dict[str, Any]:
+    """从 ModelService.predict 的成功结果中提取需要缓存的字段"""
+    return {
+        "mask_png": prediction_result.get("mask_png", b""),
+        "confidence": prediction_result.get("confidence"),
+        "vessel_coverage": prediction_result.get("vessel_coverage"),
+        "inference_mode": prediction_result.get("inference_mode"),
+        "tta_views": prediction_result.get("tta_views"),
+        "tta_agreement": prediction_result.get("tta_agreement"),
+        "tta_uncertain_fraction": prediction_result.get("tta_uncertain_fraction"),
+        "image_info": image_info,
+    }
+
+
+def cache_entry_to_result(entry: Dict[str, Any], request_id: str) -> Dict[str, Any]:
+    """把缓存条目还原为与 ModelService.predict 一致的结果字典"""
+    return {
+        "status": "success",
+        "request_id": request_id,
+        "mask_png": entry["mask_png"],
+        "processing_time": 0.0,
+        "confidence": entry.get("confidence"),
+        "vessel_coverage": entry.get("vessel_coverage"),
+        "inference_mode": entry.get("inference_mode"),
+        "tta_views": entry.get("tta_views"),
+        "tta_agreement": entry.get("tta_agreement"),
+        "tta_uncertain_fraction": entry.get("tta_uncertain_fraction"),
+        "cache_hit": True,
+        "cache_tier": entry.get("cache_tier"),
+        "message": "预测成功 (缓存命中)"
+    }
+
+
+# 创建全局实例
+prediction_cache = PredictionCache(
+    memory_max_bytes=settings.CACHE_MEMORY_MAX_MB * 1024 * 1024,
+    disk_dir=settings.CACHE_DISK_DIR,
+    disk_max_bytes=settings.CACHE_DISK_MAX_MB * 1024 * 1024
+)
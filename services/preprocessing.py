@@ -0,0 +1,125 @@
+"""
+预处理模块 (Allocation-free Preprocessing)
+-----------------------------------------
+原先的预处理依次执行 cvtColor、resize、astype(float32)、np.min/np.max、归一化、transpose、from_numpy，
+每张图会产生约 6 个整幅图像大小的临时数组。本模块把这些步骤合并：
+1. 先在 BGR 上 resize 到每线程预分配的 uint8 缓冲区 (resize 与通道顺序无关，结果与先转 RGB 相同)。
+2. 在 uint8 数据上求 Min/Max (两次标量归约，不产生临时数组)。
+3. 通道交换 (BGR->RGB)、HWC->CHW 转置与 Min-Max 归一化融合为每通道两次原地 ufunc，
+   直接写入批张量的对应槽位。
+批张量缓冲区按线程复用；使用 GPU 时分配为锁页内存 (pinned)，以便异步拷贝到显存。
+"""
+import threading
+from typing import Callable, Dict, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+# BGR -> RGB：输出通道 c 取自输入通道 2 - c
+_RGB_FROM_BGR = (2, 1, 0)
+
+
+def normalization_params(min_val: float, max_val: float) -> Tuple[float, float]:
+    """Min-Max 归一化参数 (offset, scale)；动态范围过小时退化为 /255，与训练时保持一致"""
+    if max_val - min_val > 1e-5:
+        return float(min_val), 1.0 / float(max_val - min_val)
+    return 0.0, 1.0 / 255.0
+
+
+class InputSpec:
+    """
+    一个等待写入批张量槽位的模型输入
+    shape: (3, H, W)；fill(out) 负责把预处理结果写入 out (float32, 形状同 shape)
+    views: 测试时增强的视图 (services.tta)；非空时占用 len(views) 个相邻槽位，结果为融合后的 (3, H, W)
+    """
+    __slots__ = ("shape", "fill", "views")
+
+    def __init__(self, shape: Tuple[int, int, int], fill: Callable[[np.ndarray], None],
+                 views: Tuple[str, ...] = ()):
+        self.shape = shape
+        self.fill = fill
+        self.views = views
+
+    @property
+    def slots(self) -> int:
+        return len(self.views) or 1
+
+
+class Preprocessor:
+    """
+    预处理器：所有缓冲区按线程缓存，推理线程之间互不干扰
+    """
+
+    def __init__(self, input_size: Tuple[int, int] = (512, 512), pin_memory: bool = False):
+        self.input_size = input_size  # (宽, 高)
+        self.pin_memory = pin_memory
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------
+    # 缓冲区管理
+    # ------------------------------------------------------------------
+    def _resize_buffer(self) -> np.ndarray:
+        buf = getattr(self._local, "resized", None)
+        if buf is None:
+            w, h = self.input_size
+            buf = self._local.resized = np.empty((h, w, 3), dtype=np.uint8)
+        return buf
+
+    def batch_buffer(self, batch_size: int, shape: Tuple[int, int, int]) -> np.ndarray:
+        """
+        返回 (batch_size, *shape) 的 float32 批缓冲区视图
+        同一线程内按形状复用，只在批大小增长时重新分配。
+        """
+        buffers: Dict[Tuple[int, int, int], torch.Tensor] = getattr(self._local, "batches", None)
+        if buffers is None:
+            buffers = self._local.batches = {}
+
+        tensor = buffers.get(shape)
+        if tensor is None or tensor.shape[0] < batch_size:
+            tensor = torch.empty((batch_size, *shape), dtype=torch.float32, pin_memory=self.pin_memory)
+            buffers[shape] = tensor
+        return tensor[:batch_size].numpy()
+
+    # ------------------------------------------------------------------
+    # 融合的预处理核心
+    # ------------------------------------------------------------------
+    @staticmethod
+    def normalize_into(src_bgr: np.ndarray, out: np.ndarray, offset: float, scale: float):
+        """
+        把 (H, W, 3) uint8 BGR 数据归一化写入 (3, H, W) float32 的 out
+        通道交换、转置与归一化融合：每通道一次减法 + 一次乘法，全部原地完成。
+        """
+        for c, src_c in enumerate(_RGB_FROM_BGR):
+            np.subtract(src_bgr[:, :, src_c], offset, out=out[c], dtype=np.float32)
+            np.multiply(out[c], scale, out=out[c])
+
+    def resize_into(self, image: np.ndarray, out: np.ndarray):
+        """缩放模式：原图 resize 到 input_size 后归一化写入 out"""
+        resized = cv2.resize(image, self.input_size, dst=self._resize_buffer())
+        offset, scale = normalization_params(resized.min(), resized.max())
+        self.normalize_into(resized, out, offset, scale)
+
+    def tile_into(self, image: np.ndarray, y: int, x: int, tile_size: int,
+                  offset: float, scale: float, out: np.ndarray):
+        """分块模式：从 (已填充的) BGR 原图裁出图块，用全图归一化参数写入 out"""
+        self.normalize_into(image[y:y + tile_size, x:x + tile_size], out, offset, scale)
+
+    # ------------------------------------------------------------------
+    # InputSpec 构造
+    # ------------------------------------------------------------------
+    def resize_spec(self, image: np.ndarray, views: Tuple[str, ...] = ()) -> InputSpec:
+        w, h = self.input_size
+        return InputSpec((3, h, w), lambda out: self.resize_into(image, out), views)
+
+    def tile_spec(self, image: np.ndarray, y: int, x: int, tile_size: int,
+                  offset: float, scale: float, views: Tuple[str, ...] = ()) -> InputSpec:
+        return InputSpec((3, tile_size, tile_size),
+                         lambda out: self.tile_into(image, y, x, tile_size, offset, scale, out), views)
+
+    def preprocess(self, image: np.ndarray) -> np.ndarray:
+        """单张预处理，返回新分配的 (3, H, W) 数组 (用于离线脚本与测试)"""
+        w, h = self.input_size
+        out = np.empty((3, h, w), dtype=np.float32)
+        self.resize_into(image, out)
+        return out
@@ -0,0 +1,146 @@
+"""
+多进程推理池模块 (Multi-process Inference Pool)
+---------------------------------------------
+单个 uvicorn 进程只能使用一个 torch 解释器。本模块提供多进程推理模式：
+1. API 进程只加载一次 bestmodel.pt，调用 share_memory() 把参数放入共享内存，
+   子进程通过 torch.multiprocessing 的文件描述符共享机制拿到同一份权重 (零拷贝，内存中只有一份 U-Net)。
+2. 批输入与概率图通过 multiprocessing.shared_memory 缓冲区在进程间传递，不再 pickle 数组。
+3. 共享内存块在 API 进程侧复用 (按大小缓存)，避免每个批次都重新创建/销毁。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing as torch_mp
+
+logger = logging.getLogger(__name__)
+
+# === 子进程侧状态 ===
+_worker_model = None
+_worker_bf16 = False
+
+
+def _init_worker(model: torch.nn.Module, torch_threads: int, bf16: bool = False):
+    """子进程初始化：接收共享内存中的模型，并固定 intra-op 线程数"""
+    global _worker_model, _worker_bf16
+    torch.set_num_threads(torch_threads)
+    _worker_model = model
+    _worker_model.eval()
+    _worker_bf16 = bf16
+
+
+def _worker_forward(in_name: str, shape: Tuple[int, ...], out_name: str):
+    """子进程执行：从共享内存读取批输入，把 (N, H, W) 概率图写回共享内存"""
+    from services.model_service import vessel_probabilities
+
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        batch = np.ndarray(shape, dtype=np.float32, buffer=shm_in.buf)
+        out = np.ndarray((shape[0], shape[2], shape[3]), dtype=np.float32, buffer=shm_out.buf)
+
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=_worker_bf16):
+            output = _worker_model(torch.from_numpy(batch))
+        out[:] = vessel_probabilities(output)
+        del batch, out
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+# === API 进程侧 ===
+class ProcessInferencePool:
+    """
+    多进程推理池
+    forward() 是同步调用，应在推理线程池中执行 (阻塞等待子进程结果时不占用事件循环)。
+    """
+
+    def __init__(self, processes: int = 4, torch_threads: int = 0):
+        self.processes = max(1, int(processes))
+        self.torch_threads = int(torch_threads) or max(1, (os.cpu_count() or 1) // self.processes)
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._model: Optional[torch.nn.Module] = None
+        self._free_buffers: Dict[int, List[shared_memory.SharedMemory]] = {}
+        self._lock = threading.Lock()
+
+        self.batches_done = 0
+
+    def start(self, model: torch.nn.Module, bf16: bool = False):
+        """把模型参数移入共享内存并启动子进程 (bf16=True 时子进程在 autocast 下推理)"""
+        if self._pool is not None:
+            return
+        model.share_memory()
+        # 保持引用：共享内存中的参数需要在 API 进程中一直存活
+        self._model = model
+        ctx = torch_mp.get_context("spawn")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(model, self.torch_threads, bf16)
+        )
+        logger.info(f"🧩 多进程推理池已启动 (processes={self.processes}, torch_threads={self.torch_threads})")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        with self._lock:
+            for buffers in self._free_buffers.values():
+                for shm in buffers:
+                    shm.close()
+                    shm.unlink()
+            self._free_buffers.clear()
+        self._model = None
+        logger.info("🧩 多进程推理池已关闭")
+
+    def _acquire_buffer(self, nbytes: int) -> shared_memory.SharedMemory:
+        with self._lock:
+            buffers = self._free_buffers.get(nbytes)
+            if buffers:
+                return buffers.pop()
+        return shared_memory.SharedMemory(create=True, size=nbytes)
+
+    def _release_buffer(self, shm: shared_memory.SharedMemory, nbytes: int):
+        with self._lock:
+            self._free_buffers.setdefault(nbytes, []).append(shm)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """把 (N, 3, H, W) float32 批输入交给空闲子进程，返回 (N, H, W) 概率图"""
+        if self._pool is None:
+            raise RuntimeError("多进程推理池未启动")
+
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        n, _, h, w = batch.shape
+        in_bytes = batch.nbytes
+        out_bytes = n * h * w * 4
+
+        shm_in = self._acquire_buffer(in_bytes)
+        shm_out = self._acquire_buffer(out_bytes)
+        try:
+            np.ndarray(batch.shape, dtype=np.float32, buffer=shm_in.buf)[:] = batch
+            self._pool.submit(_worker_forward, shm_in.name, batch.shape, shm_out.name).result()
+            probs = np.ndarray((n, h, w), dtype=np.float32, buffer=shm_out.buf).copy()
+        finally:
+            self._release_buffer(shm_in, in_bytes)
+            self._release_buffer(shm_out, out_bytes)
+
+        self.batches_done += 1
+        return probs
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cached = sum(len(v) for v in self._free_buffers.values())
+        return {
+            "processes": self.processes,
+            "torch_threads": self.torch_threads,
+            "running": self._pool is not None,
+            "batches_done": self.batches_done,
+            "cached_shm_buffers": cached,
+        }
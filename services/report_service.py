@@ -1,19 +1,17 @@
-import os
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import ImageReader
 import io
 import base64
-from PIL import Image as PILImage
 
 
 class ReportService:
     def generate_pdf(self, patient_data, prediction_data, report_data, image_base64):
         """
         生成PDF文件的二进制流
+        reportlab 只有生成报告时才用到，在这里导入，不拖慢服务启动
         """
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.utils import ImageReader
+
         buffer = io.BytesIO()
         c = canvas.Canvas(buffer, pagesize=A4)
         width, height = A4
@@ -0,0 +1,196 @@
+"""
+影子推理模块 (Shadow Inference)
+------------------------------
+上线重新训练的 U-Net 前，用线上流量把候选版本与当前版本对比，而不增加请求延迟：
+1. 按 SHADOW_SAMPLE_RATE 抽样已成功的在线预测，把 (图像, 基线结果) 放入有界队列后立即返回；
+   单个后台协程逐条在候选版本上重新推理 (同样的推理模式与 TTA 视图)。
+2. 低优先级：影子推理不经过准入队列 (不占用在线请求的名额，也不会导致 503)，
+   推理执行器的在途请求数超过 SHADOW_PRESSURE_THRESHOLD * max_queue 时，
+   新的抽样与队列中尚未执行的影子任务都会被直接丢弃 (最先被舍弃的工作)。
+3. 记录两个输出之间的掩码 Dice、置信度差与延迟差 (候选 - 基线)：
+   写入 retina_shadow_* 指标，并作为 model_version=候选版本、result_data.shadow=True 的记录写入 predictions 集合。
+"""
+import asyncio
+import logging
+import random
+from typing import Any, Dict, Optional, Tuple
+
+from core import metrics
+from core.rate_limit import request_deadline
+from utils.seg_metrics import dice_score
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowRunner:
+    """
+    影子推理调度器 (由 ModelRegistry 持有，在 registry.predict 成功后调用 offer)
+    """
+
+    def __init__(self,
+                 registry: "ModelRegistry",
+                 candidate_version: Optional[str] = None,
+                 sample_rate: float = 0.0,
+                 max_pending: int = 4,
+                 pressure_threshold: float = 0.25,
+                 persist: bool = True):
+        self.registry = registry
+        self.candidate_version = candidate_version or None
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.max_pending = max(1, int(max_pending))
+        self.pressure_threshold = float(pressure_threshold)
+        self.persist = persist
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+
+        # 统计信息
+        self.offered = 0
+        self.sampled = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = {"pressure": 0, "queue_full": 0}
+        self._dice_sum = 0.0
+        self._confidence_delta_sum = 0.0
+        self._latency_delta_sum = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.candidate_version is not None and self.sample_rate > 0
+
+    def configure(self, candidate_version: Optional[str], sample_rate: float = 0.0):
+        """运行时切换候选版本与抽样比例 (candidate_version 为 None 时关闭)"""
+        self.candidate_version = candidate_version or None
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        logger.info(f"🌓 影子推理配置: candidate={self.candidate_version}, sample_rate={self.sample_rate}")
+
+    # ------------------------------------------------------------------
+    # 抽样与卸载
+    # ------------------------------------------------------------------
+    def under_pressure(self, executor) -> bool:
+        """推理执行器的在途请求数达到阈值时视为有压力"""
+        return executor.pending >= self.pressure_threshold * executor.max_queue
+
+    def offer(self, baseline_version: str, executor, image, request_id: str,
+              result: Dict[str, Any], mode: Optional[str] = None, tta: Tuple[str, ...] = ()):
+        """在线预测成功后调用：按比例抽样入队，不等待 (队列满或有压力时直接丢弃)"""
+        if not self.enabled or baseline_version == self.candidate_version:
+            return
+        self.offered += 1
+        if random.random() >= self.sample_rate:
+            return
+        if self.under_pressure(executor):
+            self._shed("pressure")
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((baseline_version, image, request_id, result, mode, tta))
+        except asyncio.QueueFull:
+            self._shed("queue_full")
+            return
+        self.sampled += 1
+
+    def _shed(self, reason: str):
+        self.shed[reason] += 1
+        metrics.SHADOW_RUNS.labels(f"shed_{reason}").inc()
+
+    def _ensure_started(self):
+        if self._worker_task is None or self._worker_task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker_task = asyncio.create_task(self._worker(), name="shadow-inference")
+
+    async def stop(self):
+        if self._worker_task is None:
+            return
+        self._worker_task.cancel()
+        await asyncio.gather(self._worker_task, return_exceptions=True)
+        self._worker_task = None
+
+    async def _worker(self):
+        # 在首个抽样请求中惰性启动，不继承该请求的截止时间
+        request_deadline.set(None)
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._run(*item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                metrics.SHADOW_RUNS.labels("error").inc()
+                logger.warning(f"⚠️ 影子推理失败 [{item[2]}]: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # 执行与对比
+    # ------------------------------------------------------------------
+    async def _run(self, baseline_version: str, image, request_id: str, baseline: Dict[str, Any],
+                   mode: Optional[str], tta: Tuple[str, ...]):
+        candidate_version = self.candidate_version
+        if candidate_version is None or candidate_version == baseline_version:
+            return
+        # 排队期间压力可能已上升：尚未执行的影子任务最先被舍弃
+        if self.under_pressure(self.registry.primary.executor):
+            self._shed("pressure")
+            return
+
+        # 候选版本由管理员配置，未常驻时允许加载 (线上请求不会触发加载)
+        async with self.registry.acquire(candidate_version, allow_load=True) as service:
+            shadow = await service.predict_shadow(image, f"{request_id}#shadow", mode=mode, tta=tta)
+            if shadow["status"] != "success":
+                raise RuntimeError(shadow.get("message", "影子推理失败"))
+            dice = await service.executor.run(dice_score, shadow["mask"], baseline["mask"])
+
+        comparison = {
+            "dice": round(dice, 4),
+            "confidence_delta": round(shadow["confidence"] - baseline["confidence"], 4),
+            "latency_delta": round(shadow["processing_time"] - baseline["processing_time"], 4),
+        }
+        self._record(request_id, baseline_version, candidate_version, baseline, shadow, comparison)
+
+    def _record(self, request_id: str, baseline_version: str, candidate_version: str,
+                baseline: Dict[str, Any], shadow: Dict[str, Any], comparison: Dict[str, float]):
+        self.completed += 1
+        self._dice_sum += comparison["dice"]
+        self._confidence_delta_sum += comparison["confidence_delta"]
+        self._latency_delta_sum += comparison["latency_delta"]
+
+        metrics.SHADOW_RUNS.labels("completed").inc()
+        metrics.SHADOW_DICE.observe(comparison["dice"])
+        metrics.SHADOW_CONFIDENCE_DELTA.observe(comparison["confidence_delta"])
+        metrics.SHADOW_LATENCY_DELTA_SECONDS.observe(comparison["latency_delta"])
+        logger.debug(f"🌓 影子推理 [{request_id}] {baseline_version} vs {candidate_version}: {comparison}")
+
+        if self.persist:
+            from models.prediction import Prediction
+            Prediction(
+                request_id=f"{request_id}#shadow",
+                model_version=candidate_version,
+                result_data={
+                    "shadow": True,
+                    "baseline_request_id": request_id,
+                    "baseline_version": baseline_version,
+                    "confidence": shadow.get("confidence"),
+                    "vessel_coverage": shadow.get("vessel_coverage"),
+                    "processing_time": shadow.get("processing_time"),
+                    "inference_mode": shadow.get("inference_mode"),
+                    **comparison
+                }
+            ).save_later()
+
+    def get_stats(self) -> Dict[str, Any]:
+        completed = self.completed or 1
+        return {
+            "enabled": self.enabled,
+            "candidate_version": self.candidate_version,
+            "sample_rate": self.sample_rate,
+            "offered": self.offered,
+            "sampled": self.sampled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shed": dict(self.shed),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "mean_dice": round(self._dice_sum / completed, 4) if self.completed else None,
+            "mean_confidence_delta": round(self._confidence_delta_sum / completed, 4) if self.completed else None,
+            "mean_latency_delta": round(self._latency_delta_sum / completed, 4) if self.completed else None,
+        }
@@ -0,0 +1,269 @@
+"""
+文件存储模块 (Content-addressed Blob Storage)
+--------------------------------------------
+原图与分割掩码按内容 SHA-256 寻址存储：同一张图无论上传多少次、叫什么文件名，都只保存一份。
+支持两种后端 (settings.STORAGE_BACKEND)：
+1. local:  本地目录 <STORAGE_DIR>/<前两位>/<sha256>，写入临时文件后原子重命名。
+2. gridfs: MongoDB GridFS，文件名即 sha256，先以临时名上传，完成后重命名或 (已存在时) 删除。
+读写均按 STORAGE_CHUNK_SIZE 分块流式进行；本地文件 IO 在线程池中执行，不阻塞事件循环。
+预测接口通过 store_later() 先计算哈希得到引用、再在后台写入，响应不等待存储完成。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_chunks(data: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    """把内存中的字节按块切分为异步迭代器 (memoryview 切片，不复制)"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+async def iter_upload(file, chunk_size: int) -> AsyncIterator[bytes]:
+    """按块读取 UploadFile，不把整个文件读入内存"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class BlobNotFoundError(KeyError):
+    """存储中不存在该内容"""
+
+
+class LocalStorageBackend:
+    """本地文件系统后端"""
+
+    name = "local"
+
+    def __init__(self, root: str, chunk_size: int):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(os.path.exists, self._path(key))
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> Dict[str, Any]:
+        """边写临时文件边计算哈希；内容已存在时丢弃临时文件"""
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        f = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await run_in_threadpool(f.write, chunk)
+        except BaseException:
+            await run_in_threadpool(f.close)
+            await run_in_threadpool(os.remove, tmp_path)
+            raise
+        await run_in_threadpool(f.close)
+
+        key = digest.hexdigest()
+        deduplicated = await run_in_threadpool(self._commit, tmp_path, key)
+        return {"key": key, "size": size, "content_type": content_type,
+                "backend": self.name, "deduplicated": deduplicated}
+
+    def _commit(self, tmp_path: str, key: str) -> bool:
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return False
+
+    async def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        path = self._path(key)
+        try:
+            f = await run_in_threadpool(open, path, "rb")
+        except FileNotFoundError:
+            raise BlobNotFoundError(key)
+        try:
+            while True:
+                chunk = await run_in_threadpool(f.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await run_in_threadpool(f.close)
+
+
+class GridFSStorageBackend:
+    """MongoDB GridFS 后端 (Motor 异步 API)"""
+
+    name = "gridfs"
+
+    def __init__(self, bucket_name: str, chunk_size: int):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        from core.database import db
+
+        self.chunk_size = chunk_size
+        self.files = db[f"{bucket_name}.files"]
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=chunk_size)
+
+    async def exists(self, key: str) -> bool:
+        return await self.files.find_one({"filename": key}, {"_id": 1}) is not None
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> Dict[str, Any]:
+        """以临时文件名上传并计算哈希，完成后重命名为哈希；内容已存在时删除刚上传的副本"""
+        digest = hashlib.sha256()
+        size = 0
+        stream = self.bucket.open_upload_stream(f"tmp-{uuid.uuid4().hex}",
+                                                metadata={"content_type": content_type})
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await stream.write(chunk)
+        except BaseException:
+            await stream.abort()
+            raise
+        await stream.close()
+
+        key = digest.hexdigest()
+        deduplicated = await self.exists(key)
+        if deduplicated:
+            await self.bucket.delete(stream._id)
+        else:
+            await self.bucket.rename(stream._id, key)
+        return {"key": key, "size": size, "content_type": content_type,
+                "backend": self.name, "deduplicated": deduplicated}
+
+    async def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        from gridfs.errors import NoFile
+
+        try:
+            stream = await self.bucket.open_download_stream_by_name(key)
+        except NoFile:
+            raise BlobNotFoundError(key)
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+
+class StorageService:
+    """
+    内容寻址存储服务
+    返回的引用即内容的 SHA-256 (保存在 Image.filepath / Prediction.mask_file 中)。
+    """
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend_name = (backend or settings.STORAGE_BACKEND).lower()
+        self.chunk_size = settings.STORAGE_CHUNK_SIZE
+        self._backend = None
+        self._pending: Set[asyncio.Task] = set()
+
+        # 统计信息
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend_name != "none"
+
+    @property
+    def backend(self):
+        """首次使用时创建后端 (GridFS 需要数据库连接)"""
+        if self._backend is None:
+            if self.backend_name == "gridfs":
+                self._backend = GridFSStorageBackend(settings.STORAGE_GRIDFS_BUCKET, self.chunk_size)
+            elif self.backend_name == "local":
+                self._backend = LocalStorageBackend(settings.STORAGE_DIR, self.chunk_size)
+            else:
+                raise RuntimeError(f"存储后端未启用: {self.backend_name}")
+            logger.info(f"🗄️ 文件存储后端: {self.backend_name}")
+        return self._backend
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    async def store_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> Dict[str, Any]:
+        """流式写入，返回 {"key", "size", "content_type", "backend", "deduplicated"}"""
+        ref = await self.backend.put_stream(chunks, content_type)
+        if ref["deduplicated"]:
+            self.deduplicated += 1
+        else:
+            self.stored += 1
+            self.bytes_written += ref["size"]
+        return ref
+
+    async def store_bytes(self, data: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+        return await self.store_stream(iter_chunks(data, self.chunk_size), content_type)
+
+    def store_later(self, data: bytes, content_type: Optional[str] = None,
+                    key: Optional[str] = None) -> Optional[str]:
+        """
+        先同步计算哈希并返回引用，实际写入在后台任务中完成 (不阻塞响应)
+        key 为已知的内容 SHA-256 (流式接收时已增量计算) 时不再重复哈希。
+        存储未启用或数据为空时返回 None。
+        """
+        if not self.enabled or not data:
+            return None
+        key = key or hashlib.sha256(data).hexdigest()
+        task = asyncio.create_task(self._store_background(key, data, content_type))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return key
+
+    async def _store_background(self, key: str, data: bytes, content_type: Optional[str]):
+        try:
+            if await self.backend.exists(key):
+                self.deduplicated += 1
+                return
+            await self.store_bytes(data, content_type)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"❌ [Storage] 后台写入失败: {str(e)}")
+
+    async def drain(self):
+        """等待所有后台写入完成 (应用关闭时调用)"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    async def exists(self, key: str) -> bool:
+        return await self.backend.exists(key)
+
+    def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        """按块异步读取；内容不存在时在第一次迭代时抛出 BlobNotFoundError"""
+        return self.backend.open_stream(key)
+
+    async def read_bytes(self, key: str) -> bytes:
+        return b"".join([bytes(chunk) async for chunk in self.open_stream(key)])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend_name,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_written": self.bytes_written,
+            "failures": self.failures,
+            "pending_writes": len(self._pending),
+        }
+
+
+# 创建全局存储服务实例
+storage_service = StorageService()
@@ -0,0 +1,189 @@
+"""
+系统监控模块 (System Monitor)
+----------------------------
+原 /system/stats 在请求处理中同步调用 psutil.cpu_percent(interval=0.1) (阻塞 100ms)
+和 psutil.net_connections() (连接多时很慢)，监控轮询会卡住事件循环。改为：
+1. 后台协程按 SYSTEM_STATS_INTERVAL 采样，psutil 调用放在线程池执行；
+   cpu_percent 使用非阻塞模式 (与上次采样之间的平均值)，net_connections 按更长的间隔单独刷新。
+2. 接口直接返回缓存的最新快照，并保留最近 SYSTEM_STATS_HISTORY 条历史 (环形缓冲)。
+3. 进程级指标：RSS、线程数、torch 线程数、推理在途请求数与微批队列深度。
+4. 每次采样顺带 ping MongoDB，就绪检查 (/health/ready) 读取该结果，不在探针请求里访问数据库。
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import psutil
+from fastapi.concurrency import run_in_threadpool
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SystemMonitor:
+    """后台系统状态采样器"""
+
+    def __init__(self,
+                 interval: float = 5.0,
+                 history_size: int = 120,
+                 connections_interval: float = 60.0,
+                 mongo_timeout: float = 2.0):
+        self.interval = float(interval)
+        self.connections_interval = float(connections_interval)
+        self.mongo_timeout = float(mongo_timeout)
+        self.history = deque(maxlen=max(1, int(history_size)))
+        self.process = psutil.Process(os.getpid())
+
+        self._task: Optional[asyncio.Task] = None
+        self._latest: Dict[str, Any] = {}
+        self._connections = 0
+        self._connections_at = 0.0
+        self.mongo_reachable: Optional[bool] = None
+        self.mongo_latency_ms: Optional[float] = None
+        self.mongo_checked_at: Optional[float] = None
+
+        # 首次调用 cpu_percent(None) 只建立基准 (返回 0)，之后每次返回与上次调用之间的平均值
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(), name="system-monitor")
+        logger.info(f"📈 系统监控已启动 (interval={self.interval}s, history={self.history.maxlen})")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 系统状态采样失败: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    # ------------------------------------------------------------------
+    # 采样
+    # ------------------------------------------------------------------
+    async def refresh(self) -> Dict[str, Any]:
+        """采样一次并更新缓存快照"""
+        await self._check_mongo()
+        snapshot = await run_in_threadpool(self._sample_host)
+        snapshot.update(self._sample_service())
+        snapshot["mongo_reachable"] = self.mongo_reachable
+        snapshot["mongo_latency_ms"] = self.mongo_latency_ms
+        self._latest = snapshot
+        self.history.append(snapshot)
+        return snapshot
+
+    def _sample_host(self) -> Dict[str, Any]:
+        """psutil 采样 (在线程池中执行)"""
+        now = time.monotonic()
+        if self.connections_interval > 0 and now - self._connections_at >= self.connections_interval:
+            try:
+                self._connections = len(psutil.net_connections())
+            except (psutil.Error, OSError):
+                # 无权限时退化为本进程的连接数
+                self._connections = len(self.process.connections())
+            self._connections_at = now
+
+        with self.process.oneshot():
+            memory = self.process.memory_info()
+            process_cpu = self.process.cpu_percent(interval=None)
+            num_threads = self.process.num_threads()
+
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+            "disk_usage": psutil.disk_usage('/').percent,
+            "active_connections": self._connections,
+            "boot_time": datetime.fromtimestamp(psutil.boot_time()).isoformat(),
+            "process_rss_mb": round(memory.rss / (1024 * 1024), 1),
+            "process_cpu_percent": process_cpu,
+            "process_threads": num_threads,
+        }
+
+    def _sample_service(self) -> Dict[str, Any]:
+        """推理服务的队列状态 (只读计数器，在事件循环中读取)"""
+        import torch
+        from services.model_registry import model_registry
+
+        # 各版本共享同一推理执行器；微批队列取默认版本
+        service = model_registry.default
+        batching = service.batch_scheduler
+        return {
+            "torch_threads": torch.get_num_threads(),
+            "model_loaded": service.model_loaded,
+            "model_version": service.model_version,
+            "inference_pending": service.executor.pending,
+            "inference_max_queue": service.executor.max_queue,
+            "batch_queue_depth": batching.queue_depth if batching is not None else 0,
+        }
+
+    async def _check_mongo(self):
+        from core.database import client
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.admin.command("ping"), self.mongo_timeout)
+            self.mongo_reachable = True
+            self.mongo_latency_ms = round((time.perf_counter() - start) * 1000, 2)
+        except Exception as e:
+            if self.mongo_reachable is not False:
+                logger.warning(f"⚠️ MongoDB 不可达: {str(e) or type(e).__name__}")
+            self.mongo_reachable = False
+            self.mongo_latency_ms = None
+        self.mongo_checked_at = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def snapshot(self) -> Dict[str, Any]:
+        """最新的缓存快照 (尚未采样时为空字典)"""
+        return self._latest
+
+    def get_history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        items = list(self.history)
+        return items[-limit:] if limit else items
+
+    def readiness(self) -> Dict[str, Any]:
+        """就绪状态：默认版本的模型已加载并完成预热，且 MongoDB 可达 (取最近一次采样结果)"""
+        from services.model_registry import model_registry
+
+        service = model_registry.default
+        checks = {
+            "model_loaded": service.model_loaded,
+            "model_warmed_up": service.warmed_up,
+            "mongo_reachable": bool(self.mongo_reachable),
+        }
+        return {
+            "ready": all(checks.values()),
+            "checks": checks,
+            "mongo_checked_seconds_ago": round(time.monotonic() - self.mongo_checked_at, 1)
+            if self.mongo_checked_at is not None else None,
+        }
+
+
+# 创建全局系统监控实例
+system_monitor = SystemMonitor(
+    interval=settings.SYSTEM_STATS_INTERVAL,
+    history_size=settings.SYSTEM_STATS_HISTORY,
+    connections_interval=settings.SYSTEM_STATS_CONNECTIONS_INTERVAL,
+    mongo_timeout=settings.MONGO_PING_TIMEOUT
+)
@@ -0,0 +1,105 @@
+"""
+测试时增强模块 (Test-Time Augmentation)
+-------------------------------------
+对边界病例，把输入的翻转 / 90° 旋转视图的预测逆变换回原方向后取平均。
+逐个视图调用 predict 会让延迟乘以视图数，本模块改为：
+1. 预处理只做一次 (写入第一个槽位)，其余视图由它经翻转 / 旋转复制到相邻槽位，
+   同一输入的所有视图在同一次 U-Net 前向中完成。
+2. 输出按视图做逆变换 (numpy 视图操作，不逐像素循环)，一次性求均值、标准差与投票一致率。
+3. 除平均概率图外返回逐像素的不确定性：各视图概率的标准差 (uncertainty) 与
+   二值化投票中多数派所占比例 (agreement，0.5~1)。
+视图集合可按请求选择 (预设或逗号分隔的视图名)，视图数即推理成本的倍数。
+"""
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 二面体群 D4 的 8 个元素：恒等、水平 / 垂直翻转、三个旋转、主 / 副对角线转置
+VIEWS = ("identity", "hflip", "vflip", "rot90", "rot180", "rot270", "transpose", "transverse")
+
+PRESETS: Dict[str, Tuple[str, ...]] = {
+    "flips": ("identity", "hflip", "vflip"),
+    "rotations": ("identity", "rot90", "rot180", "rot270"),
+    "d4": VIEWS,
+}
+
+# 需要方形输入的视图 (改变宽高方向)
+_SQUARE_ONLY = {"rot90", "rot270", "transpose", "transverse"}
+
+# 作用于最后两个轴 (H, W) 的变换；均返回 numpy 视图，不复制数据
+_FORWARD = {
+    "identity": lambda a: a,
+    "hflip": lambda a: a[..., ::-1],
+    "vflip": lambda a: a[..., ::-1, :],
+    "rot90": lambda a: np.rot90(a, 1, axes=(-2, -1)),
+    "rot180": lambda a: a[..., ::-1, ::-1],
+    "rot270": lambda a: np.rot90(a, -1, axes=(-2, -1)),
+    "transpose": lambda a: np.swapaxes(a, -1, -2),
+    "transverse": lambda a: np.swapaxes(a, -1, -2)[..., ::-1, ::-1],
+}
+
+# 逆变换：除 90° / 270° 旋转互逆外，其余视图都是自身的逆
+_INVERSE = {view: view for view in VIEWS}
+_INVERSE.update({"rot90": "rot270", "rot270": "rot90"})
+
+
+def parse_views(spec: Optional[str], max_views: int = len(VIEWS)) -> Tuple[str, ...]:
+    """
+    解析请求中的 TTA 参数
+    spec: None / "" / "none" 表示关闭；预设名 (flips / rotations / d4)；或逗号分隔的视图名。
+    返回去重后的视图元组，identity 始终排在第一位 (预处理直接写入该槽位)；关闭时返回空元组。
+    参数无效时抛出 ValueError。
+    """
+    if spec is None or not spec.strip() or spec.strip().lower() == "none":
+        return ()
+    spec = spec.strip().lower()
+    if spec in PRESETS:
+        views = PRESETS[spec]
+    else:
+        views = tuple(v.strip() for v in spec.split(",") if v.strip())
+        unknown = [v for v in views if v not in _FORWARD]
+        if unknown:
+            raise ValueError(f"不支持的 TTA 视图: {', '.join(unknown)}。"
+                             f"支持: {', '.join(VIEWS)} 或预设 {', '.join(PRESETS)}")
+
+    ordered = ("identity",) + tuple(dict.fromkeys(v for v in views if v != "identity"))
+    if len(ordered) > max_views:
+        raise ValueError(f"TTA 视图数 {len(ordered)} 超过上限 {max_views}")
+    return ordered
+
+
+def apply_view(array: np.ndarray, view: str) -> np.ndarray:
+    return _FORWARD[view](array)
+
+
+def invert_view(array: np.ndarray, view: str) -> np.ndarray:
+    return _FORWARD[_INVERSE[view]](array)
+
+
+def fill_views(slots: np.ndarray, views: Sequence[str]):
+    """
+    slots: (V, C, H, W) 批缓冲区中属于同一输入的连续槽位，slots[0] 已写入预处理结果 (identity)
+    其余槽位由 slots[0] 经对应变换复制得到，不再重复预处理。
+    """
+    height, width = slots.shape[-2:]
+    for k, view in enumerate(views[1:], start=1):
+        if view in _SQUARE_ONLY and height != width:
+            raise ValueError(f"TTA 视图 {view} 需要方形输入，当前为 {width}x{height}")
+        np.copyto(slots[k], apply_view(slots[0], view))
+
+
+def merge_views(probs: np.ndarray, views: Sequence[str]) -> np.ndarray:
+    """
+    把 (V, H, W) 的各视图概率图逆变换回原方向并融合
+    返回 (3, H, W) float32：[平均概率, 标准差 (uncertainty), 投票一致率 (agreement)]
+    """
+    aligned = np.empty(probs.shape, dtype=np.float32)
+    for k, view in enumerate(views):
+        np.copyto(aligned[k], invert_view(probs[k], view))
+
+    merged = np.empty((3,) + probs.shape[1:], dtype=np.float32)
+    np.mean(aligned, axis=0, out=merged[0])
+    np.std(aligned, axis=0, out=merged[1])
+    votes = np.count_nonzero(aligned > 0.5, axis=0) / np.float32(len(views))
+    np.maximum(votes, 1.0 - votes, out=merged[2])
+    return merged
@@ -0,0 +1,124 @@
+import asyncio
+
+from core.rate_limit import DeadlineExceeded, request_deadline
+from services.batch_scheduler import BatchScheduler
+
+
+def test_concurrent_requests_are_batched():
+    """测试并发请求在等待窗口内被合并为一批"""
+    calls = []
+
+    async def runner(payloads):
+        calls.append(list(payloads))
+        return [p * 10 for p in payloads]
+
+    async def main():
+        scheduler = BatchScheduler(runner, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(*(scheduler.submit(i) for i in range(4)))
+        await scheduler.stop()
+        return results, scheduler.get_stats()
+
+    results, stats = asyncio.run(main())
+
+    assert results == [0, 10, 20, 30]
+    assert len(calls) == 1
+    assert stats["batch_size_histogram"] == {"4": 1}
+    assert stats["total_items"] == 4
+
+    print("✅ 微批合并测试通过")
+
+
+def test_batch_respects_max_size():
+    """测试单批不超过 max_batch_size"""
+    sizes = []
+
+    async def runner(payloads):
+        sizes.append(len(payloads))
+        return payloads
+
+    async def main():
+        scheduler = BatchScheduler(runner, max_batch_size=3, max_wait_ms=20)
+        results = await asyncio.gather(*(scheduler.submit(i) for i in range(7)))
+        await scheduler.stop()
+        return results
+
+    assert asyncio.run(main()) == list(range(7))
+    assert max(sizes) <= 3
+    assert sum(sizes) == 7
+
+    print("✅ 批大小上限测试通过")
+
+
+def test_runner_error_propagates_to_callers():
+    """测试批推理异常会传递给该批的每个调用方"""
+    async def runner(payloads):
+        raise ValueError("boom")
+
+    async def main():
+        scheduler = BatchScheduler(runner, max_batch_size=2, max_wait_ms=5)
+        results = await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+        await scheduler.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+    print("✅ 异常传递测试通过")
+
+
+def test_inflight_batches_run_concurrently():
+    """测试 max_inflight_batches > 1 时多个批次可并行执行"""
+    active = 0
+    peak = 0
+
+    async def runner(payloads):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return payloads
+
+    async def main():
+        scheduler = BatchScheduler(runner, max_batch_size=1, max_wait_ms=0, max_inflight_batches=3)
+        results = await asyncio.gather(*(scheduler.submit(i) for i in range(6)))
+        await scheduler.stop()
+        return results
+
+    assert asyncio.run(main()) == list(range(6))
+    assert peak == 3
+
+    print("✅ 并行批次测试通过")
+
+
+def test_expired_items_are_dropped_before_forward():
+    """测试排队期间超过截止时间的请求不进入前向推理，调度协程不继承首个请求的截止时间"""
+    calls = []
+
+    async def runner(payloads):
+        calls.append(list(payloads))
+        await asyncio.sleep(0.05)
+        return payloads
+
+    async def submit(scheduler, payload, timeout=None):
+        if timeout is not None:
+            request_deadline.set(asyncio.get_running_loop().time() + timeout)
+        return await scheduler.submit(payload)
+
+    async def main():
+        scheduler = BatchScheduler(runner, max_batch_size=1, max_wait_ms=0)
+        # 0 占用唯一的在途批次名额期间，1 的截止时间已过
+        results = await asyncio.gather(submit(scheduler, 0, timeout=5), submit(scheduler, 1, timeout=0.01),
+                                       submit(scheduler, 2), return_exceptions=True)
+        stats = scheduler.get_stats()
+        await scheduler.stop()
+        return results, stats
+
+    results, stats = asyncio.run(main())
+
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], DeadlineExceeded)
+    assert calls == [[0], [2]]
+    assert stats["expired_items"] == 1
+
+    print("✅ 截止时间丢弃测试通过")
@@ -0,0 +1,26 @@
+import numpy as np
+
+from ai_core.predict import read_manifest, to_bgr_uint8, to_label_mask
+
+
+def test_dataset_arrays_convert_to_service_input():
+    """测试 .npy 中的 CHW 浮点图像与标注转换为服务使用的格式"""
+    chw = np.zeros((3, 4, 5), dtype=np.float32)
+    chw[0] = 1.0  # R 通道最亮
+
+    bgr = to_bgr_uint8(chw, "rgb")
+    assert bgr.shape == (4, 5, 3) and bgr.dtype == np.uint8
+    assert bgr[0, 0].tolist() == [0, 0, 255]
+
+    label = to_label_mask(np.array([[[0.0, 1.0], [0.9, 0.2]]], dtype=np.float32))
+    assert label.tolist() == [[False, True], [True, False]]
+
+    print("✅ 数据集格式转换测试通过")
+
+
+def test_manifest_lists_completed_names(tmp_path):
+    """测试断点续跑的 manifest 读取"""
+    manifest = tmp_path / "manifest.txt"
+    assert read_manifest(str(manifest)) == set()
+    manifest.write_text("a/01\nb_00002\n\n", encoding="utf-8")
+    assert read_manifest(str(manifest)) == {"a/01", "b_00002"}
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+from core.rate_limit import DeadlineExceeded, request_deadline
+from services.inference_executor import InferenceExecutor, InferenceQueueFullError
+
+
+def test_admission_rejects_when_queue_is_full():
+    """测试在途请求达到 max_queue 时立即拒绝，完成或取消后名额被释放"""
+    executor = InferenceExecutor(max_workers=1, max_queue=2, retry_after=3)
+
+    async def main():
+        release = asyncio.Event()
+        entered = []
+
+        async def hold():
+            async with executor.admit():
+                entered.append(True)
+                await release.wait()
+
+        first = asyncio.create_task(hold())
+        second = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert executor.pending == 2
+
+        with pytest.raises(InferenceQueueFullError) as exc_info:
+            async with executor.admit():
+                pass
+        assert exc_info.value.retry_after == 3
+        assert executor.pending == 2
+
+        # 取消一个在途请求：名额随之释放
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert executor.pending == 1
+
+        release.set()
+        await first
+        assert executor.pending == 0
+
+        async with executor.admit():
+            assert executor.pending == 1
+        return len(entered)
+
+    entered = asyncio.run(main())
+
+    stats = executor.get_stats()
+    assert entered == 2
+    assert stats["pending"] == 0
+    assert stats["rejected"] == 1
+    assert stats["max_pending"] == 2
+    assert stats["completed"] == 3
+
+    print("✅ 推理准入背压测试通过")
+
+
+def test_expired_request_is_not_run():
+    """测试请求超过截止时间后，提交前或在线程池中排队到过期的任务都不再执行"""
+    executor = InferenceExecutor(max_workers=1, max_queue=4)
+    calls = []
+
+    def work(name, seconds=0.0):
+        calls.append(name)
+        time.sleep(seconds)
+        return name
+
+    async def run(name, timeout, seconds=0.0):
+        request_deadline.set(asyncio.get_running_loop().time() + timeout)
+        return await executor.run(work, name, seconds)
+
+    async def main():
+        expired = await asyncio.gather(run("late", -1), return_exceptions=True)
+        # 唯一的线程被 slow 占用期间，queued 的截止时间已过
+        queued = await asyncio.gather(run("slow", 5, 0.1), run("queued", 0.02), return_exceptions=True)
+        return expired + queued
+
+    try:
+        late, slow, queued = asyncio.run(main())
+    finally:
+        executor.shutdown()
+
+    assert isinstance(late, DeadlineExceeded) and isinstance(queued, DeadlineExceeded)
+    assert slow == "slow"
+    assert calls == ["slow"]
+    assert executor.get_stats()["expired"] == 2
+
+    print("✅ 推理截止时间测试通过")
@@ -0,0 +1,274 @@
+import asyncio
+import copy
+import io
+import zipfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+
+import api.endpoints.routes_job as routes_job
+import models.job as job_model
+from models.job import (Job, ITEM_DONE, ITEM_PENDING, ITEM_SKIPPED, JOB_CANCELLED, JOB_COMPLETED, JOB_QUEUED,
+                        JOB_RUNNING)
+from services.job_service import JobWorker
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        doc = doc[int(part)] if isinstance(doc, list) else doc.get(part)
+    return doc
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict):
+            if "$lt" in cond and not (value is not None and value < cond["$lt"]):
+                return False
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class _FakeJobsCollection:
+    """内存中的 jobs 集合，只实现 models.job 用到的查询与更新操作符"""
+
+    def __init__(self):
+        self.docs = []
+
+    def _apply(self, doc, update):
+        for path, value in update.get("$set", {}).items():
+            *parents, last = path.split(".")
+            target = doc
+            for part in parents:
+                target = target[int(part)] if isinstance(target, list) else target[part]
+            target[last] = value
+        for path, value in update.get("$inc", {}).items():
+            doc[path] = doc.get(path, 0) + value
+
+    async def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def find_one(self, query, projection=None):
+        return next((copy.deepcopy(d) for d in self.docs if _matches(d, query)), None)
+
+    async def find_one_and_update(self, query, update, sort=None, projection=None, return_document=None):
+        candidates = [d for d in self.docs if _matches(d, query)]
+        if sort:
+            candidates.sort(key=lambda d: d[sort[0][0]])
+        if not candidates:
+            return None
+        self._apply(candidates[0], update)
+        return copy.deepcopy(candidates[0])
+
+    async def update_one(self, query, update):
+        await self.find_one_and_update(query, update)
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    collection = _FakeJobsCollection()
+    monkeypatch.setattr(job_model, "jobs_collection", collection)
+    return collection
+
+
+def _items(n):
+    return [{"filename": f"{i}.png", "storage_key": f"k{i}"} for i in range(n)]
+
+
+def test_new_job_tracks_every_item_as_pending():
+    """测试新任务为每张图像建立待处理状态与进度计数"""
+    job = Job([{"filename": "a.png", "storage_key": "k1"}, {"filename": "b.png", "storage_key": "k2"}],
+              inference_mode="tiled")
+
+    assert job.status == JOB_QUEUED
+    assert job.total == 2 and job.completed == job.failed == job.skipped == 0
+    assert [item["index"] for item in job.items] == [0, 1]
+    assert all(item["status"] == ITEM_PENDING for item in job.items)
+    assert job.items[1]["storage_key"] == "k2"
+
+    print("✅ 任务初始化测试通过")
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(jobs):
+    """测试任务只被一个工作进程领取，租约过期后由其他进程接管，原进程续约失败"""
+
+    async def main():
+        await Job(_items(1)).save()
+        first = await Job.claim_next("worker-a", 60)
+        assert first["status"] == JOB_RUNNING and first["worker_id"] == "worker-a"
+        assert await Job.claim_next("worker-b", 60) is None  # 租约有效期内不可重复领取
+
+        jobs.docs[0]["lease_until"] = datetime.utcnow() - timedelta(seconds=1)  # 模拟 worker-a 崩溃
+        second = await Job.claim_next("worker-b", 60)
+        assert second["_id"] == first["_id"] and second["worker_id"] == "worker-b"
+        assert await Job.renew_lease(first["_id"], "worker-a", 60) is None
+
+    asyncio.run(main())
+
+    print("✅ 租约过期接管测试通过")
+
+
+def test_heartbeat_keeps_lease_during_long_item(jobs):
+    """测试单张图像耗时超过租约时，心跳续约使任务不会被其他工作进程重复领取"""
+    worker = JobWorker(item_concurrency=1, lease_seconds=0.15)
+    stolen = []
+
+    async def slow_item(job, item):
+        await asyncio.sleep(0.4)
+        stolen.append(await Job.claim_next("worker-b", 0.15))
+        await Job.record_item(job["_id"], item["index"], ITEM_DONE, result={})
+
+    worker._process_item = slow_item
+
+    async def main():
+        await Job(_items(1)).save()
+        job = await Job.claim_next(worker.worker_id, worker.lease_seconds)
+        return await worker._process_items(job)
+
+    assert asyncio.run(main()) is None
+    assert stolen == [None]
+    assert jobs.docs[0]["worker_id"] == worker.worker_id
+
+    print("✅ 心跳续约测试通过")
+
+
+def test_transient_renew_error_does_not_fail_job(jobs, monkeypatch):
+    """测试续约时的瞬时 MongoDB 错误只使该图像稍后重试，任务照常完成"""
+    worker = JobWorker(item_concurrency=1, lease_seconds=0.3)
+    renew_lease = Job.renew_lease
+    calls = []
+
+    async def flaky_renew(job_id, worker_id, lease_seconds):
+        calls.append(job_id)
+        if len(calls) == 1:
+            raise ConnectionError("mongo hiccup")
+        return await renew_lease(job_id, worker_id, lease_seconds)
+
+    monkeypatch.setattr(Job, "renew_lease", flaky_renew)
+
+    async def process_item(job, item):
+        await Job.record_item(job["_id"], item["index"], ITEM_DONE, result={})
+
+    worker._process_item = process_item
+
+    async def main():
+        worker._slots = asyncio.Semaphore(1)
+        await worker._slots.acquire()
+        await Job(_items(2)).save()
+        job = await Job.claim_next(worker.worker_id, worker.lease_seconds)
+        await worker._run_job(job)
+
+    asyncio.run(main())
+
+    doc = jobs.docs[0]
+    assert doc["status"] == JOB_COMPLETED
+    assert [item["status"] for item in doc["items"]] == [ITEM_DONE, ITEM_DONE]
+
+    print("✅ 续约瞬时错误重试测试通过")
+
+
+def test_cancellation_skips_remaining_items(jobs):
+    """测试执行中取消：已开始的图像完成，其余图像标记为跳过，任务状态为已取消"""
+    worker = JobWorker(item_concurrency=1, lease_seconds=60)
+    processed = []
+
+    async def process_item(job, item):
+        processed.append(item["index"])
+        await Job.request_cancel(str(job["_id"]))
+        await Job.record_item(job["_id"], item["index"], ITEM_DONE, result={})
+
+    worker._process_item = process_item
+
+    async def main():
+        worker._slots = asyncio.Semaphore(1)
+        await worker._slots.acquire()
+        await Job(_items(3)).save()
+        job = await Job.claim_next(worker.worker_id, worker.lease_seconds)
+        await worker._run_job(job)
+
+    asyncio.run(main())
+
+    doc = jobs.docs[0]
+    assert processed == [0]
+    assert doc["status"] == JOB_CANCELLED
+    assert [item["status"] for item in doc["items"]] == [ITEM_DONE, ITEM_SKIPPED, ITEM_SKIPPED]
+    assert doc["completed"] == 1 and doc["skipped"] == 2
+
+    print("✅ 任务取消测试通过")
+
+
+def test_zip_upload_stores_each_image(monkeypatch):
+    """测试 zip 中的图像逐个写入存储，跳过目录、macOS 元数据与非图像文件"""
+    stored = []
+
+    async def store_bytes(data, content_type=None):
+        stored.append((bytes(data), content_type))
+        return {"key": f"k{len(stored)}"}
+
+    monkeypatch.setattr(routes_job.storage_service, "store_bytes", store_bytes)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("eyes/left.png", b"png-bytes")
+        archive.writestr("eyes/right.JPG", b"jpg-bytes")
+        archive.writestr("__MACOSX/eyes/._left.png", b"meta")
+        archive.writestr("notes.txt", b"text")
+    buffer.seek(0)
+    upload = SimpleNamespace(file=buffer, filename="batch.zip", content_type="application/zip")
+
+    items = []
+    asyncio.run(routes_job._store_zip(upload, items))
+
+    assert [item["filename"] for item in items] == ["eyes/left.png", "eyes/right.JPG"]
+    assert [item["content_type"] for item in items] == ["image/png", "image/jpeg"]
+    assert [item["storage_key"] for item in items] == ["k1", "k2"]
+    assert stored[0][0] == b"png-bytes"
+
+    print("✅ zip 任务导入测试通过")
+
+
+def test_oversized_upload_is_rejected_before_commit(monkeypatch):
+    """测试单张图像超过 MAX_FILE_SIZE 时在写入存储的过程中中止，而不是先存储再检查"""
+    monkeypatch.setattr(routes_job.settings, "MAX_FILE_SIZE", 10)
+    committed = []
+
+    async def store_stream(chunks, content_type=None):
+        data = b"".join([bytes(chunk) async for chunk in chunks])
+        committed.append(data)
+        return {"key": "k", "size": len(data)}
+
+    monkeypatch.setattr(routes_job.storage_service, "store_stream", store_stream)
+
+    class _Upload:
+        filename = "big.png"
+        content_type = "image/png"
+
+        def __init__(self, data):
+            self._data = io.BytesIO(data)
+
+        async def read(self, size=-1):
+            return self._data.read(size)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(routes_job._store_image(_Upload(b"x" * 64), []))
+    assert exc_info.value.status_code == 413
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(routes_job._store_image(_Upload(b""), []))
+    assert exc_info.value.status_code == 400
+    assert committed == []
+
+    print("✅ 任务上传大小限制测试通过")
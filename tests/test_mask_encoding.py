@@ -0,0 +1,39 @@
+import numpy as np
+
+from utils.mask_encoding import mask_to_rle, rle_to_mask, mask_to_packbits, packbits_to_mask
+
+
+def _random_mask(height=37, width=53, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.random((height, width)) > 0.7).astype(np.uint8) * 255
+
+
+def test_rle_roundtrip():
+    """测试 RLE 编码可无损还原"""
+    mask = _random_mask()
+    rle = mask_to_rle(mask)
+
+    assert rle["size"] == [37, 53]
+    assert sum(rle["counts"]) == mask.size
+    assert np.array_equal(rle_to_mask(rle), mask)
+
+    print("✅ RLE 往返测试通过")
+
+
+def test_rle_starts_with_background_run():
+    """测试首像素为前景时 counts 以 0 长度背景游程开头 (COCO 约定)"""
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    mask[0, 0] = 255
+
+    assert mask_to_rle(mask)["counts"] == [0, 1, 15]
+
+
+def test_packbits_roundtrip():
+    """测试位打包编码可无损还原"""
+    mask = _random_mask(seed=1)
+    packed = mask_to_packbits(mask)
+
+    assert packed["shape"] == [37, 53]
+    assert np.array_equal(packbits_to_mask(packed), mask)
+
+    print("✅ 位打包往返测试通过")
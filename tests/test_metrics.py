@@ -0,0 +1,42 @@
+from core.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    """测试直方图导出累积分桶、_sum 与 _count"""
+    registry = MetricsRegistry()
+    hist = Histogram("stage_seconds", "stage latency", ["stage"], registry=registry, buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 2.0):
+        hist.labels("forward").observe(value)
+
+    text = registry.render()
+    assert 'stage_seconds_bucket{stage="forward",le="0.01"} 1' in text
+    assert 'stage_seconds_bucket{stage="forward",le="0.1"} 3' in text
+    assert 'stage_seconds_bucket{stage="forward",le="1"} 3' in text
+    assert 'stage_seconds_bucket{stage="forward",le="+Inf"} 4' in text
+    assert 'stage_seconds_count{stage="forward"} 4' in text
+    assert "# TYPE stage_seconds histogram" in text
+
+    print("✅ 直方图导出测试通过")
+
+
+def test_counter_and_gauges():
+    """测试计数器标签、回调 Gauge 与转义"""
+    registry = MetricsRegistry()
+    errors = Counter("errors", "errors by code", ["error_code"], registry=registry)
+    errors.labels("QUEUE_FULL").inc()
+    errors.labels("QUEUE_FULL").inc()
+    errors.labels('BAD"CODE').inc()
+
+    in_flight = Gauge("in_flight", "in-flight requests", registry=registry)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    Gauge("queue_depth", "queue depth", registry=registry, fn=lambda: 7)
+
+    text = registry.render()
+    assert 'errors_total{error_code="QUEUE_FULL"} 2' in text
+    assert 'errors_total{error_code="BAD\\"CODE"} 1' in text
+    assert "in_flight 1" in text
+    assert "queue_depth 7" in text
+
+    print("✅ 计数器与 Gauge 测试通过")
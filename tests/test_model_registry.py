@@ -0,0 +1,153 @@
+import asyncio
+
+import services.model_registry as model_registry_module
+from services.model_registry import ModelRegistry, ModelVersionError, confine_artifact
+
+
+class _FakeService:
+    """只实现注册表用到的属性与方法，不加载真实模型"""
+
+    def __init__(self, version, memory_mb=100):
+        self.model_version = version
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.model_loaded = True
+        self.warmed_up = True
+        self.load_time = None
+        self.unloaded = False
+
+    async def predict(self, image, request_id, **kwargs):
+        await asyncio.sleep(0.05)
+        return {"status": "success", "model_version": self.model_version, "unloaded_during": self.unloaded}
+
+    async def unload(self):
+        self.unloaded = True
+        self.model_loaded = False
+        return 0.0
+
+    def get_model_info(self):
+        return {"version": self.model_version}
+
+
+def _registry(*versions, **kwargs):
+    registry = ModelRegistry(primary=_FakeService(versions[0]), **kwargs)
+    for version in versions[1:]:
+        registry._resident[version] = _FakeService(version)
+    return registry
+
+
+def test_lru_eviction_respects_budget_and_default():
+    """测试超出内存预算时按 LRU 卸载，默认版本与最近使用的版本保留"""
+    async def main():
+        registry = _registry("v1", "v2", "v3", memory_budget_mb=1000, max_resident=5)
+        old = registry._resident["v2"]
+        await registry.resolve("v2")  # v2 变为最近使用，v3 成为最久未使用
+        registry.memory_budget = 250 * 1024 * 1024
+        await registry._evict()
+        return registry, old
+
+    registry, v2 = asyncio.run(main())
+
+    assert list(registry._resident) == ["v1", "v2"]
+    assert not v2.unloaded
+    assert [e["action"] for e in registry.get_history()] == ["unload"]
+    assert registry.get_history()[0]["version"] == "v3"
+
+    print("✅ LRU 卸载测试通过")
+
+
+def test_unload_waits_for_inflight_requests():
+    """测试卸载等待在途请求完成，切换默认版本后旧版本上的请求不受影响"""
+    async def main():
+        registry = _registry("v1", "v2", drain_timeout=5)
+        request = asyncio.create_task(registry.predict("v1", None, "r1"))
+        await asyncio.sleep(0.01)
+
+        await registry.activate("v2")
+        await registry.unload("v1")
+        return registry, await request
+
+    registry, result = asyncio.run(main())
+
+    assert registry.default_version == "v2"
+    assert result["status"] == "success"
+    assert result["unloaded_during"] is False
+    assert "v1" not in registry._resident
+
+    print("✅ 热切换排空测试通过")
+
+
+def test_default_version_cannot_be_unloaded():
+    async def main():
+        registry = _registry("v1", "v2")
+        try:
+            await registry.unload("v1")
+        except ModelVersionError as e:
+            return e.status_code
+        return None
+
+    assert asyncio.run(main()) == 409
+
+    print("✅ 默认版本保护测试通过")
+
+
+def test_registered_artifacts_are_confined_to_artifact_dir(monkeypatch, tmp_path):
+    """测试注册版本的权重路径必须位于 MODEL_ARTIFACT_DIR 内 (含符号链接越界与登记后被改指向的情况)"""
+    root = tmp_path / "artifacts"
+    root.mkdir()
+    (root / "v2.pt").write_bytes(b"weights")
+    (tmp_path / "secret.pt").write_bytes(b"outside")
+    (root / "link.pt").symlink_to(tmp_path / "secret.pt")
+    monkeypatch.setattr(model_registry_module.settings, "MODEL_ARTIFACT_DIR", str(root))
+
+    assert confine_artifact("v2.pt") == str((root / "v2.pt").resolve())
+    assert confine_artifact(str(root / "v2.pt")) == str((root / "v2.pt").resolve())
+    assert confine_artifact("../secret.pt") is None
+    assert confine_artifact(str(tmp_path / "secret.pt")) is None
+    assert confine_artifact("/etc/passwd") is None
+    assert confine_artifact("link.pt") is None
+
+    async def find_by_version(version):
+        return {"model_version": version, "artifact_path": str(root / "link.pt")}
+
+    monkeypatch.setattr(model_registry_module.ModelInfo, "find_by_version", find_by_version)
+
+    async def main():
+        try:
+            await _registry("v1")._artifact_for("v3")
+        except ModelVersionError as e:
+            return e.status_code
+        return None
+
+    assert asyncio.run(main()) == 409
+
+    print("✅ 权重路径限制测试通过")
+
+
+def test_requests_do_not_load_non_resident_versions():
+    """测试预测请求指定未常驻的版本时返回 404 且不触发加载；只有影子候选 (管理员配置) 允许加载"""
+    loaded = []
+
+    async def main():
+        registry = _registry("v1", "v2")
+
+        async def load(version):
+            loaded.append(version)
+            registry._resident[version] = _FakeService(version)
+            return registry._resident[version]
+
+        registry.load = load
+        try:
+            await registry.resolve("v9")
+        except ModelVersionError as e:
+            status = e.status_code
+        resident = await registry.resolve("v2")
+        shadow = await registry.resolve("v3", allow_load=True)
+        return status, resident, shadow
+
+    status, resident, shadow = asyncio.run(main())
+
+    assert status == 404
+    assert resident.model_version == "v2" and shadow.model_version == "v3"
+    assert loaded == ["v3"]
+
+    print("✅ 请求不触发模型加载测试通过")
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from core.pagination import (InvalidCursorError, build_projection, decode_cursor,
+                             encode_cursor, keyset_filter)
+
+
+def test_cursor_roundtrip():
+    """测试游标可还原 (时间字段, _id)"""
+    doc = {"_id": ObjectId(), "created_at": datetime(2024, 5, 1, 12, 30, 15, 123000)}
+    value, last_id = decode_cursor(encode_cursor(doc, "created_at"))
+
+    assert value == doc["created_at"]
+    assert last_id == doc["_id"]
+
+    print("✅ 游标往返测试通过")
+
+
+def test_keyset_filter_and_invalid_cursor():
+    """测试键集条件「严格排在游标之后」，以及非法游标报错"""
+    doc = {"_id": ObjectId(), "uploaded_at": datetime(2024, 1, 1)}
+    query = keyset_filter({"patient_id": "p1"}, "uploaded_at", encode_cursor(doc, "uploaded_at"))
+
+    assert query["patient_id"] == "p1"
+    assert query["$or"] == [
+        {"uploaded_at": {"$lt": doc["uploaded_at"]}},
+        {"uploaded_at": doc["uploaded_at"], "_id": {"$lt": doc["_id"]}},
+    ]
+    assert keyset_filter({"patient_id": "p1"}, "uploaded_at", None) == {"patient_id": "p1"}
+
+    with pytest.raises(InvalidCursorError):
+        decode_cursor("not-a-cursor")
+
+
+def test_projection_keeps_sort_field_and_drops_unknown():
+    """测试投影忽略未知字段并保留排序字段"""
+    projection = build_projection("filename, password ,file_size", ("filename", "file_size"), "uploaded_at")
+    assert projection == {"filename": 1, "file_size": 1, "uploaded_at": 1}
+    assert build_projection(None, ("filename",), "uploaded_at") is None
@@ -0,0 +1,112 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect
+
+import services.persistence_queue as persistence_queue
+from services.persistence_queue import WriteBehindQueue
+
+
+class _FakeCollection:
+    def __init__(self, db):
+        self.db = db
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        if self.db.down:
+            raise AutoReconnect("mongo unreachable")
+        self.db.calls += 1
+        self.docs.extend(docs)
+
+
+class _FakeDB(dict):
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.calls = 0
+
+    def __missing__(self, name):
+        self[name] = _FakeCollection(self)
+        return self[name]
+
+
+def test_documents_are_batched_and_ids_preassigned(monkeypatch, tmp_path):
+    """测试入队立即返回 ID，后台按集合批量写入"""
+    fake_db = _FakeDB()
+    monkeypatch.setattr(persistence_queue, "db", fake_db)
+    queue = WriteBehindQueue(batch_size=50, flush_interval_ms=20, journal_path=str(tmp_path / "journal.jsonl"))
+
+    async def main():
+        ids = []
+        for i in range(10):
+            image_id = queue.enqueue("images", {"filename": f"{i}.png"})
+            queue.enqueue("predictions", {"image_id": image_id})
+            ids.append(image_id)
+        await queue.stop()
+        return ids
+
+    ids = asyncio.run(main())
+
+    assert [str(d["_id"]) for d in fake_db["images"].docs] == ids
+    assert [d["image_id"] for d in fake_db["predictions"].docs] == ids
+    assert fake_db.calls == 2  # 每个集合一次 insert_many
+
+    print("✅ 写后批量写入测试通过")
+
+
+def test_unreachable_mongo_spills_to_journal_and_replays(monkeypatch, tmp_path):
+    """测试 MongoDB 不可达时写入本地日志，恢复后重放"""
+    fake_db = _FakeDB()
+    fake_db.down = True
+    monkeypatch.setattr(persistence_queue, "db", fake_db)
+    journal_path = tmp_path / "journal.jsonl"
+
+    async def write_while_down():
+        queue = WriteBehindQueue(flush_interval_ms=5, journal_path=str(journal_path))
+        for i in range(3):
+            queue.enqueue("images", {"filename": f"{i}.png"})
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(write_while_down())
+    assert queue.journaled == 3
+    assert journal_path.exists()
+
+    fake_db.down = False
+
+    async def restart():
+        queue = WriteBehindQueue(journal_path=str(journal_path))
+        await queue.start()
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(restart())
+    assert queue.replayed == 3
+    assert len(fake_db["images"].docs) == 3
+    assert not journal_path.exists()
+
+    print("✅ 本地日志重放测试通过")
+
+
+def test_journal_is_replayed_without_new_traffic(monkeypatch, tmp_path):
+    """测试 MongoDB 恢复后，即使没有新的写入，也会在 retry_interval 后重放本地日志"""
+    fake_db = _FakeDB()
+    fake_db.down = True
+    monkeypatch.setattr(persistence_queue, "db", fake_db)
+
+    async def main():
+        queue = WriteBehindQueue(flush_interval_ms=5, retry_interval=0.05,
+                                 journal_path=str(tmp_path / "journal.jsonl"))
+        queue.enqueue("images", {"filename": "a.png"})
+        await asyncio.sleep(0.03)
+        assert queue.journaled == 1
+
+        fake_db.down = False
+        await asyncio.sleep(0.2)
+        replayed = queue.replayed
+        await queue.stop()
+        return replayed
+
+    assert asyncio.run(main()) == 1
+    assert len(fake_db["images"].docs) == 1
+
+    print("✅ 空闲时日志重放测试通过")
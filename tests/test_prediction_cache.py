@@ -0,0 +1,74 @@
+import asyncio
+
+from services.prediction_cache import PredictionCache, _DiskTier
+
+
+def _entry(size: int):
+    return {"mask_png": b"x" * size, "confidence": 0.5, "vessel_coverage": 0.1,
+            "inference_mode": "resize", "image_info": {"dimensions": "512x512"}}
+
+
+def test_key_depends_on_model_version_and_params():
+    """测试缓存键同时包含图像内容、模型版本与推理参数"""
+    key = PredictionCache.make_key(b"img", "1.0", {"mode": "resize"})
+
+    assert key == PredictionCache.make_key(b"img", "1.0", {"mode": "resize"})
+    assert key != PredictionCache.make_key(b"img", "2.0", {"mode": "resize"})
+    assert key != PredictionCache.make_key(b"img", "1.0", {"mode": "tiled"})
+
+    print("✅ 缓存键测试通过")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    """测试内存层按 LRU 淘汰"""
+    cache = PredictionCache(memory_max_bytes=3000)
+
+    async def main():
+        await cache.put("a", _entry(900))
+        await cache.put("b", _entry(900))
+        assert await cache.get("a") is not None  # a 变为最近使用
+        await cache.put("c", _entry(900))
+        return await cache.get("a"), await cache.get("b")
+
+    a, b = asyncio.run(main())
+    assert a is not None and a["cache_tier"] == "memory"
+    assert b is None
+    assert cache.memory_evictions == 1
+
+    print("✅ 内存 LRU 测试通过")
+
+
+def test_disk_tier_survives_memory_eviction(tmp_path):
+    """测试磁盘层命中，并按容量淘汰"""
+    cache = PredictionCache(memory_max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=5000)
+
+    async def main():
+        await cache.put("a", _entry(2000))
+        await cache.put("b", _entry(2000))
+        await cache.put("c", _entry(2000))
+        return await cache.get("a"), await cache.get("c")
+
+    a, c = asyncio.run(main())
+    assert a is None
+    assert c is not None and c["cache_tier"] == "disk"
+    assert c["mask_png"] == b"x" * 2000
+
+    print("✅ 磁盘缓存测试通过")
+
+
+def test_disk_tier_writes_are_atomic(tmp_path):
+    """测试磁盘层通过临时文件 + 重命名写入，重启时清理残留的临时文件与不完整的条目"""
+    tier = _DiskTier(str(tmp_path), max_bytes=10000)
+    tier.put("a", _entry(100))
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # 模拟写入中途崩溃：掩码已写入、meta 仍是临时文件
+    (tmp_path / "b.png").write_bytes(b"x" * 100)
+    (tmp_path / "b.json.0123.tmp").write_text("{")
+
+    restarted = _DiskTier(str(tmp_path), max_bytes=10000)
+    assert list(restarted._index) == ["a"]
+    assert restarted.get("a")["mask_png"] == b"x" * 100
+    assert not list(tmp_path.glob("*.tmp"))
+
+    print("✅ 磁盘缓存原子写入测试通过")
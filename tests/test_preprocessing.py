@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from services.preprocessing import Preprocessor, normalization_params
+
+
+def _reference(image):
+    """原始的逐步预处理实现"""
+    img = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (512, 512)).astype(np.float32)
+    img = (img - img.min()) / (img.max() - img.min())
+    return img.transpose((2, 0, 1))
+
+
+def test_fused_preprocess_matches_reference():
+    """测试融合预处理与原实现结果一致"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(10, 240, size=(700, 900, 3), dtype=np.uint8)
+
+    out = Preprocessor().preprocess(image)
+
+    assert out.shape == (3, 512, 512)
+    assert out.dtype == np.float32
+    assert np.allclose(out, _reference(image), atol=1e-6)
+
+    print("✅ 融合预处理一致性测试通过")
+
+
+def test_batch_buffer_is_reused():
+    """测试同一线程内批缓冲区被复用，只在批变大时重新分配"""
+    preprocessor = Preprocessor()
+    a = preprocessor.batch_buffer(4, (3, 64, 64))
+    b = preprocessor.batch_buffer(2, (3, 64, 64))
+
+    assert b.shape == (2, 3, 64, 64)
+    assert np.shares_memory(a, b)
+
+    print("✅ 批缓冲区复用测试通过")
+
+
+def test_flat_image_falls_back_to_255_scale():
+    """测试动态范围过小时退化为 /255 归一化"""
+    assert normalization_params(7, 7) == (0.0, 1.0 / 255.0)
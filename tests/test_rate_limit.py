@@ -0,0 +1,202 @@
+import asyncio
+import json
+
+from core.rate_limit import AdmissionController, AdmissionMiddleware, TokenBucketLimiter, request_deadline
+
+
+def _scope(path="/api/v1/predict", headers=()):
+    return {"type": "http", "method": "POST", "path": path, "query_string": b"",
+            "headers": list(headers), "client": ("10.0.0.1", 5000)}
+
+
+async def _call(middleware, scope, messages=None):
+    """驱动一次 ASGI 调用，返回 (状态码, 响应体 JSON 或 None)"""
+    messages = list(messages or [{"type": "http.request", "body": b"", "more_body": False}])
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    status = next((m["status"] for m in sent if m["type"] == "http.response.start"), None)
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return status, json.loads(body) if body else None
+
+
+async def _ok_app(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def test_token_bucket_limits_per_client_and_weights_cost():
+    """测试令牌桶按客户端独立计数，大图成本更高，且单次成本不超过桶容量"""
+    limiter = TokenBucketLimiter(rate_per_minute=60, burst=10)
+
+    assert limiter.try_acquire("a", 8) == 0
+    assert limiter.try_acquire("a", 8) > 0  # 令牌不足时不扣除
+    assert limiter.try_acquire("a", 2) == 0
+    assert limiter.try_acquire("b", 10) == 0
+    assert limiter.try_acquire("c", 100) == 0  # 成本封顶为容量，否则永远无法通过
+
+    controller = AdmissionController(cost_pixels=1024 * 1024)
+    assert controller.image_cost(584, 565) == 1.0
+    assert 15 < controller.image_cost(4096, 4096) <= 16
+
+    print("✅ 令牌桶限流测试通过")
+
+
+def test_middleware_returns_429_when_bucket_is_empty():
+    controller = AdmissionController(rate_per_minute=60, burst=2, inference_paths=["/api/v1/predict"],
+                                     exempt_paths=["/health"], api_keys=["k1", "k2"])
+    middleware = AdmissionMiddleware(_ok_app, controller)
+
+    async def main():
+        results = [await _call(middleware, _scope(headers=[(b"x-api-key", b"k1")])) for _ in range(3)]
+        other_client = await _call(middleware, _scope(headers=[(b"x-api-key", b"k2")]))
+        health = [await _call(middleware, _scope("/health")) for _ in range(5)]
+        return results, other_client, health
+
+    results, other_client, health = asyncio.run(main())
+
+    assert [status for status, _ in results] == [200, 200, 429]
+    assert results[2][1]["detail"]["error_code"] == "RATE_LIMITED"
+    assert other_client[0] == 200
+    assert all(status == 200 for status, _ in health)
+    assert controller.get_stats()["rejected"] == {"rate_limited": 1}
+
+    print("✅ 限流中间件测试通过")
+
+
+def test_unregistered_keys_share_the_ip_bucket():
+    """测试未登记的 X-API-Key / X-Patient-ID 不能绕过限流：轮换取值仍按同一 IP 计数，且不新增令牌桶"""
+    controller = AdmissionController(rate_per_minute=60, burst=1, inference_paths=["/api/v1/predict"],
+                                     api_keys=["registered"])
+    middleware = AdmissionMiddleware(_ok_app, controller)
+
+    async def main():
+        rotating = [await _call(middleware, _scope(headers=[(b"x-api-key", f"random-{i}".encode()),
+                                                            (b"x-patient-id", f"p{i}".encode())]))
+                    for i in range(20)]
+        registered = await _call(middleware, _scope(headers=[(b"x-api-key", b"registered")]))
+        return rotating, registered
+
+    rotating, registered = asyncio.run(main())
+
+    assert [status for status, _ in rotating] == [200] + [429] * 19
+    assert registered[0] == 200
+    assert controller.get_stats()["tracked_clients"] == 2
+
+    print("✅ 未登记身份限流测试通过")
+
+
+def test_read_only_requests_are_not_charged():
+    """测试列表查询与任务轮询等 GET 请求不扣令牌；max_concurrency=0 时不限制推理并发"""
+    controller = AdmissionController(rate_per_minute=60, burst=1, max_concurrency=0,
+                                     inference_paths=["/api/v1/predict"])
+    middleware = AdmissionMiddleware(_ok_app, controller)
+
+    def get(path):
+        return {**_scope(path), "method": "GET"}
+
+    async def main():
+        polls = [await _call(middleware, get("/jobs/abc")) for _ in range(5)]
+        first = await _call(middleware, _scope())
+        second = await _call(middleware, _scope())
+        return polls, first, second
+
+    polls, first, second = asyncio.run(main())
+
+    assert all(status == 200 for status, _ in polls)
+    assert first[0] == 200 and second[0] == 429
+    assert controller.get_stats()["inflight"] == 0
+
+    print("✅ 只读请求不限流测试通过")
+
+
+def test_deadline_cancels_queued_work():
+    """测试超过截止时间的请求被取消 (排队中的推理随之取消) 并返回 504"""
+    cancelled = []
+
+    async def slow_app(scope, receive, send):
+        await receive()
+        assert request_deadline.get() is not None
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    controller = AdmissionController(rate_per_minute=0, request_timeout=0.05,
+                                     inference_paths=["/api/v1/predict"])
+    middleware = AdmissionMiddleware(slow_app, controller)
+
+    status, body = asyncio.run(_call(middleware, _scope()))
+
+    assert status == 504
+    assert body["detail"]["error_code"] == "DEADLINE_EXCEEDED"
+    assert cancelled == [True]
+    assert controller.get_stats()["inflight"] == 0
+
+    print("✅ 截止时间取消测试通过")
+
+
+def test_client_disconnect_cancels_request():
+    cancelled = []
+
+    async def slow_app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    controller = AdmissionController(rate_per_minute=0, request_timeout=5,
+                                     inference_paths=["/api/v1/predict"])
+    middleware = AdmissionMiddleware(slow_app, controller)
+    messages = [{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+
+    status, _ = asyncio.run(_call(middleware, _scope(), messages))
+
+    assert status is None
+    assert cancelled == [True]
+    assert controller.get_stats()["rejected"] == {"client_disconnected": 1}
+
+    print("✅ 客户端断开取消测试通过")
+
+
+def test_concurrency_cap_returns_503():
+    release = None
+
+    async def blocking_app(scope, receive, send):
+        await receive()
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    controller = AdmissionController(rate_per_minute=0, max_concurrency=1, max_wait=0.05,
+                                     inference_paths=["/api/v1/predict"])
+    middleware = AdmissionMiddleware(blocking_app, controller)
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.create_task(_call(middleware, _scope()))
+        await asyncio.sleep(0.01)
+        second = await _call(middleware, _scope())
+        release.set()
+        return await first, second
+
+    first, second = asyncio.run(main())
+
+    assert first[0] == 200
+    assert second[0] == 503
+    assert second[1]["detail"]["error_code"] == "SERVER_BUSY"
+
+    print("✅ 并发上限测试通过")
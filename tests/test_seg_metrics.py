@@ -0,0 +1,58 @@
+import numpy as np
+
+from utils.seg_metrics import confusion_counts, dice_score, iou_score
+
+
+def test_confusion_counts_and_scores():
+    """测试 TP/FP/FN/TN 统计以及 Dice / IoU 计算"""
+    pred = np.array([[1, 1, 0], [0, 0, 0]], dtype=np.uint8) * 255
+    target = np.array([[1, 0, 0], [1, 0, 0]], dtype=bool)
+
+    assert confusion_counts(pred, target) == {"tp": 1, "fp": 1, "fn": 1, "tn": 3}
+    assert abs(dice_score(pred, target) - 0.5) < 1e-9
+    assert abs(iou_score(pred, target) - 1 / 3) < 1e-9
+
+    print("✅ 分割指标测试通过")
+
+
+def test_empty_masks_score_one():
+    """测试预测与标注都为空时 Dice / IoU 记为 1"""
+    empty = np.zeros((8, 8), dtype=np.uint8)
+    assert dice_score(empty, empty) == 1.0
+    assert iou_score(empty, empty) == 1.0
+
+
+def test_histogram_auc_matches_rank_auc():
+    """测试直方图 ROC-AUC 与精确的秩统计 AUC 一致"""
+    from utils.seg_metrics import roc_auc
+
+    rng = np.random.default_rng(0)
+    target = rng.random((64, 64)) > 0.8
+    probs = np.clip(rng.normal(0.35 + 0.3 * target, 0.15), 0, 1)
+
+    pos, neg = probs[target], probs[~target]
+    exact = ((pos[:, None] > neg[None, :]).mean() + 0.5 * (pos[:, None] == neg[None, :]).mean())
+
+    assert abs(roc_auc(probs, target) - exact) < 1e-3
+    assert roc_auc(target.astype(np.float32), target) == 1.0
+
+
+def test_streaming_metrics_match_whole_dataset():
+    """测试逐张流式累积的 micro 指标与整体计算一致"""
+    from utils.seg_metrics import StreamingSegMetrics, roc_auc
+
+    rng = np.random.default_rng(1)
+    images = [(rng.random((20, 30)), rng.random((20, 30)) > 0.7) for _ in range(3)]
+
+    metrics = StreamingSegMetrics()
+    for probs, target in images:
+        metrics.update(probs, target)
+    summary = metrics.summary()
+
+    all_probs = np.concatenate([p.ravel() for p, _ in images])
+    all_target = np.concatenate([t.ravel() for _, t in images])
+    assert summary["images"] == 3
+    assert abs(summary["micro"]["dice"] - dice_score(all_probs > 0.5, all_target)) < 1e-12
+    assert abs(summary["micro"]["auc"] - roc_auc(all_probs, all_target)) < 1e-12
+
+    print("✅ 流式指标测试通过")
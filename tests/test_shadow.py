@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+from services.shadow import ShadowRunner
+
+
+def test_shadow_work_is_shed_under_pressure():
+    """测试推理队列有压力或影子队列已满时，影子任务被直接丢弃而不是排队"""
+    executor = SimpleNamespace(pending=0, max_queue=8)
+    registry = SimpleNamespace(primary=SimpleNamespace(executor=executor))
+
+    async def main():
+        runner = ShadowRunner(registry, candidate_version="v2", sample_rate=1.0,
+                              max_pending=1, pressure_threshold=0.5, persist=False)
+        runner._worker = lambda: asyncio.sleep(3600)  # 不执行，只观察入队
+
+        executor.pending = 4
+        runner.offer("v1", executor, None, "r1", {})
+        executor.pending = 0
+        runner.offer("v1", executor, None, "r2", {})
+        runner.offer("v1", executor, None, "r3", {})
+        runner.offer("v2", executor, None, "r4", {})  # 候选版本自身的请求不做影子
+        stats = runner.get_stats()
+        await runner.stop()
+        return stats
+
+    stats = asyncio.run(main())
+
+    assert stats["offered"] == 3
+    assert stats["sampled"] == 1
+    assert stats["shed"] == {"pressure": 1, "queue_full": 1}
+    assert stats["queue_depth"] == 1
+
+    print("✅ 影子任务丢弃测试通过")
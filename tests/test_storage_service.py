@@ -0,0 +1,25 @@
+import asyncio
+
+from services.storage_service import LocalStorageBackend, iter_chunks
+
+
+def test_local_backend_deduplicates_by_content(tmp_path):
+    """测试相同内容只保存一份，且可分块读回"""
+    backend = LocalStorageBackend(str(tmp_path), chunk_size=4)
+    data = b"retina-fundus-image-bytes"
+
+    async def main():
+        first = await backend.put_stream(iter_chunks(data, 4), "image/png")
+        second = await backend.put_stream(iter_chunks(data, 7), "image/png")
+        chunks = [bytes(c) async for c in backend.open_stream(first["key"])]
+        return first, second, chunks
+
+    first, second, chunks = asyncio.run(main())
+
+    assert first["key"] == second["key"]
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert b"".join(chunks) == data
+    assert max(len(c) for c in chunks) == 4
+    assert not list((tmp_path / "tmp").iterdir())  # 临时文件已清理
+
+    print("✅ 本地存储去重测试通过")
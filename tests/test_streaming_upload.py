@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import struct
+
+from api.streaming_upload import UploadRejected, receive_image_upload
+from services.storage_service import LocalStorageBackend, storage_service
+from utils.image_sniff import sniff_image
+
+BOUNDARY = b"retina-boundary"
+
+
+def _png(width, height, size=64):
+    ihdr = struct.pack(">II", width, height) + b"\x08\x02\x00\x00\x00"
+    data = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr + b"\x00\x00\x00\x00"
+    return data + b"\x00" * max(0, size - len(data))
+
+
+def _jpeg(width, height):
+    app1 = b"\xff\xe1" + struct.pack(">H", 2 + 300) + b"\x00" * 300  # 较大的 EXIF 段在帧头之前
+    sof0 = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + app1 + sof0 + b"\xff\xda"
+
+
+def _body(file_bytes, content_type=b"image/png", fields=None):
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"" + name.encode()
+                     + b"\"\r\n\r\n" + value.encode() + b"\r\n")
+    parts.append(b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"file\"; filename=\"eye.png\"\r\n"
+                 + b"Content-Type: " + content_type + b"\r\n\r\n" + file_bytes + b"\r\n")
+    return b"".join(parts) + b"--" + BOUNDARY + b"--\r\n"
+
+
+class _FakeRequest:
+    """只提供 headers 与 stream()，并记录被读取了多少字节"""
+
+    def __init__(self, body, chunk_size=16, content_length=True):
+        self.headers = {"content-type": "multipart/form-data; boundary=" + BOUNDARY.decode()}
+        if content_length:
+            self.headers["content-length"] = str(len(body))
+        self.body = body
+        self.chunk_size = chunk_size
+        self.consumed = 0
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start:start + self.chunk_size]
+            self.consumed += len(chunk)
+            yield chunk
+
+
+def test_sniff_reads_format_and_size_from_header():
+    """测试只凭文件头读出格式与宽高，尺寸不在已接收的字节内时返回 None"""
+    assert sniff_image(_png(584, 565)) == ("png", 584, 565)
+    assert sniff_image(_jpeg(3504, 2336)) == ("jpg", 3504, 2336)
+    assert sniff_image(b"GIF89a" + struct.pack("<HH", 700, 605) + b"\x00") == ("gif", 700, 605)
+
+    tiff = b"II*\x00" + struct.pack("<I", 8) + struct.pack("<H", 2) \
+        + struct.pack("<HHII", 256, 3, 1, 565) + struct.pack("<HHII", 257, 4, 1, 584)
+    assert sniff_image(tiff) == ("tiff", 565, 584)
+
+    truncated = sniff_image(_jpeg(3504, 2336)[:100])
+    assert truncated.format == "jpg" and not truncated.has_size
+    assert sniff_image(b"%PDF-1.7\n...") is None
+
+    print("✅ 图像头嗅探测试通过")
+
+
+def test_upload_is_rejected_while_streaming():
+    """测试超大文件与超尺寸图像在接收中途就被拒绝，合法上传得到字段、内容与增量哈希"""
+
+    async def receive(request, **kwargs):
+        try:
+            return await receive_image_upload(request, "file", min_dimension=100, max_dimension=4096, **kwargs)
+        except UploadRejected as e:
+            return e
+
+    # Content-Length 已超限：不读取请求体
+    big = _FakeRequest(_body(_png(584, 565, size=128 * 1024)))
+    error = asyncio.run(receive(big, max_size=1024))
+    assert error.status_code == 413 and big.consumed == 0
+
+    # 分块传输 (无 Content-Length)：超过上限后立即停止读取
+    chunked = _FakeRequest(_body(_png(584, 565, size=256 * 1024)), chunk_size=1024, content_length=False)
+    error = asyncio.run(receive(chunked, max_size=8 * 1024))
+    assert error.status_code == 413 and chunked.consumed < 16 * 1024
+
+    # 尺寸超限：读到 IHDR 即拒绝，不等待其余内容
+    huge = _FakeRequest(_body(_png(8000, 8000, size=512 * 1024)))
+    error = asyncio.run(receive(huge, max_size=1024 * 1024))
+    assert error.error_code == "INVALID_IMAGE_DIMENSIONS" and huge.consumed < 1024
+
+    error = asyncio.run(receive(_FakeRequest(_body(b"not an image at all", b"image/png"))))
+    assert error.status_code == 415
+
+    png = _png(584, 565, size=2048)
+    upload = asyncio.run(receive(_FakeRequest(_body(png, fields={"patient_id": "p1"})), keep_bytes=True))
+    assert upload.fields == {"patient_id": "p1"}
+    assert bytes(upload.data) == png and upload.size == len(png)
+    assert upload.header == ("png", 584, 565)
+
+    assert upload.sha256 == hashlib.sha256(png).hexdigest()
+
+    print("✅ 流式上传校验测试通过")
+
+
+def test_missing_field_discards_streamed_blob(monkeypatch, tmp_path):
+    """测试必填字段缺失 (即使出现在文件之后) 时，已流式写入的内容不会提交到存储"""
+    backend = LocalStorageBackend(str(tmp_path), chunk_size=1024)
+    monkeypatch.setattr(storage_service, "backend_name", "local")
+    monkeypatch.setattr(storage_service, "_backend", backend)
+    png = _png(584, 565, size=8 * 1024)
+
+    async def receive(body):
+        try:
+            return await receive_image_upload(_FakeRequest(body, chunk_size=512), "file", keep_bytes=False,
+                                              store=True, required_fields=["user_id"])
+        except UploadRejected as e:
+            return e
+
+    error = asyncio.run(receive(_body(png)))
+    assert error.error_code == "MISSING_FIELD"
+    assert [p.name for p in tmp_path.iterdir()] == ["tmp"]
+    assert not list((tmp_path / "tmp").iterdir())
+
+    upload = asyncio.run(receive(_body(png, fields={"user_id": "p1"})))
+    assert upload.storage_ref["key"] == hashlib.sha256(png).hexdigest()
+    assert upload.storage_ref["size"] == len(png)
+
+    print("✅ 缺失字段丢弃上传测试通过")
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from services.tiling import TilePlan, TileAccumulator, blend_window, tile_starts
+
+
+def test_tile_starts_cover_full_length():
+    """测试图块起点完整覆盖整条边，且最后一块与边界对齐"""
+    starts = tile_starts(3000, 512, 448)
+
+    assert starts[0] == 0
+    assert starts[-1] == 3000 - 512
+    assert all(b - a <= 448 for a, b in zip(starts, starts[1:]))
+
+    print("✅ 图块坐标测试通过")
+
+
+def test_blend_window_is_positive():
+    """测试融合窗口处处为正，中心权重为 1"""
+    window = blend_window(512, 64)
+
+    assert window.shape == (512, 512)
+    assert window.min() > 0
+    assert window[256, 256] == pytest.approx(1.0)
+
+    print("✅ 融合窗口测试通过")
+
+
+def test_accumulator_reconstructs_constant_map():
+    """测试常数概率图经分块融合后保持不变，并裁剪回原始尺寸"""
+    plan = TilePlan(700, 300, tile_size=256, overlap=32)
+    accumulator = TileAccumulator(plan)
+
+    for coords in plan.batches(3):
+        accumulator.add_many(coords, [np.full((256, 256), 0.7, dtype=np.float32)] * len(coords))
+
+    result = accumulator.result()
+    assert result.shape == (700, 300)
+    assert np.allclose(result, 0.7)
+
+    print("✅ 分块融合测试通过")
+
+
+def test_invalid_tile_size_rejected():
+    """测试非 16 倍数的图块尺寸被拒绝"""
+    with pytest.raises(ValueError):
+        TilePlan(1024, 1024, tile_size=500)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from services.tta import VIEWS, apply_view, fill_views, invert_view, merge_views, parse_views
+
+
+def test_views_roundtrip():
+    """测试每个视图的逆变换都能还原输入"""
+    x = np.random.default_rng(0).random((3, 8, 8)).astype(np.float32)
+    for view in VIEWS:
+        assert np.array_equal(invert_view(apply_view(x, view), view), x), view
+
+    print("✅ TTA 视图往返测试通过")
+
+
+def test_parse_views():
+    """测试预设、自定义列表与非法参数"""
+    assert parse_views(None) == ()
+    assert parse_views("none") == ()
+    assert parse_views("flips") == ("identity", "hflip", "vflip")
+    assert parse_views("vflip, hflip,vflip") == ("identity", "vflip", "hflip")
+    assert len(parse_views("d4")) == 8
+
+    with pytest.raises(ValueError):
+        parse_views("rot45")
+    with pytest.raises(ValueError):
+        parse_views("d4", max_views=4)
+
+    print("✅ TTA 参数解析测试通过")
+
+
+def test_equivariant_model_has_full_agreement():
+    """测试逐像素模型 (对翻转 / 旋转等变) 的融合结果等于单次预测，且不确定性为 0"""
+    views = parse_views("d4")
+    slots = np.empty((len(views), 3, 16, 16), dtype=np.float32)
+    slots[0] = np.random.default_rng(1).random((3, 16, 16))
+    fill_views(slots, views)
+
+    probs = slots.mean(axis=1)  # 逐像素 "模型"
+    merged = merge_views(probs, views)
+
+    assert merged.shape == (3, 16, 16)
+    assert np.allclose(merged[0], probs[0], atol=1e-6)
+    assert np.allclose(merged[1], 0.0, atol=1e-6)
+    assert np.allclose(merged[2], 1.0)
+
+    print("✅ TTA 融合测试通过")
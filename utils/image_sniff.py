@@ -0,0 +1,149 @@
+"""
+图像头部嗅探模块 (Image Header Sniffing)
+--------------------------------------
+只根据文件开头的若干字节判断图像格式与宽高，不做完整解码：
+上传流式接收时先用它拒绝伪造扩展名 / 不支持的格式与超大尺寸的图像，再决定是否继续接收与解码。
+支持 PNG、JPEG、GIF、TIFF、BMP；纯 Python 实现 (struct)，不依赖 OpenCV / PIL。
+"""
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# 判断格式所需的最少字节数 (各格式的魔数都在前 12 字节内)
+MAGIC_BYTES = 12
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+# JPEG 帧头标记 (SOF0-SOF15，不含 DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# 没有长度字段的 JPEG 标记 (TEM、RSTn、SOI)
+_JPEG_STANDALONE_MARKERS = frozenset([0x01, 0xD8, *range(0xD0, 0xD8)])
+
+
+class ImageHeader(NamedTuple):
+    """嗅探结果：format 与 ALLOWED_CONTENT_TYPES 的取值一致；尺寸不在已接收的字节内时为 None"""
+    format: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def has_size(self) -> bool:
+        return self.width is not None and self.height is not None
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """按魔数判断格式，无法识别时返回 None"""
+    if head.startswith(_PNG_MAGIC):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head.startswith(b"BM") and len(head) >= 6:
+        return "bmp"
+    return None
+
+
+def _png_size(head: bytes) -> Optional[Tuple[int, int]]:
+    # 签名 (8) + IHDR 长度 (4) + "IHDR" (4) + 宽 (4) + 高 (4)
+    if len(head) < 24 or head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _gif_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 10:
+        return None
+    return struct.unpack("<HH", head[6:10])
+
+
+def _bmp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 26:
+        return None
+    dib_size = struct.unpack("<I", head[14:18])[0]
+    if dib_size == 12:  # OS/2 BITMAPCOREHEADER
+        return struct.unpack("<HH", head[18:22])
+    width, height = struct.unpack("<ii", head[18:26])
+    return abs(width), abs(height)  # 高度为负表示自上而下存储
+
+
+def _jpeg_size(head: bytes) -> Optional[Tuple[int, int]]:
+    """逐段跳过 APPn / DQT 等，直到帧头 (EXIF 等段很大时可能超出已接收的字节)"""
+    i, n = 2, len(head)
+    while i + 4 <= n:
+        if head[i] != 0xFF:
+            return None
+        marker = head[i + 1]
+        if marker == 0xFF:  # 填充字节
+            i += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", head[i + 5:i + 9])
+            return width, height
+        if marker == 0xDA:  # 扫描数据开始前仍未见到帧头
+            return None
+        i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+    return None
+
+
+def _tiff_size(head: bytes) -> Optional[Tuple[int, int]]:
+    """读取第一个 IFD 的 ImageWidth (256) / ImageLength (257) 标签 (IFD 不在已接收的字节内时返回 None)"""
+    endian = "<" if head[:2] == b"II" else ">"
+    if len(head) < 8:
+        return None
+    offset = struct.unpack(endian + "I", head[4:8])[0]
+    if offset + 2 > len(head):
+        return None
+    count = struct.unpack(endian + "H", head[offset:offset + 2])[0]
+    size = {}
+    for k in range(count):
+        entry = offset + 2 + 12 * k
+        if entry + 12 > len(head):
+            return None
+        tag, field_type = struct.unpack(endian + "HH", head[entry:entry + 4])
+        if tag not in (256, 257):
+            continue
+        if field_type == 3:  # SHORT
+            size[tag] = struct.unpack(endian + "H", head[entry + 8:entry + 10])[0]
+        elif field_type == 4:  # LONG
+            size[tag] = struct.unpack(endian + "I", head[entry + 8:entry + 12])[0]
+        if len(size) == 2:
+            return size[256], size[257]
+    return None
+
+
+_SIZE_READERS = {
+    "png": _png_size,
+    "jpg": _jpeg_size,
+    "gif": _gif_size,
+    "tiff": _tiff_size,
+    "bmp": _bmp_size,
+}
+
+
+def sniff_image(head: bytes) -> Optional[ImageHeader]:
+    """
+    从文件开头的字节嗅探格式与宽高
+
+    Args:
+        head: 文件开头的字节 (越长越可能读到尺寸，通常 64KB 足够)
+
+    Returns:
+        无法识别格式时返回 None；识别出格式但尺寸不在 head 内时 width/height 为 None
+    """
+    head = bytes(head)
+    fmt = sniff_format(head)
+    if fmt is None:
+        return None
+    try:
+        size = _SIZE_READERS[fmt](head)
+    except struct.error:
+        size = None
+    if size is None:
+        return ImageHeader(fmt)
+    return ImageHeader(fmt, int(size[0]), int(size[1]))
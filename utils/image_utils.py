@@ -1,40 +1,41 @@
 import cv2
 import numpy as np
 import base64
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Union
 import logging
-from PIL import Image
 import io
 
 logger = logging.getLogger(__name__)
 
 
-def base64_to_image(base64_string: str) -> Optional[np.ndarray]:
-    """
-    将base64字符串转换为OpenCV图像
-    (已升级：支持 GIF / TIFF)
+def bytes_to_image(data: Union[bytes, bytearray, memoryview]) -> Optional[np.ndarray]:
     """
-    try:
-        # 移除可能的data URI前缀
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
+    直接从图像文件的二进制数据解码为OpenCV图像 (不经过 base64)
+    np.frombuffer 零拷贝地包装传入的缓冲区；OpenCV 无法解码时回退到 Pillow (GIF / TIFF)
 
-        # 解码base64
-        image_data = base64.b64decode(base64_string)
+    Args:
+        data: 图像文件字节 (bytes / bytearray / memoryview)
 
+    Returns:
+        BGR 格式的图像，解码失败时返回 None
+    """
+    try:
         # 先尝试OpenCV解码
-        nparr = np.frombuffer(image_data, np.uint8)
+        nparr = np.frombuffer(data, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
         # ⚠️ 如果OpenCV失败：尝试Pillow (处理 GIF / TIFF / 其他格式)
         if image is None:
-            pil_image = Image.open(io.BytesIO(image_data))
+            # Pillow 只在 OpenCV 解码失败时才需要，按需导入
+            from PIL import Image
+
+            pil_image = Image.open(io.BytesIO(data))
 
             # 对于TIFF / GIF 等格式，统一转 RGB
             if pil_image.mode != 'RGB':
                 pil_image = pil_image.convert('RGB')
 
-            image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
 
             logger.info(f"🟢 使用 Pillow 成功解码 TIFF/GIF 图像, 尺寸: {image.shape}")
         else:
@@ -42,10 +43,62 @@ def base64_to_image(base64_string: str) -> Optional[np.ndarray]:
 
         return image
 
+    except Exception as e:
+        logger.error(f"❌ 图像解码失败: {str(e)}")
+        return None
+
+
+def base64_to_image(base64_string: str) -> Optional[np.ndarray]:
+    """
+    将base64字符串转换为OpenCV图像
+    (已升级：支持 GIF / TIFF)
+    """
+    try:
+        # 移除可能的data URI前缀
+        if ',' in base64_string:
+            base64_string = base64_string.split(',')[1]
+
+        # 解码base64
+        image_data = base64.b64decode(base64_string)
+
     except Exception as e:
         logger.error(f"❌ Base64转换失败: {str(e)}")
         return None
 
+    return bytes_to_image(image_data)
+
+
+def encode_image(image: np.ndarray, format: str = "png") -> Optional[bytes]:
+    """
+    将OpenCV图像编码为指定格式的二进制数据
+
+    Args:
+        image: OpenCV图像
+        format: 输出格式
+
+    Returns:
+        编码后的字节串，失败时返回 None
+    """
+    success, encoded_image = cv2.imencode(f'.{format}', image)
+    if not success:
+        logger.error("图像编码失败")
+        return None
+    return encoded_image.tobytes()
+
+
+def bytes_to_base64(data: bytes, format: str = "png") -> str:
+    """
+    将已编码的图像字节包装为 data URI 形式的 base64 字符串
+
+    Args:
+        data: 已编码的图像字节 (如 PNG)
+        format: 图像格式
+
+    Returns:
+        base64编码的字符串
+    """
+    base64_data = base64.b64encode(data).decode('utf-8')
+    return f"data:image/{format};base64,{base64_data}"
 
 
 def image_to_base64(image: np.ndarray, format: str = "png") -> str:
@@ -61,14 +114,12 @@ def image_to_base64(image: np.ndarray, format: str = "png") -> str:
     """
     try:
         # 编码图像
-        success, encoded_image = cv2.imencode(f'.{format}', image)
-        if not success:
-            logger.error("图像编码失败")
+        encoded = encode_image(image, format)
+        if encoded is None:
             return ""
 
         # 转换为base64
-        base64_data = base64.b64encode(encoded_image.tobytes()).decode('utf-8')
-        return f"data:image/{format};base64,{base64_data}"
+        return bytes_to_base64(encoded, format)
 
     except Exception as e:
         logger.error(f"图像转Base64失败: {str(e)}")
@@ -0,0 +1,72 @@
+"""
+掩码紧凑编码模块 (Mask Encodings)
+--------------------------------
+为分割掩码提供比 PNG-base64 更紧凑的表示：
+1. COCO 风格的非压缩 RLE：按列优先 (Fortran 顺序) 展平，counts 从「背景」游程开始。
+2. 位打包 (np.packbits)：按行优先展平，每 8 个像素占 1 个字节，再做 base64。
+所有函数均为向量化实现，不逐像素循环。
+"""
+import base64
+from typing import Any, Dict
+
+import numpy as np
+
+
+def mask_to_rle(mask: np.ndarray) -> Dict[str, Any]:
+    """
+    将二值掩码编码为 COCO 风格 RLE
+
+    Args:
+        mask: (H, W) 掩码，非零即前景
+
+    Returns:
+        {"size": [H, W], "counts": [背景游程, 前景游程, ...]}
+    """
+    height, width = mask.shape[:2]
+    flat = mask.ravel(order="F") > 0
+    if flat.size == 0:
+        return {"size": [height, width], "counts": []}
+
+    # 值发生变化的位置即游程边界
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(boundaries)
+
+    # COCO 约定第一个游程为背景 (0)，若首像素为前景则补一个长度为 0 的背景游程
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+
+    return {"size": [height, width], "counts": counts.tolist()}
+
+
+def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
+    """将 COCO 风格 RLE 还原为 uint8 掩码 (前景为 255)"""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.zeros(counts.size, dtype=np.uint8)
+    values[1::2] = 255
+    flat = np.repeat(values, counts)
+    return flat.reshape((height, width), order="F")
+
+
+def mask_to_packbits(mask: np.ndarray) -> Dict[str, Any]:
+    """
+    将二值掩码按位打包
+
+    Returns:
+        {"shape": [H, W], "bitorder": "big", "data": base64 字符串}
+    """
+    packed = np.packbits(mask > 0, axis=None)
+    return {
+        "shape": list(mask.shape[:2]),
+        "bitorder": "big",
+        "data": base64.b64encode(packed.tobytes()).decode("utf-8"),
+    }
+
+
+def packbits_to_mask(packed: Dict[str, Any]) -> np.ndarray:
+    """将位打包表示还原为 uint8 掩码 (前景为 255)"""
+    height, width = packed["shape"]
+    raw = np.frombuffer(base64.b64decode(packed["data"]), dtype=np.uint8)
+    bits = np.unpackbits(raw, count=height * width)
+    return (bits * 255).astype(np.uint8).reshape((height, width))
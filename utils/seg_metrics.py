@@ -0,0 +1,138 @@
+"""
+分割指标模块 (Segmentation Metrics)
+----------------------------------
+向量化的 NumPy 实现，用于比较两个二值掩码 (预测 vs 标注，或量化模型 vs fp32 模型)。
+ROC-AUC 基于概率直方图计算：每张图只需累加正/负像素在 AUC_BINS 个概率区间上的计数，
+因此可以逐张流式累积整个数据集 (StreamingSegMetrics)，内存占用与数据集大小无关。
+"""
+import math
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# ROC-AUC 概率直方图的区间数 (阈值分辨率 0.001)
+AUC_BINS = 1000
+
+
+def _as_bool(mask: np.ndarray) -> np.ndarray:
+    return mask if mask.dtype == np.bool_ else mask > 0
+
+
+def confusion_counts(pred: np.ndarray, target: np.ndarray) -> Dict[str, int]:
+    """统计 TP / FP / FN / TN 像素数"""
+    pred = _as_bool(pred)
+    target = _as_bool(target)
+    tp = int(np.count_nonzero(pred & target))
+    fp = int(np.count_nonzero(pred)) - tp
+    fn = int(np.count_nonzero(target)) - tp
+    tn = int(pred.size) - tp - fp - fn
+    return {"tp": tp, "fp": fp, "fn": fn, "tn": tn}
+
+
+def dice_score(pred: np.ndarray, target: np.ndarray) -> float:
+    """Dice = 2|A∩B| / (|A| + |B|)；两者都为空时记为 1"""
+    c = confusion_counts(pred, target)
+    denom = 2 * c["tp"] + c["fp"] + c["fn"]
+    return 2 * c["tp"] / denom if denom else 1.0
+
+
+def iou_score(pred: np.ndarray, target: np.ndarray) -> float:
+    """IoU = |A∩B| / |A∪B|；两者都为空时记为 1"""
+    c = confusion_counts(pred, target)
+    denom = c["tp"] + c["fp"] + c["fn"]
+    return c["tp"] / denom if denom else 1.0
+
+
+def rates(counts: Dict[str, int]) -> Dict[str, float]:
+    """由混淆计数计算 Dice / IoU / 敏感度 / 特异度；分母为 0 的敏感度与特异度记为 NaN"""
+    tp, fp, fn, tn = counts["tp"], counts["fp"], counts["fn"], counts["tn"]
+    dice_denom = 2 * tp + fp + fn
+    iou_denom = tp + fp + fn
+    return {
+        "dice": 2 * tp / dice_denom if dice_denom else 1.0,
+        "iou": tp / iou_denom if iou_denom else 1.0,
+        "sensitivity": tp / (tp + fn) if tp + fn else math.nan,
+        "specificity": tn / (tn + fp) if tn + fp else math.nan,
+    }
+
+
+def probability_histograms(probs: np.ndarray, target: np.ndarray,
+                           bins: int = AUC_BINS) -> Tuple[np.ndarray, np.ndarray]:
+    """按概率区间统计正 (血管) / 负 (背景) 像素数"""
+    idx = np.minimum((np.clip(probs, 0.0, 1.0) * bins).astype(np.int64), bins - 1).ravel()
+    positive = _as_bool(target).ravel()
+    pos_hist = np.bincount(idx[positive], minlength=bins)
+    neg_hist = np.bincount(idx[~positive], minlength=bins)
+    return pos_hist, neg_hist
+
+
+def auc_from_histograms(pos_hist: np.ndarray, neg_hist: np.ndarray) -> float:
+    """
+    从高到低扫描阈值得到 ROC 曲线，梯形积分求面积
+    同一区间内的像素视为同分 (对应 ROC 上的斜线段)；只有一类像素时返回 NaN。
+    """
+    tp = np.cumsum(pos_hist[::-1], dtype=np.float64)
+    fp = np.cumsum(neg_hist[::-1], dtype=np.float64)
+    if tp[-1] == 0 or fp[-1] == 0:
+        return math.nan
+    tpr = np.concatenate(([0.0], tp / tp[-1]))
+    fpr = np.concatenate(([0.0], fp / fp[-1]))
+    return float(np.sum((fpr[1:] - fpr[:-1]) * (tpr[1:] + tpr[:-1]) * 0.5))
+
+
+def roc_auc(probs: np.ndarray, target: np.ndarray, bins: int = AUC_BINS) -> float:
+    return auc_from_histograms(*probability_histograms(probs, target, bins))
+
+
+class StreamingSegMetrics:
+    """
+    流式分割指标累加器
+    update() 逐张输入概率图与标注，返回该图的指标；summary() 给出两种汇总：
+    - micro: 全数据集像素合并后计算 (大图权重更大)
+    - macro: 逐图指标的平均 (NaN 忽略)
+    """
+
+    METRICS = ("dice", "iou", "sensitivity", "specificity", "auc")
+
+    def __init__(self, threshold: float = 0.5, bins: int = AUC_BINS):
+        self.threshold = threshold
+        self.bins = bins
+        self.counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0}
+        self.pos_hist = np.zeros(bins, dtype=np.int64)
+        self.neg_hist = np.zeros(bins, dtype=np.int64)
+        self.per_image: Dict[str, List[float]] = {name: [] for name in self.METRICS}
+        self.images = 0
+
+    def update(self, probs: np.ndarray, target: np.ndarray) -> Dict[str, float]:
+        target = _as_bool(target)
+        counts = confusion_counts(probs > self.threshold, target)
+        pos_hist, neg_hist = probability_histograms(probs, target, self.bins)
+
+        for key, value in counts.items():
+            self.counts[key] += value
+        self.pos_hist += pos_hist
+        self.neg_hist += neg_hist
+        self.images += 1
+
+        metrics = rates(counts)
+        metrics["auc"] = auc_from_histograms(pos_hist, neg_hist)
+        for name in self.METRICS:
+            self.per_image[name].append(metrics[name])
+        return metrics
+
+    def summary(self) -> Dict[str, Any]:
+        micro = rates(self.counts)
+        micro["auc"] = auc_from_histograms(self.pos_hist, self.neg_hist)
+        macro = {}
+        for name, values in self.per_image.items():
+            arr = np.asarray(values, dtype=np.float64)
+            valid = arr[~np.isnan(arr)]
+            macro[name] = float(valid.mean()) if valid.size else math.nan
+            macro[f"{name}_std"] = float(valid.std()) if valid.size else math.nan
+        return {
+            "images": self.images,
+            "threshold": self.threshold,
+            "pixels": dict(self.counts),
+            "micro": micro,
+            "macro": macro,
+        }